@@ -24,9 +24,88 @@ import sys
 import numpy as np
 import nibabel as nib
 import nibabel.nifti1 as nii
+from nibabel.openers import ImageOpener
 
 import pv_parser as par
 
+class FrameData:
+    """
+    2dseq data read on demand from a memory map (NiBabel array proxy)
+
+    The slope/offset mapping is applied per frame (3D volume), so writing a
+    NIfTI file needs the memory of one frame only.
+    """
+
+    is_proxy = True
+
+    def __init__(self, data, slope=None, offs=None, map_pv6=False):
+        self.data = data
+        self.slope = slope
+        self.offs = offs
+        self.map_pv6 = map_pv6
+        self.shape = data.shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.data.dtype if self.slope is None else np.dtype(np.float32)
+
+    def rollaxis(self, axis, start):
+        self.data = np.rollaxis(self.data, axis, start)
+        if self.slope is not None:
+            self.slope = np.rollaxis(self.slope, axis, start)
+            self.offs = np.rollaxis(self.offs, axis, start)
+        self.shape = self.data.shape
+
+    def squeeze(self):
+        axes = tuple(index for index, size in enumerate(self.data.shape) if size == 1)
+        self.data = np.squeeze(self.data, axis=axes)
+        if self.slope is not None:
+            self.slope = np.squeeze(self.slope, axis=axes)
+            self.offs = np.squeeze(self.offs, axis=axes)
+        self.shape = self.data.shape
+
+    def reshape(self, dims, order='F'):
+        # Only the dimensions after the third one can be combined (order 'F'),
+        # the frames stay the same
+        dims = tuple(int(x) for x in dims)
+        if (order != 'F') or (dims[:3] != self.data.shape[:3]) or (np.prod(dims) != np.prod(self.data.shape)):
+            sys.exit("The data dimensions %s cannot be changed to %s." % (self.data.shape, dims))
+        self.shape = dims
+        return self
+
+    def frame_indices(self):
+        # Indices of all frames in NIfTI order (first frame dimension fastest)
+        for index in np.ndindex(*self.data.shape[:2:-1]):
+            yield (Ellipsis,) + index[::-1]
+
+    def frames(self):
+        for index in self.frame_indices():
+            frame = self.data[index]
+            if self.slope is not None:
+                frame = frame.astype(np.float32)
+                if self.map_pv6:
+                    frame /= self.slope[index]
+                else:
+                    frame *= self.slope[index]
+                frame += self.offs[index]
+            yield frame
+
+    def __array__(self, dtype=None, copy=None):
+        array = np.empty(self.data.shape, dtype=self.dtype, order='F')
+        for index, frame in zip(self.frame_indices(), self.frames()):
+            array[index] = frame
+        array = array.reshape(self.shape, order='F')
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
+
+    def __getitem__(self, key):
+        return np.asarray(self)[key]
+
 class ParaVision:
     """
     Read ParaVision data and save as NIfTI file
@@ -158,12 +237,13 @@ class ParaVision:
         return (voxel_dims, voxel_unit)
 
     def __map_data(self, data, map_pv6):
+        # The mapping is applied when the frames are read (see FrameData)
         VisuCoreExtent = self.visu_pars.get('VisuCoreExtent')
         VisuCoreDataOffs = self.visu_pars.get('VisuCoreDataOffs')
         VisuCoreDataSlope = self.visu_pars.get('VisuCoreDataSlope')
 
         n = min(len(VisuCoreExtent), 3)
-        dims = data.shape[n:]
+        dims = [1] * n + list(data.shape[n:])
 
         if VisuCoreDataOffs.size > 1:
             VisuCoreDataOffs = VisuCoreDataOffs.reshape(dims, order='F').astype(np.float32)
@@ -175,14 +255,23 @@ class ParaVision:
         else:
             VisuCoreDataSlope = np.float32(VisuCoreDataSlope[0])
 
-        if map_pv6:
-            data = data.astype(np.float32) / VisuCoreDataSlope
-            data = data + VisuCoreDataOffs
-        else:
-            data = data.astype(np.float32) * VisuCoreDataSlope
-            data = data + VisuCoreDataOffs
+        VisuCoreDataOffs = np.broadcast_to(VisuCoreDataOffs, data.shape)
+        VisuCoreDataSlope = np.broadcast_to(VisuCoreDataSlope, data.shape)
 
-        return (data, 'float32')
+        return (FrameData(data, VisuCoreDataSlope, VisuCoreDataOffs, map_pv6), 'float32')
+
+    def __write_nifti(self, fpath):
+        # Writes the NIfTI header and then the data frame by frame
+        self.nifti_image.update_header()
+        header = self.nifti_image.header
+        dtype = header.get_data_dtype()
+        header.set_slope_inter(1.0, 0.0)
+        with ImageOpener(fpath, 'wb') as fid:
+            header.write_to(fid)
+            fid.write(b'\0' * max(0, int(header.get_data_offset()) - fid.tell()))
+            for frame in self.nifti_image.dataobj.frames():
+                fid.write(frame.astype(dtype, copy=False).tobytes(order='F'))
+        self.nifti_image.set_filename(fpath)
 
     def __make_subfolder(self, subfolder=''):
         procfolder = os.path.join(self.procfolder, self.study)
@@ -227,18 +316,23 @@ class ParaVision:
         # Close text file
         fid.close()
 
-    def read_2dseq(self, map_raw=False, map_pv6=False, roll_fg=False, squeeze=False, compact=False, swap_vd=False, scale=1.0):
+    def read_header(self, roll_fg=False, squeeze=False, compact=False, swap_vd=False, scale=1.0):
+        # Data and voxel dimensions and the matrices (get_matrix) from the
+        # parameter files only, the 2dseq file is not opened
+        self.read_2dseq(roll_fg=roll_fg, squeeze=squeeze, compact=compact, swap_vd=swap_vd, scale=scale, header_only=True)
+
+    def read_2dseq(self, map_raw=False, map_pv6=False, roll_fg=False, squeeze=False, compact=False, swap_vd=False, scale=1.0, header_only=False):
         self.scale = float(scale)
 
         # Get acqp and method parameters
         datadir = os.path.join(self.rawfolder, self.study, str(self.expno))
-        _header, self.acqp = par.read_param_file(os.path.join(datadir, 'acqp'))
-        _header, self.method = par.read_param_file(os.path.join(datadir, 'method'))
+        _header, self.acqp = par.read_cached(os.path.join(datadir, 'acqp'), par.read_param_file, 'pv_parser.read_param_file')
+        _header, self.method = par.read_cached(os.path.join(datadir, 'method'), par.read_param_file, 'pv_parser.read_param_file')
 
         # Get visu_pars parameters
         datadir = os.path.join(self.rawfolder, self.study, str(self.expno), 'pdata', str(self.procno))
         #_header, self.d3proc = par.read_param_file(os.path.join(datadir, 'd3proc')) # Removed for PV6
-        header, self.visu_pars = par.read_param_file(os.path.join(datadir, 'visu_pars'))
+        header, self.visu_pars = par.read_cached(os.path.join(datadir, 'visu_pars'), par.read_param_file, 'pv_parser.read_param_file')
 
         self.__check_path(header['Path'])
 
@@ -255,25 +349,22 @@ class ParaVision:
         # Get data dimensions
         data_dims, data_type, dim_desc, fg_index, fg_slice = self.__get_data_dims()
 
-        # Open 2dseq file
+        # Open 2dseq file as memory map, the data is read when it is written
         path_2dseq = os.path.join(datadir, '2dseq')
-        try:
-            fid = open(path_2dseq, 'rb')
-        except IOError as V:
-            if V.errno == 2:
-                sys.exit("Cannot open 2dseq file %s" % (path_2dseq,))
-            else:
-                raise
-
-        # Read 2dseq file
-        data = np.fromfile(fid, dtype=np.dtype(data_type)).reshape(data_dims, order='F')
-
-        # Close 2dseq file
-        fid.close()
+        if header_only: # Placeholder array without memory, only its dimensions are used
+            data = np.broadcast_to(np.zeros((), dtype=np.dtype(data_type)), data_dims)
+        elif not os.path.isfile(path_2dseq):
+            sys.exit("Cannot open 2dseq file %s" % (path_2dseq,))
+        elif os.path.getsize(path_2dseq) != np.prod(data_dims) * np.dtype(data_type).itemsize:
+            sys.exit("The size of the 2dseq file %s does not match the data dimensions %s." % (path_2dseq, data_dims))
+        else:
+            data = np.memmap(path_2dseq, dtype=np.dtype(data_type), mode='r', shape=tuple(data_dims), order='F')
 
         # Map to raw data range
-        if map_raw:
+        if map_raw and not header_only:
             data, data_type = self.__map_data(data, map_pv6)
+        else:
+            data = FrameData(data)
 
         # Move FrameGroup FG_SLICE axis to position 2
         self.roll_fg = False
@@ -282,7 +373,7 @@ class ParaVision:
                 print("Warning: Could not find FrameGroup.", file=sys.stderr)
             elif fg_index > 2:
                 print("Warning: Move axis %d (FrameGroup %s) to position %d." % (fg_index, fg_slice, 2), file=sys.stderr)
-                data = np.rollaxis(data, fg_index, 2)
+                data.rollaxis(fg_index, 2)
                 data_dims = list(data.shape)
                 self.roll_fg = True
             else:
@@ -290,14 +381,14 @@ class ParaVision:
 
         # Remove data dimensions of size 1
         if squeeze and (1 in data_dims):
-            data = np.squeeze(data)
+            data.squeeze()
             data_dims = list(data.shape)
 
         # Reduce data dimensions to 4
         if compact and (len(data_dims) > 4):
             nt = int(np.prod(data_dims[3:]))
             data_dims[3:] = [nt]
-            data = data.reshape(data_dims, order='F')
+            data.reshape(data_dims, order='F')
 
         # Get voxel dimensions
         voxel_dims, voxel_unit = self.__get_voxel_dims(data_dims, scale=self.scale)
@@ -320,6 +411,10 @@ class ParaVision:
         self.voxel_dims = voxel_dims
         self.voxel_unit = voxel_unit
 
+        if header_only:
+            self.nifti_image = None
+            return
+
         # NIfTI image
         self.nifti_image = nii.Nifti1Image(data.reshape(data_dims, order='F'), None)
 
@@ -349,7 +444,10 @@ class ParaVision:
         fpath = os.path.join(fproc, fname)
 
         # Write NIfTI file
-        nib.save(self.nifti_image, fpath)
+        if ext == 'img':
+            nib.save(self.nifti_image, fpath)
+        else:
+            self.__write_nifti(fpath)
         #self.nifti_image.to_filename(fpath)
         print(self.nifti_image.get_filename())
 
@@ -8,15 +8,21 @@ University Hospital Cologne
 
 """
 import os
+import sys
+import mmap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from math import *
 from lmfit import  Minimizer, Parameters
 import matplotlib.pyplot as plt
 import nibabel as nii
 import numpy as np
-import progressbar
 
 
 from ReferenceMethods import brummerSNR, changSNR, sijbersSNR
+from pv_parseBruker_md_np import parsePV
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import niiWriter
 
 plt.interactive(False)
 
@@ -75,29 +81,12 @@ def t2_monoexp2(params, t, data):
 
 #def t2_fitmonoexp1 (T2, S0, Y0, T2bn, T2pe, img, snr, snrlim, nx, ny, slc, te, start, pinfo, FIXOFFSE):
 #(slice, echoTime, model, curSnrMap, snrLim, slc)
-def t2_fitmonoexp1(slice,te,snrMap,snrLim, model,uplim):
-
-    dims = slice.shape
-    nx = dims[1]
-    ny = dims[0]
-
-    T2 = np.zeros([nx,ny],dtype='int8') #Temporary store T2 map
-    S0 = np.zeros([nx,ny],dtype='int8') #Temporary store S0 map
-
+def t2_fitmonoexp1(voxels,te, model,uplim):
 
     # // FITTING PROCEDURE //
-    bar = progressbar.ProgressBar()
-    for i in bar(range(nx)):
-        for j in range(ny):
-            y = slice[i][j][:]
-            if np.mean(snrMap[i, j]) >= snrLim:
-                result=mpfitfun(y, te, model,uplim)
-                T2[i, j] = result['T2'].value
-                S0[i, j] = result['S0'].value
-        bar.update(i)
-    allResult = {'T2': T2, 'S0': S0, 'SNR': snrMap}
-    #plt.imshow(T2, cmap='gray')
-    return allResult
+    # the voxels of the fit mask (voxels x echoes) are fitted at once, the
+    # log-linear estimate as start values saves about half of the iterations
+    return mpfitbatch(voxels, te, model, uplim, start=t2_loglinear(voxels, te, uplim))
 
 ###############################################################################
 # t2_fitmonoexp2
@@ -108,119 +97,240 @@ def t2_fitmonoexp1(slice,te,snrMap,snrLim, model,uplim):
 ###############################################################################
 
 #def t2_fitmonoexp2 (T2, S0, T2bn, T2pe, slice, snr, snrlim, nx, ny, slc, te, start, pinfo):
-def t2_fitmonoexp2(slice,te,snrMap,snrLim, model,uplim):
+def t2_fitmonoexp2(voxels,te, model,uplim):
 
-    dims = slice.shape
-    nx = dims[1]
-    ny = dims[0]
+    # // FITTING PROCEDURE //
+    # start values of the decay above the last echo, which starts Y0
+    voxels = np.asarray(voxels, dtype=np.float64)
+    return mpfitbatch(voxels, te, model, uplim, start=t2_loglinear(voxels - voxels[:, -1:], te, 70))
 
-    T2 = np.zeros([nx, ny],dtype='int8')  # Temporary store T2 map
-    S0 = np.zeros([nx, ny],dtype='int8')  # Temporary store S0 map
-    Y0 = np.zeros([nx, ny],dtype='int8')  # Temporary storeY0 map
 
-    # // FITTING PROCEDURE //
-    bar = progressbar.ProgressBar()
-    for i in bar(range(nx)):
-        for j in range(ny):
-            y = slice[i][j][:]
-            if np.mean(snrMap[i, j]) >= snrLim:
-                result = mpfitfun(y, te, model, uplim)
-                T2[i, j] = result['T2'].value
-                S0[i, j] = result['S0'].value
-                Y0[i, j] = result['Y0'].value
-        bar.update(i)
-    allResult = {'T2': T2, 'S0': S0, 'Y0': Y0, 'SNR': snrMap}
-    #plt.imshow(T2, cmap='gray')
-    return allResult
+###############################################################################
+# t2_dictionary
+#
+# Dictionary matching: decay curves exp(-TE / T2) on a grid of T2 values are
+# compared with the measured curves, the best match gives T2
+###############################################################################
 
+# dictionaries of the echo time sets and grids used so far
+dictionary_cache = {}
+
+def t2_dictionary(te, uplim, step, offset):
+    """
+    # Returns the T2 grid (step, 2 * step, ... uplim ms) and the normalized decay
+    # curves of its values (grid points x echoes). With offset (model T2_3p) the
+    # curves are centred, so the match does not depend on the offset Y0. Each
+    # dictionary is calculated once per set of echo times.
+    """
+    if not step > 0:
+        sys.exit("Error: The step of the T2 dictionary must be positive.")
+    key = (tuple(np.asarray(te, dtype=np.float64)), float(uplim), float(step), bool(offset))
+    if key not in dictionary_cache:
+        x = np.asarray(te, dtype=np.float64)
+        grid = np.arange(step, uplim + step / 2, step)
+        atoms = np.exp(-x[None, :] / grid[:, None])
+        if offset:
+            atoms -= np.mean(atoms, axis=1, keepdims=True)
+        atoms /= np.linalg.norm(atoms, axis=1, keepdims=True)
+        dictionary_cache[key] = (grid, atoms.astype(np.float32))
+    return dictionary_cache[key]
+
+def t2_dictmatch(data, te, uplim, step, offset, chunk=65536):
+    """
+    # Matches the decay curves data (voxels x echoes) with the dictionary by
+    # their inner product with the normalized curves, one matrix product per
+    # chunk of voxels (a whole slice with the default chunk). S0 (and Y0 with
+    # offset) follow from a linear least squares fit with the matched T2.
+    """
+    y = np.asarray(data, dtype=np.float64).reshape(-1, len(te))
+    x = np.asarray(te, dtype=np.float64)
+    grid, atoms = t2_dictionary(te, uplim, step, offset)
+
+    yc = y - np.mean(y, axis=1, keepdims=True) if offset else y
+    index = np.empty(y.shape[0], dtype=int)
+    for start in range(0, y.shape[0], chunk):
+        index[start:start + chunk] = np.argmax(yc[start:start + chunk].astype(np.float32) @ atoms.T, axis=1)
+
+    T2 = grid[index]
+    e = np.exp(-x[None, :] / T2[:, None])
+    if offset:
+        ec = e - np.mean(e, axis=1, keepdims=True)
+        S0 = np.sum(ec * yc, axis=1) / np.sum(ec * ec, axis=1)
+        Y0 = np.mean(y, axis=1) - S0 * np.mean(e, axis=1)
+    else:
+        S0 = np.sum(e * y, axis=1) / np.sum(e * e, axis=1)
+        Y0 = np.zeros(y.shape[0])
+    return {'T2': T2, 'S0': S0, 'Y0': Y0}
 
 ###############################################################################
-# t2_mapping
+# t2_fitmask
 #
-# Main function for the T2 mapping project. Iterate over the slices
-# T2 maps are generated from Bruker ParaVision data.
-# Generate arrays to store data and call the fitting routines.
+# Voxels of a slice that are fitted, so the estimators only get the compact
+# list of these voxels and never see the background
 ###############################################################################
 
-def t2_mapping(data,echoTime, model, uplim, snrLim, SNRMethod):
+def t2_snrmap(slice, SNRMethod):
 
+    # Temporal map containing the snr values for the selected slice
+    if 'Chang' in SNRMethod:
+        curSnrMap, estStdSijbers, estStdSijbersNorm = changSNR.calcSNR(slice, 0, 1)
+    elif 'Brummer' in SNRMethod:
+        curSnrMap, estStdSijbers, estStdSijbersNorm = brummerSNR.calcSNR(slice, 0, 1)
+    elif 'Sijbers' in SNRMethod:
+        curSnrMap, estStdSijbers, estStdSijbersNorm = sijbersSNR.calcSNR(slice, 0, 1)
+    else:
+        sys.exit("Error: No valid SNR model.")
+    return curSnrMap
 
-    imgData = data.get_data()
+def t2_fitmask(snrMap, snrLim, brainMask=None):
+    """
+    # Voxels with a mean SNR over the echoes of at least snrLim and, if a brain
+    # mask of the slice is given, inside of it
+    """
+    mask = np.mean(snrMap, axis=2) >= snrLim
+    if brainMask is not None:
+        mask &= np.asarray(brainMask) > 0
+    return mask
 
+def t2_estimate(voxels, te, model, uplim, estimator='fit', dictStep=0.5):
+    """
+    # T2, S0, Y0, the sum of squared residuals chisqr, the coefficient of
+    # determination R2 and the convergence flag of the compact voxel list
+    # (voxels x echoes) with the selected estimator
+    """
+    if 'loglinear' in estimator:
+        result = t2_loglinear(voxels, te, uplim)
+        result['Y0'] = np.zeros(len(voxels))
+    elif 'dictionary' in estimator:
+        result = t2_dictmatch(voxels, te, uplim, dictStep, 'T2_3p' in model)
+    elif 'T2_2p' in model:
+        result = t2_fitmonoexp1(voxels, te, model, uplim)
+    else:
+        result = t2_fitmonoexp2(voxels, te, model, uplim)
+    if 'chisqr' not in result:
+        # sum of squared residuals, as the fit returns it
+        x = np.asarray(te, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            fit = result['S0'][:, None] * np.exp(-x / result['T2'][:, None]) + result['Y0'][:, None]
+            result['chisqr'] = np.sum(np.square(fit - voxels), axis=1)
+    if 'converged' not in result:
+        # the closed form estimates fail only without decay
+        result['converged'] = np.isfinite(result['T2']) & (result['T2'] > 0)
+    y = np.asarray(voxels, dtype=np.float64)
+    ssTot = np.sum(np.square(y - np.mean(y, axis=1, keepdims=True)), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R2 = 1 - result['chisqr'] / ssTot
+    result['R2'] = np.where(np.isfinite(R2), R2, 0)
+    return result
 
-    nx = imgData.shape[0] # Images size in x - direction
-    ny = imgData.shape[1] # Images size in y - direction
-    ns = imgData.shape[3] # Number of slices
+###############################################################################
+# t2_mapslice
+#
+# Fit of one slice into the parameter maps T2, S0, Y0, R2, converged (1 if
+# the fit converged) and SNR (of the first echo) of all slices. The slices are
+# independent, so t2_mapping can hand them to forked worker processes which
+# write into the maps in shared memory.
+###############################################################################
 
+mapNames = ('T2', 'S0', 'Y0', 'R2', 'converged', 'SNR')
 
-    if 'T2_2p' in model:
-         # Array to store the T2, S0 and Y0 maps
-         pvMaps = np.zeros([nx, ny, ns, 3],dtype=data.get_data_dtype())
+# arrays (data, maps, brain mask) of t2_mapping, set before its worker
+# processes are forked, so they inherit them instead of receiving copies
+shared_arrays = {}
 
+def t2_mapslice(slc, imgData, maps, echoTime, model, uplim, snrLim, SNRMethod, estimator, dictStep, brainMask):
+    #   Print % of progress
+    print('Slice: ' + str(slc + 1))
 
-         #Loop to go through all slices
-         for slc in range(ns):
-            #   Print % of progress
-            print('Slice: ' + str(slc + 1))
+    # Temporal image containing all TE values for the selected slice
+    slice = imgData[:, :, :, slc]
+    curSnrMap = t2_snrmap(slice, SNRMethod)
+    mask = t2_fitmask(curSnrMap, snrLim, None if brainMask is None else brainMask[:, :, slc])
 
-            # Temporal image containing all TE values for the selected slice
-            slice = imgData[:, :, :, slc]
+    # Fit only the voxels of the mask
+    if np.any(mask):
+        results = t2_estimate(slice[mask], echoTime, model, uplim, estimator, dictStep)
+        for index, name in enumerate(mapNames[:-1]):
+            maps[:, :, slc, index][mask] = results[name]
+    maps[:, :, slc, -1] = curSnrMap[:, :, 0]
 
+def t2_forkpool(workers):
+    # Pool of forked worker processes. Before Python 3.7 there is no
+    # mp_context, the workers are forked on all POSIX systems then.
+    if sys.version_info >= (3, 7):
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    return ProcessPoolExecutor(max_workers=workers)
 
-            # Temporal map containing the snr values for the selected slice
-            if 'Chang' in SNRMethod:
-                curSnrMap, estStdSijbers, estStdSijbersNorm = changSNR.calcSNR(slice, 0, 1)
-            elif 'Brummer' in SNRMethod:
-                curSnrMap, estStdSijbers, estStdSijbersNorm = brummerSNR.calcSNR(slice, 0, 1)
-            elif 'Sijbers' in SNRMethod:
-                curSnrMap, estStdSijbers, estStdSijbersNorm = sijbersSNR.calcSNR(slice, 0, 1)
-            else:
-                sys.exit("Error: No valid SNR model.")
+def t2_mapworker(slc, *args):
+    # t2_mapslice in a worker process, only the slice number and the
+    # parameters are sent to it and nothing but None is sent back
+    t2_mapslice(slc, shared_arrays['data'], shared_arrays['maps'], *args, shared_arrays['brainMask'])
 
-            # Fit the data of the single slice (model 1)
-            results = t2_fitmonoexp1(slice, echoTime, curSnrMap, snrLim, model, uplim)
 
-            # Store data of slice in final image
-            pvMaps[:, :, slc, 0] = results['T2']
-            pvMaps[:, :, slc, 1] = results['S0']
-            pvMaps[:, :, slc, 2] = results['SNR'][:, :, 0]
+###############################################################################
+# t2_mapping
+#
+# Main function for the T2 mapping project. Iterate over the slices
+# T2 maps are generated from Bruker ParaVision data.
+# Generate arrays to store data and call the fitting routines.
+###############################################################################
 
-    elif 'T2_3p' in model:
-        # Array to store the T2, S0 maps
-        pvMaps = np.zeros([nx, ny, ns, 4],dtype=data.get_data_dtype())
+def t2_mapping(data,echoTime, model, uplim, snrLim, SNRMethod, estimator='fit', dictStep=0.5, brainMask=None, workers=1):
 
-        # Loop to go through all slices
-        for slc in range(ns):
-            #   Print % of progress
-            print('Slice: ' + str(slc + 1) +'\n')
-
-            # Temporal image containing all TE values for the selected slice
-            slice = imgData[:, :, :, slc]
-
-            # Temporal map containing the snr values for the selected slice
-            if 'Chang' in SNRMethod:
-                curSnrMap, estStdSijbers, estStdSijbersNorm = changSNR.calcSNR(slice, 0, 1)
-            elif 'Brummer' in SNRMethod:
-                curSnrMap, estStdSijbers, estStdSijbersNorm = brummerSNR.calcSNR(slice, 0, 1)
-            elif 'Sijbers' in SNRMethod:
-                curSnrMap, estStdSijbers, estStdSijbersNorm = sijbersSNR.calcSNR(slice, 0, 1)
-            else:
-                sys.exit("Error: No valid SNR model.")
-
-            # Fit the data of the single slice (model 1)
-            results = t2_fitmonoexp2(slice, echoTime, curSnrMap, snrLim, model, uplim)
-
-            # Store data of slice in final image
-            pvMaps[:, :, slc, 0] = results['T2']
-            pvMaps[:, :, slc, 1] = results['S0']
-            pvMaps[:, :, slc, 2] = results['Y0']
-            pvMaps[:, :, slc, 3] = results['SNR'][:,:,0]
 
-    else:
+    imgData = np.asanyarray(data.dataobj)
+
+
+    nx = imgData.shape[0] # Images size in x - direction
+    ny = imgData.shape[1] # Images size in y - direction
+    ns = imgData.shape[3] # Number of slices
+
+    # fit: nonlinear fit of the model, loglinear: closed form estimate without
+    # offset Y0, dictionary: match with decay curves of a T2 grid with dictStep ms steps
+    if 'fit' not in estimator and 'loglinear' not in estimator and 'dictionary' not in estimator:
+        sys.exit("Error: No valid estimator.")
+    if brainMask is not None and np.shape(brainMask) != (nx, ny, ns):
+        sys.exit("Error: The brain mask does not match the slices of the data.")
+    # with workers > 1 the slices are fitted by as many processes
+    if workers < 1:
+        sys.exit("Error: The number of workers must be positive.")
+
+    if 'T2_2p' not in model and 'T2_3p' not in model:
         sys.exit("Error: No valid model.")
 
+    args = (echoTime, model, uplim, snrLim, SNRMethod, estimator, dictStep)
+    parallel = workers > 1 and ns > 1
+    if parallel and 'fork' not in multiprocessing.get_all_start_methods():
+        print('Notice: No worker processes can be forked here (e.g. Windows), the slices are fitted one after another.')
+        parallel = False
+    if parallel:
+        if 'dictionary' in estimator:
+            # calculated once here, the forked workers inherit the cache
+            t2_dictionary(echoTime, uplim, dictStep, 'T2_3p' in model)
+        # The workers inherit data and brain mask and write into the maps in an
+        # anonymous shared mapping, so neither slices nor maps are pickled
+        memory = mmap.mmap(-1, nx * ny * ns * len(mapNames) * np.dtype(np.float32).itemsize)
+        try:
+            shared = np.frombuffer(memory, dtype=np.float32).reshape((nx, ny, ns, len(mapNames)))
+            shared_arrays.update(data=imgData, maps=shared, brainMask=brainMask)
+            with t2_forkpool(min(workers, ns)) as pool:
+                for future in [pool.submit(t2_mapworker, slc, *args) for slc in range(ns)]:
+                    future.result()
+            maps = shared.copy()
+        finally:
+            # the mapping can only be closed without arrays on it
+            shared_arrays.clear()
+            shared = None
+            memory.close()
+    else:
+        maps = np.zeros([nx, ny, ns, len(mapNames)], dtype=np.float32)
+        #Loop to go through all slices
+        for slc in range(ns):
+            t2_mapslice(slc, imgData, maps, *args, brainMask)
 
-    return pvMaps
+
+    # float32 maps in the order of mapNames, Y0 is zero for T2_2p
+    return maps
 
 def mpfitfun(data,te,model,uplim):
 
@@ -246,82 +356,158 @@ def mpfitfun(data,te,model,uplim):
 
     return result.params
 
-def parsePV(filename):
+###############################################################################
+# mpfitbatch
+#
+# Fit of the mono-exponential models to many voxels at once: a Levenberg-
+# Marquardt solver on arrays of voxels. Start values, parameter bounds and the
+# bounds transformation (T2 = min + (sin(u) + 1) * (max - min) / 2) are those
+# of mpfitfun/lmfit, so both converge to the same minimum.
+###############################################################################
+
+def t2_batchmodel(p, te, upper):
+    """
+    # Model values (voxels x echoes) and Jacobian (voxels x echoes x parameters)
+    # of the internal parameters p = [u, S0] or [u, S0, Y0] of all voxels
     """
-    Parser for Bruker ParaVision parameter files in JCAMP-DX format
+    T2 = (np.sin(p[:, 0]) + 1) * upper / 2
+    dT2 = np.cos(p[:, 0]) * upper / 2
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore', under='ignore'):
+        e = np.exp(-te / T2[:, None])
+        model = p[:, 1, None] * e
+        jac = np.empty(model.shape + (p.shape[1],))
+        jac[:, :, 0] = model * te / np.square(T2[:, None]) * dT2[:, None]
+        jac[:, :, 1] = e
+    if p.shape[1] == 3:
+        model += p[:, 2, None]
+        jac[:, :, 2] = 1
+    return model, jac
+
+def mpfitbatch(data, te, model, uplim, start=None, maxiter=200, ftol=1.5e-8, xtol=1.5e-8):
     """
+    # mpfitbatch
+    #
+    # Fits the model 'T2_2p' or 'T2_3p' to the decay curves data (voxels x echoes)
+    # at the echo times te. start (optional) holds the start values T2 and S0 of
+    # all voxels, e.g. of t2_loglinear, instead of those of mpfitfun. Returns the
+    # arrays T2, S0, Y0 (zero for T2_2p), the sum of squared residuals chisqr,
+    # converged (False if maxiter was reached before the fit met ftol or xtol)
+    # and the number of iterations niter of all voxels.
+    """
+    y = np.asarray(data, dtype=np.float64).reshape(-1, len(te))
+    x = np.asarray(te, dtype=np.float64)
+    n = y.shape[0]
+
+    # start values as in mpfitfun, lmfit moves them into the bounds
+    upper = uplim if 'T2_2p' in model else 70
+    if start is None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            estT2 = (x[1]-x[0])/(np.log(y[:, 0])/np.log(y[:, 1]))
+        estS0 = y[:, 0]
+    else:
+        estT2 = np.asarray(start['T2'], dtype=np.float64).reshape(n)
+        estS0 = np.asarray(start['S0'], dtype=np.float64).reshape(n)
+    estT2 = np.clip(np.where(np.isfinite(estT2), estT2, upper / 2), 0, upper)
+    if 'T2_2p' in model:
+        p = np.column_stack((np.arcsin(2 * estT2 / upper - 1), estS0))
+    elif 'T2_3p' in model:
+        p = np.column_stack((np.arcsin(2 * estT2 / upper - 1), estS0, y[:, -1]))
+    else:
+        sys.exit("Error: No valid model.")
+
+    fit, jac = t2_batchmodel(p, x, upper)
+    res = fit - y
+    chisqr = np.sum(np.square(res), axis=1)
+    lam = np.full(n, 1e-3)
+    converged = np.zeros(n, dtype=bool)
+    niter = np.zeros(n, dtype=int)
+    active = np.arange(n)
+
+    for iteration in range(maxiter):
+        if active.size == 0:
+            break
+        # damped normal equations of the voxels still being fitted
+        J = jac[active]
+        A = np.einsum('nmi,nmj->nij', J, J)
+        g = np.einsum('nmi,nm->ni', J, res[active])
+        d = np.einsum('nii->ni', A)
+        d = np.maximum(d, 1e-12 * np.max(d, axis=1, keepdims=True) + 1e-300)
+        A[:, np.arange(p.shape[1]), np.arange(p.shape[1])] += lam[active, None] * d
+        with np.errstate(invalid='ignore', over='ignore'):
+            try:
+                step = -np.linalg.solve(A, g[:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError:
+                step = -np.einsum('nij,nj->ni', np.linalg.pinv(A), g)
+
+        niter[active] += 1
+        pNew = p[active] + step
+        fitNew, jacNew = t2_batchmodel(pNew, x, upper)
+        resNew = fitNew - y[active]
+        chisqrNew = np.sum(np.square(resNew), axis=1)
+
+        # accepted steps lower the damping, rejected ones raise it
+        old = chisqr[active]
+        better = chisqrNew < old
+        accepted = active[better]
+        p[accepted] = pNew[better]
+        jac[accepted] = jacNew[better]
+        res[accepted] = resNew[better]
+        chisqr[accepted] = chisqrNew[better]
+        lam[active] = np.where(better, lam[active] / 10, lam[active] * 10)
+
+        small = (np.abs(step) <= xtol * (np.abs(p[active]) + xtol)).all(axis=1)
+        done = better & (((old - chisqrNew) <= ftol * old) | small)
+        # no step along the gradient lowers the sum of squares any more
+        stuck = ~better & ((lam[active] > 1e16) | small)
+        converged[active[done]] = True
+        converged[active[stuck]] = np.isfinite(chisqr[active[stuck]])
+        active = active[~(done | stuck)]
+
+    result = {'T2': (np.sin(p[:, 0]) + 1) * upper / 2, 'S0': p[:, 1],
+              'Y0': p[:, 2] if p.shape[1] == 3 else np.zeros(n),
+              'chisqr': chisqr, 'converged': converged, 'niter': niter}
+    return result
+
+###############################################################################
+# t2_loglinear
+#
+# Closed form T2 estimate: weighted linear least squares fit of
+# ln(S) = ln(S0) - TE / T2
+###############################################################################
 
-    # Read file 'filename' -> list 'lines'
-    f = open(filename, 'r')
-    lines = f.readlines()
-    f.close()
-
-    # Dictionary for parameters
-    params = {}
-
-    # Get STUDYNAME, EXPNO, and PROCNO
-    #if filename[-9:] == 'visu_pars':
-    if 'visu_pars' in filename:
-        tmp = lines[6].split('/')
-        params['studyname'] = [[], tmp[-5]]
-        params['expno'] = [[], tmp[-4]]
-        params['procno'] = [[], tmp[-2]]
-
-    # Remove comment lines
-    remove = [] # Index list
-    for index, line in enumerate(lines): # Find lines
-        if line[0:2] == '$$':
-            remove.append(index)
-    for offset, index in enumerate(remove): # Remove lines
-        del lines[index-offset]
-
-    # Create list of LDR (Labelled Data Record) elements
-    lines = ''.join(lines).split('\n##') # Join lines and split into LDRs
-    #lines = map(rstrip, lines) # Remove trailing whitespace from each LDR
-    lines[0] = lines[0].lstrip('##') # Remove leading '##' from first LDR
-
-    # Combine LDR lines
-    for index, line in enumerate(lines):
-        lines[index] = ''.join(line.split('\n'))
-
-    # Fill parameter dictionary
-    for line in lines:
-        line = line.split('=', 1)
-        if line[0][0] == '$':
-            key = line[0].lstrip('$')
-            dataset = line[1]
-            params[key] = []
-            pos = 0
-            if (len(dataset) > 4) and (dataset[0:2] == '( '):
-                pos = dataset.find(' )', 2)
-                if pos > 2:
-                    pardim = [int(dim) for dim in dataset[2:pos].split(',')]
-                    params[key].append(pardim)
-                    params[key].append(dataset[pos+2:])
-            if pos <= 2:
-                params[key].append([])
-                params[key].append(dataset)
-
-    # Remove specific elements from parameter dictionary
-    if '$VisuCoreDataMin' in params: del params['$VisuCoreDataMin']
-    if '$VisuCoreDataMax' in params: del params['$VisuCoreDataMax']
-    if '$VisuCoreDataOffs' in params: del params['$VisuCoreDataOffs']
-    if '$VisuCoreDataSlope' in params: del params['$VisuCoreDataSlope']
-    if '$VisuAcqImagePhaseEncDir' in params: del params['$VisuAcqImagePhaseEncDir']
-
-    for key in params.keys():
-        pardim = params[key][0]
-        parval = params[key][1]
-        if (len(pardim) > 0) and (len(parval) > 0) and (parval[0] == '<'):
-            params[key][1] = parval.replace('<', '"').replace('>', '"')
-        elif (len(parval) > 0) and (parval[0] == '('):
-            params[key][1] = parval.replace('<', '"').replace('>', '"')
-        params[key] = params[key][1]
-
-    return params
-
-
-def getT2mapping(path,model,upLim,snrLim,SNRMethod,echoTime):
+def t2_loglinear(data, te, uplim):
+    """
+    # Log-linear T2 and S0 of the decay curves along the last axis of data (any
+    # number of voxels, e.g. a whole volume). Each echo is weighted with S^2, the
+    # inverse variance of ln(S); echoes without signal get no weight. The sums of
+    # the 2x2 normal equations of all voxels are one matrix product, which is then
+    # solved in closed form. T2 is limited to [0, uplim]; voxels without decay get
+    # uplim, voxels with less than two echoes with signal 0.
+    """
+    y = np.asarray(data, dtype=np.float64)
+    x = np.asarray(te, dtype=np.float64)
+
+    valid = y > 0
+    w = np.where(valid, np.square(y), 0)
+    wlog = w * np.log(np.where(valid, y, 1))
+    powers = np.stack((np.ones_like(x), x, x * x), axis=1)
+    sums = w @ powers
+    sumsLog = wlog @ powers[:, :2]
+    sw, swt, swtt = sums[..., 0], sums[..., 1], sums[..., 2]
+    swl, swtl = sumsLog[..., 0], sumsLog[..., 1]
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        det = sw * swtt - swt * swt
+        slope = (sw * swtl - swt * swl) / det
+        intercept = (swtt * swl - swt * swtl) / det
+        T2 = np.where(slope < 0, -1 / slope, uplim)
+        S0 = np.exp(intercept)
+    solved = np.isfinite(slope) & np.isfinite(intercept) & (det > 0)
+    T2 = np.where(solved, np.clip(T2, 0, uplim), 0)
+    S0 = np.where(solved & np.isfinite(S0), S0, 0)
+    return {'T2': T2, 'S0': S0}
+
+def getT2mapping(path,model,upLim,snrLim,SNRMethod,echoTime,estimator='fit',dictStep=0.5,brainMask=None,workers=1):
 
     data = nii.load(path)
     hdr = data.header
@@ -331,17 +517,21 @@ def getT2mapping(path,model,upLim,snrLim,SNRMethod,echoTime):
 
     print('Start to  fit '+model+'-Map over TE %s ...' % (echoTime,) )
 
+    # optional brain mask (NIfTI file in the voxel grid of the data), only
+    # voxels inside of it are fitted
+    if brainMask is not None:
+        brainMask = np.asarray(nii.load(brainMask).dataobj)
 
 
 
-    map = t2_mapping(data, echoTime, model=model, uplim=upLim, snrLim=snrLim, SNRMethod=SNRMethod)
+
+    maps = t2_mapping(data, echoTime, model=model, uplim=upLim, snrLim=snrLim, SNRMethod=SNRMethod, estimator=estimator, dictStep=dictStep, brainMask=brainMask, workers=workers)
     pathT2Map = os.path.split(path)[0]
-    map = map[:, :, :, 0] #delete this line if you want more outputdata
-    mapNii =  nii.as_closest_canonical(nii.Nifti1Image(map, data.affine))
+    # T2, S0, Y0, R2 and converged as volumes of one file, T2 is the first volume
+    maps = maps[:, :, :, :mapNames.index('SNR')]
+    mapNii =  nii.as_closest_canonical(nii.Nifti1Image(maps, data.affine))
     hdr = mapNii.header
     hdr.set_xyzt_units('mm')
+    hdr['descrip'] = ' '.join(mapNames[:mapNames.index('SNR')])
     study = os.path.split(path)[1].split('.')[0]
-    nii.save(mapNii, os.path.join(pathT2Map, (study+'T2Map'+model+'.nii.gz')))
-
-
-
+    niiWriter.save(mapNii, os.path.join(pathT2Map, (study+'T2Map'+model+'.nii.gz')))
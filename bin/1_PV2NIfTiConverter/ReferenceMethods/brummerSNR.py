@@ -34,6 +34,8 @@ def calcSNR(img,show,fac):
     imgNorm= imgFlat/maxi
     bins  = ceil(sqrt(imgNorm.size))*fac
     binCount, binLoc = np.histogram(imgNorm, int(bins))
+    # lower edges of the bins, one per count
+    binLoc = binLoc[0:len(binCount)]
 
 
 
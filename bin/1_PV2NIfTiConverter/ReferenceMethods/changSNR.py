@@ -32,7 +32,7 @@ def calcSNR(img,show,fac):
 
     img = img.astype(int)
     maxi =  img.max()
-    imgFlat = img.flatten(2)
+    imgFlat = img.flatten()
     imgNorm= imgFlat/maxi
     bins  = ceil(sqrt(imgNorm.size))*fac
     binCount, binLoc = np.histogram(imgNorm, int(bins))
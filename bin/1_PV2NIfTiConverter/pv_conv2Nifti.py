@@ -13,11 +13,16 @@ from __future__ import print_function
 
 import os
 import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import nibabel as nib
 import nibabel.nifti1 as nii
+from nibabel.openers import ImageOpener
 import pv_parseBruker_md_np as pB
 import P2_IDLt2_mapping as mapT2
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import niiWriter
 
 class Bruker2Nifti:
     def __init__(self, study, expno, procno, rawfolder, procfolder, ftype='NIFTI_GZ'):
@@ -47,29 +52,30 @@ class Bruker2Nifti:
         if hdr is None or not isinstance(hdr[12], str):
             return
 
-        # read '2dseq' file
-        f_id = open(os.path.join(datadir, '2dseq'), 'rb')
-        data = np.fromfile(f_id, dtype=np.dtype(hdr[12])).reshape(hdr[1], hdr[2], hdr[3], hdr[4], order='F')
-        f_id.close()
-
-        # map to raw data range (PV6)
+        # memory map of the '2dseq' file, it is read frame by frame when the NIfTI file is written
+        path2dseq = os.path.join(datadir, '2dseq')
+        dims = (hdr[1], hdr[2], hdr[3], hdr[4])
+        if os.path.getsize(path2dseq) != np.prod(dims) * np.dtype(hdr[12]).itemsize:
+            sys.exit("Error: The size of '%s' does not match the dimensions %s." % (path2dseq, dims))
+        data = np.memmap(path2dseq, dtype=np.dtype(hdr[12]), mode='r', shape=dims, order='F')
+        self.path2dseq = path2dseq
+
+        # map to raw data range (PV6), applied per frame in frames()
+        self.pv6 = pv6
+        self.slope = None
+        self.offs = None
         if map_raw:
-            visu_core_data_slope = np.array(map(float, self.visu_pars['VisuCoreDataSlope'].split()), dtype=np.float32)
-            visu_core_data_offs = np.array(map(float, self.visu_pars['VisuCoreDataOffs'].split()), dtype=np.float32)
-            visu_core_data_shape = list(data.shape)
-            visu_core_data_shape[:2] = (1, 1)
-            if pv6:
-                data = data / visu_core_data_slope.reshape(visu_core_data_shape)
-            else:
-                data = data * visu_core_data_slope.reshape(visu_core_data_shape)
-            data = data + visu_core_data_offs.reshape(visu_core_data_shape)
+            self.slope = np.array(self.visu_pars['VisuCoreDataSlope'].split(), dtype=np.float32).reshape(dims[2:], order='F')
+            self.offs = np.array(self.visu_pars['VisuCoreDataOffs'].split(), dtype=np.float32).reshape(dims[2:], order='F')
 
         # NIfTI image
         nim = nii.Nifti1Image(data, None)
+        if map_raw:
+            nim.header.set_data_dtype(np.float32)
 
         # NIfTI header
         #header = nim.header
-        header = nim.get_header()
+        header = nim.header
         #print("header:"); print(header)
         header['pixdim'] = [0.0, hdr[5], hdr[6], hdr[7], hdr[8], 0.0, 0.0, 0.0]
         #nim.setXYZUnit('mm')
@@ -91,30 +97,61 @@ class Bruker2Nifti:
         self.nim = nim
         self.xml = xml
 
+    def frames(self, dtype=None):
+        # The frames (2D images) of the 2dseq file in file order, which is also the
+        # order of the NIfTI data, as flat arrays of dtype (default: the data type of
+        # the NIfTI header). Each frame is mapped with its own VisuCoreDataSlope and
+        # VisuCoreDataOffs if requested. The same buffers are used for all frames, so
+        # only one frame is in memory and a yielded frame is only valid until the next.
+        data = self.nim.dataobj
+        if dtype is None:
+            dtype = self.nim.header.get_data_dtype()
+        frameSize = data.shape[0] * data.shape[1]
+        frame = np.empty(frameSize, dtype=data.dtype)
+        mapped = np.empty(frameSize, dtype=np.float32) if self.slope is not None else None
+        if self.slope is not None:
+            slope = self.slope.reshape(-1, order='F')
+            offs = self.offs.reshape(-1, order='F')
+        with open(self.path2dseq, 'rb') as f_id:
+            for index in range(data.shape[2] * data.shape[3]):
+                if f_id.readinto(frame.view(np.uint8)) != frame.nbytes:
+                    sys.exit("Error: '%s' ends before frame %d." % (self.path2dseq, index))
+                if self.slope is None:
+                    yield frame.astype(dtype, copy=False)
+                    continue
+                if self.pv6:
+                    np.divide(frame, slope[index], out=mapped)
+                else:
+                    np.multiply(frame, slope[index], out=mapped)
+                mapped += offs[index]
+                yield mapped.astype(dtype, copy=False)
+
+    def write_nifti(self, path):
+        # streams the 2dseq file into the NIfTI file: first the header, then the
+        # (mapped) data frame by frame, .nii.gz files compressed by several threads
+        self.nim.update_header()
+        header = self.nim.header
+        header.set_slope_inter(1.0, 0.0)
+        fileobj = niiWriter.GzipWriter(path) if path.endswith('.gz') else ImageOpener(path, 'wb')
+        with fileobj as f_id:
+            header.write_to(f_id)
+            f_id.write(b'\0' * max(0, int(header.get_data_offset()) - f_id.tell()))
+            for frame in self.frames():
+                f_id.write(frame)
+        self.nim.set_filename(path)
+
     def save_nifti(self, subfolder=''):
 
 
         procfolder = os.path.join(self.procfolder, self.study)
-        if not os.path.isdir(procfolder):
-            os.mkdir(procfolder)
-
-        if "Localizer" in self.acqp['ACQ_protocol_name']:
-            procfolder = os.path.join(self.procfolder, self.study, "Localizer")
-        elif "DTI" in self.acqp['ACQ_protocol_name'] or "Diffusion" in self.acqp['ACQ_protocol_name']:
-            procfolder = os.path.join(self.procfolder, self.study, "DTI")
-        elif "fMRI" in self.acqp['ACQ_protocol_name']:
-            procfolder = os.path.join(self.procfolder, self.study, "fMRI")
-        elif "Turbo" in self.acqp['ACQ_protocol_name']:
-            procfolder = os.path.join(self.procfolder, self.study, "T2w")
-        elif "MSME" in self.acqp['ACQ_protocol_name']:
-            procfolder = os.path.join(self.procfolder, self.study, "T2map")
-        else:
-            procfolder = os.path.join(self.procfolder, self.study, "Others")
+        os.makedirs(procfolder, exist_ok=True)
+
+        procfolder = os.path.join(self.procfolder, self.study, pB.classifyProtocol(self.acqp['ACQ_protocol_name']))
 
 
 
-        if not os.path.isdir(procfolder):
-            os.mkdir(procfolder)
+        # scans of a study may be converted in parallel
+        os.makedirs(procfolder, exist_ok=True)
 
         if self.ftype   == 'NIFTI_GZ': ext = 'nii.gz'
         elif self.ftype == 'NIFTI':    ext = 'nii'
@@ -128,18 +165,20 @@ class Bruker2Nifti:
         print(os.path.join(procfolder, fname))
         if not hasattr(self, 'nim'):
             return
-        nib.save(self.nim, os.path.join(procfolder, fname))
+        if ext == 'img':
+            data = np.concatenate([frame.copy() for frame in self.frames()]).reshape(self.nim.shape, order='F')
+            nib.save(nii.Nifti1Image(data, None, self.nim.header), os.path.join(procfolder, fname))
+        else:
+            self.write_nifti(os.path.join(procfolder, fname))
 
         return os.path.join(procfolder, fname)
 
     def save_table(self, subfolder=''):
         procfolder = os.path.join(self.procfolder, self.study)
-        if not os.path.isdir(procfolder):
-            os.mkdir(procfolder)
+        os.makedirs(procfolder, exist_ok=True)
 
         procfolder = os.path.join(self.procfolder, self.study, subfolder)
-        if not os.path.isdir(procfolder):
-            os.mkdir(procfolder)
+        os.makedirs(procfolder, exist_ok=True)
 
         #dw_bval_each = float(self.method['PVM_DwBvalEach'])
         if 'PVM_DwEffBval' in self.method:
@@ -210,6 +249,116 @@ class Bruker2Nifti:
                 fid.close()
 
 
+# protocol classes of pv_parseBruker_md_np.classifyProtocol (proc_data subfolders)
+protocolClasses = ['T2w', 'DTI', 'fMRI', 'T2map', 'Localizer', 'Others']
+
+def parseProtocols(protocols):
+    """Returns the list of protocol classes of a comma separated string, e.g. 'T2w,DTI,fMRI'."""
+    selection = [p.strip() for p in protocols.split(',') if p.strip() != '']
+    for protocol in selection:
+        if protocol not in protocolClasses:
+            sys.exit("Error: '%s' is no protocol class (%s)." % (protocol, ', '.join(protocolClasses)))
+    return selection
+
+def forkContext():
+    # Arguments of ProcessPoolExecutor for forked workers. mp_context exists
+    # since Python 3.7; before, the workers are forked on all POSIX systems.
+    if sys.version_info >= (3, 7) and 'fork' in multiprocessing.get_all_start_methods():
+        return {'mp_context': multiprocessing.get_context('fork')}
+    return {}
+
+def convertScan(input_folder, expno, model='T2_2p', upLim=100, snrLim=1.5, snrMethod='Brummer', map_raw=False, pv6=False, protocols=None, estimator='fit', dictStep=0.5, workers=1):
+    """Converts one scan (expno) of a ParaVision study folder and calculates its T2 map if it
+    is a multi echo scan. With protocols (list of protocol classes) the scan is classified from
+    its acqp first and skipped without reading 2dseq if its class is not in the list. The
+    slices of the T2 map are fitted by workers processes.
+    Returns the path of the NIfTI file (None if the scan has no 2dseq, is skipped or could not
+    be converted) and the coil name of the subject."""
+    procno ='1'
+    study=input_folder.split('/')[len(input_folder.split('/'))-1]
+    path = os.path.join(input_folder, expno, 'pdata', procno)
+    if not os.path.isdir(path):
+        sys.exit("Error: '%s' is not an existing directory." % (path,))
+
+    if protocols is not None:
+        acqp = pB.parsePV(os.path.join(input_folder, expno, 'acqp'))
+        protocol = pB.classifyProtocol(acqp['ACQ_protocol_name']) if 'ACQ_protocol_name' in acqp else 'Others'
+        if protocol not in protocols:
+            print('Scan %s (%s) is skipped.' % (expno, protocol))
+            return None, None
+
+    if not os.path.exists(os.path.join(path,'2dseq')):
+        print("The following file does not exist, it will be skipped:")
+        print(os.path.join(path,'2dseq'))
+        return None, None
+
+    img = Bruker2Nifti(study, expno, procno, os.path.split(input_folder)[0], input_folder, ftype='NIFTI_GZ')
+    img.read_2dseq(map_raw=map_raw, pv6=pv6)
+    resPath = img.save_nifti()
+    if resPath is None:
+        return None, img.subject['coilname']
+
+    if 'VisuAcqEchoTime' in img.visu_pars:
+
+        echoTime = img.visu_pars['VisuAcqEchoTime']
+        echoTime = np.array(echoTime.split(), dtype=float)
+        # the dictionary is simulated at the exact echo times of the method, if it
+        # lists all of them; the other estimators keep the echo times of the images
+        if estimator == 'dictionary' and 'EffectiveTE' in img.method:
+            effectiveTE = np.array(img.method['EffectiveTE'].split(), dtype=float)
+            if len(effectiveTE) == len(echoTime):
+                echoTime = effectiveTE
+        if len(echoTime) > 3:
+            mapT2.getT2mapping(resPath,model,upLim,snrLim,snrMethod,echoTime,estimator,dictStep,workers=workers)
+    return resPath, img.subject['coilname']
+
+def convertStudy(input_folder, model='T2_2p', upLim=100, snrLim=1.5, snrMethod='Brummer', map_raw=False, pv6=False, jobs=1, protocols=None, estimator='fit', dictStep=0.5, workers=1):
+    """Converts all numbered scans of a ParaVision study folder (input_folder) to NIfTI and
+    calculates the T2 maps of multi echo scans. With jobs > 1 the scans are converted in
+    parallel, with protocols (e.g. ['T2w', 'DTI']) only scans of these protocol classes are
+    converted. estimator ('fit', 'loglinear' or 'dictionary' with dictStep ms steps of its
+    T2 grid) selects how the T2 maps are calculated, workers is the number of processes
+    fitting the slices of a T2 map.
+    Returns the path of the last converted scan."""
+    # raw data folder
+    if not os.path.isdir(input_folder):
+        sys.exit("Error: '%s' is not an existing directory." % (input_folder,))
+
+    list = os.listdir(input_folder)
+    listOfScans = [s for s in list if s.isdigit()]
+
+    if len(listOfScans) == 0:
+        sys.exit("Error: '%s' contains no numbered scans." % (input_folder,))
+
+    print('Start to process '+str(len(listOfScans))+' scans...')
+    study=input_folder.split('/')[len(input_folder.split('/'))-1]
+    print(study)
+    scanArgs = (model, upLim, snrLim, snrMethod, map_raw, pv6, protocols, estimator, dictStep, workers)
+    expnos = [str(expno) for expno in np.sort(listOfScans)]
+    if jobs > 1:
+        # the worker processes are forked, so this module need not be importable by name
+        with ProcessPoolExecutor(max_workers=jobs, **forkContext()) as pool:
+            futures = [pool.submit(convertScan, input_folder, expno, *scanArgs) for expno in expnos]
+            results = [future.result() for future in futures]
+    else:
+        results = [convertScan(input_folder, expno, *scanArgs) for expno in expnos]
+
+    resPath = None
+    coilname = None
+    for scanPath, scanCoil in results:
+        if scanCoil is not None:
+            resPath = scanPath
+            coilname = scanCoil
+
+    if resPath is not None:
+        pathlog = os.path.dirname(os.path.dirname(resPath))
+        pathlog = os.path.join(pathlog, 'data.log')
+        logfile = open(pathlog, 'w')
+        logfile.write(coilname)
+        logfile.close()
+    return resPath
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -230,58 +379,17 @@ if __name__ == "__main__":
                         default=1.5)
     parser.add_argument('-k','--snrMethod', help='Brummer ,Chang, Sijbers', nargs='?', const='Brummer', type=str,
                         default='Brummer')
+    parser.add_argument('-e','--estimator', help='fit (default): nonlinear fit of the T2 model, loglinear: fast log-linear estimate without offset, '
+                                               'dictionary: match with decay curves of a T2 grid',
+                        nargs='?', const='fit', type=str, default='fit', choices=['fit', 'loglinear', 'dictionary'])
+    parser.add_argument('-d','--dictStep', help='T2 step of the dictionary in ms - default: 0.5', type=float, default=0.5)
     parser.add_argument('-m', '--map_raw', action='store_true', help='get the real values')
     parser.add_argument('-p', '--pv6', action='store_true', help='ParaVision 6')
     parser.add_argument('-t', '--table', action='store_true', help='save b-values and diffusion directions')
+    parser.add_argument('-j', '--jobs', help='number of scans converted in parallel - default: 1', type=int, default=1)
+    parser.add_argument('-w', '--workers', help='number of processes fitting the slices of a T2 map - default: 1', type=int, default=1)
+    parser.add_argument('--protocols', help='comma separated protocol classes to convert, e.g. T2w,DTI,fMRI,T2map - default: all (%s)' % (', '.join(protocolClasses),), type=str, default=None)
     args = parser.parse_args()
 
-    input_folder = None
-    # raw data folder
-    if args.input_folder is not None:
-        input_folder = args.input_folder
-    if not os.path.isdir(input_folder):
-        sys.exit("Error: '%s' is not an existing directory." % (input_folder,))
-
-
-
-    list = os.listdir(input_folder)
-    listOfScans = [s for s in list if s.isdigit()]
-
-    if len(listOfScans) is 0:
-        sys.exit("Error: '%s' contains no numbered scans." % (input_folder,))
-
-    print('Start to process '+str(len(listOfScans))+' scans...')
-    procno ='1'
-    study=input_folder.split('/')[len(input_folder.split('/'))-1]
-    print(study)
-    img = []
-    for expno in np.sort(listOfScans):
-        path = os.path.join(input_folder, expno, 'pdata', procno)
-        if not os.path.isdir(path):
-            sys.exit("Error: '%s' is not an existing directory." % (path,))
-
-        if os.path.exists(os.path.join(path,'2dseq')):
-
-            img = Bruker2Nifti(study, expno, procno, os.path.split(input_folder)[0], input_folder, ftype='NIFTI_GZ')
-            img.read_2dseq(map_raw=args.map_raw, pv6=args.pv6)
-            resPath = img.save_nifti()
-            if resPath is None: continue
-
-            if 'VisuAcqEchoTime' in img.visu_pars:
-
-                echoTime = img.visu_pars['VisuAcqEchoTime']
-                echoTime = np.fromstring(echoTime, dtype=float, sep=' ')
-                if len(echoTime) > 3:
-                    mapT2.getT2mapping(resPath,args.model,args.upLim,args.snrLim,args.snrMethod,echoTime)
-    
-        else: 
-            print("The following file does not exist, it will be skipped:")
-            print(os.path.join(path,'2dseq'))
-            continue
-    
-    if resPath is not None:
-        pathlog = os.path.dirname(os.path.dirname(resPath))
-        pathlog = os.path.join(pathlog, 'data.log')
-        logfile = open(pathlog, 'w')
-        logfile.write(img.subject['coilname'])
-        logfile.close()
+    protocols = parseProtocols(args.protocols) if args.protocols is not None else None
+    convertStudy(args.input_folder, args.model, args.upLim, args.snrLim, args.snrMethod, args.map_raw, args.pv6, args.jobs, protocols, args.estimator, args.dictStep, args.workers)
@@ -15,6 +15,7 @@ import os,sys
 import numpy as np
 
 from dict2xml import createXML
+from pv_parser import tokenize, read_cached
 
 
 # from string import split
@@ -22,6 +23,7 @@ from dict2xml import createXML
 def parsePV(filename):
     """
     Parser for Bruker ParaVision parameter files in JCAMP-DX format
+    (parsed once, then read from the parameter cache of pv_parser)
 
     Prarmeters:
     ===========
@@ -30,41 +32,32 @@ def parsePV(filename):
     if not os.path.exists(filename):
         return []
 
-    # Read file 'filename' -> list 'lines'
-    f = open(filename, 'r')
-    lines = f.readlines()
-    f.close()
+    return read_cached(filename, parsePVFile, 'pv_parseBruker_md_np.parsePVFile')
 
+def parsePVFile(filename):
     # Dictionary for parameters
     params = {}
 
+    # Create list of LDR (Labelled Data Record) elements in one pass, comment lines are skipped
+    lines = []
+    pathLine = ''
+    with open(filename, 'r') as f:
+        for index, line, data, comment in tokenize(f):
+            if data is not None:
+                lines.append(line[2:] + data)
+            elif index == 6:
+                pathLine = line
+
     # Get STUDYNAME, EXPNO, and PROCNO
     #if filename[-9:] == 'visu_pars':
     if 'visu_pars' in filename:
-        tmp = lines[6].split('/')
+        tmp = pathLine.split('/')
         params['studyname'] = [[], tmp[-5]]
         params['expno'] = [[], tmp[-4]]
         params['procno'] = [[], tmp[-2]]
 
-    # Remove comment lines
-    remove = [] # Index list
-    for index, line in enumerate(lines): # Find lines
-        if line[0:2] == '$$':
-            remove.append(index)
-    for offset, index in enumerate(remove): # Remove lines
-        del lines[index-offset]
-
-    # Create list of LDR (Labelled Data Record) elements
-    lines = ''.join(lines).split('\n##') # Join lines and split into LDRs
-    #lines = map(rstrip, lines) # Remove trailing whitespace from each LDR
-    lines[0] = lines[0].lstrip('##') # Remove leading '##' from first LDR
-
-    # Combine LDR lines
-    for index, line in enumerate(lines):
-        lines[index] = ''.join(line.split('\n'))
-
     # Fill parameter dictionary
-    if np.size(lines) == 1:
+    if len(lines) <= 1:
         sys.exit("Error: visu_pars is not readable")
 
     if 'subject' in filename:
@@ -107,6 +100,24 @@ def parsePV(filename):
 
     return params
 
+def classifyProtocol(protocolName):
+    """
+    Returns the proc_data subfolder of a scan (Localizer, DTI, fMRI, T2w,
+    T2map or Others) from its ACQ_protocol_name
+    """
+    if "Localizer" in protocolName:
+        return "Localizer"
+    elif "DTI" in protocolName or "Diffusion" in protocolName:
+        return "DTI"
+    elif "fMRI" in protocolName:
+        return "fMRI"
+    elif "Turbo" in protocolName:
+        return "T2w"
+    elif "MSME" in protocolName:
+        return "T2map"
+    else:
+        return "Others"
+
 def getXML(filename, writeFile=False):
     """
     Writes header dictionary to xml format
@@ -11,9 +11,13 @@ University Hospital Cologne
 
 import nipype.interfaces.fsl as fsl
 import os,sys
+import shutil
 import nibabel as nii
 import numpy as np
 import applyMICO
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import niiWriter
+from scratchSpace import makeScratchDir
 
 def applyBET(input_file,frac,radius,vertical_gradient):
     """Apply BET"""
@@ -34,17 +38,20 @@ def applyBET(input_file,frac,radius,vertical_gradient):
     scaledNiiData = nii.as_closest_canonical(scaledNiiData)
     print('Orientation:' + str(nii.aff2axcodes(scaledNiiData.affine)))
 
-    fslPath = os.path.join(os.getcwd(),'fslScaleTemp.nii.gz')
-    nii.save(scaledNiiData, fslPath)
+    scratch = makeScratchDir(os.path.basename(input_file).split('.')[0])
+    try:
+        fslPath = os.path.join(scratch, os.path.basename(input_file).split('.')[0] + '_fslScaleTemp.nii.gz')
+        niiWriter.save(scaledNiiData, fslPath, final=False)
 
-    # extract brain
-    output_file = os.path.join(os.path.dirname(input_file),os.path.basename(input_file).split('.')[0] + 'Bet.nii.gz')
+        # extract brain
+        output_file = os.path.join(os.path.dirname(input_file),os.path.basename(input_file).split('.')[0] + 'Bet.nii.gz')
 
-    myBet = fsl.BET(in_file=fslPath, out_file=output_file,frac=frac,radius=radius,
-                    vertical_gradient=vertical_gradient,robust=True, mask = True)
-    print(myBet.cmdline)
-    myBet.run()
-    os.remove(fslPath)
+        myBet = fsl.BET(in_file=fslPath, out_file=output_file,frac=frac,radius=radius,
+                        vertical_gradient=vertical_gradient,robust=True, mask = True)
+        print(myBet.cmdline)
+        myBet.run()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
 
     # unscale result data by factor 10ˆ(-1)
     dataOut = nii.load(output_file)
@@ -55,10 +62,40 @@ def applyBET(input_file,frac,radius,vertical_gradient):
     unscaledNiiData = nii.Nifti1Image(imgOut, dataOut.affine * scale)
     hdrOut = unscaledNiiData.header
     hdrOut.set_xyzt_units('mm')
-    nii.save(unscaledNiiData, output_file)
+    niiWriter.save(unscaledNiiData, output_file)
     return output_file
 
 
+def startPreprocessing(inputFile,frac=0.15,radius=45,vertical_gradient=0.0,bias_skip=0):
+    """Bias field correction (MICO) and brain extraction of a T2 dataset"""
+    if not os.path.exists(inputFile):
+        sys.exit("Error: '%s' is not an existing directory or file." % (inputFile,))
+
+    # 1) Process MRI
+    print("T2 Preprocessing  \33[5m...\33[0m (wait!)", end="\r")
+
+    # generate log - file
+    stdout = sys.stdout
+    sys.stdout = open(os.path.join(os.path.dirname(inputFile), 'preprocess.log'), 'w')
+    try:
+        # print parameters
+        print("Frac: %s" % frac)
+        print("Radius: %s" % radius)
+        print("Gradient: %s" %vertical_gradient)
+
+        #intensity correction using non parametric bias field correction algorithm
+        if bias_skip == 0:
+            outputMICO = applyMICO.run_MICO(inputFile,os.path.dirname(inputFile))
+        else:
+            outputMICO = inputFile
+        # get rid of your skull
+        outputBET = applyBET(input_file=outputMICO,frac=frac,radius=radius,vertical_gradient=vertical_gradient)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print('T2 Preprocessing  \033[0;30;42m COMPLETED \33[0m')
+    return outputBET
+
 if __name__ == "__main__":
     import argparse
 
@@ -80,46 +117,4 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    # set Parameters
-    inputFile = None
-    if args.inputFile is not None and args.inputFile is not None:
-        inputFile = args.inputFile
-    if not os.path.exists(inputFile):
-        sys.exit("Error: '%s' is not an existing directory or file %s is not in directory." % (inputFile, args.file,))
-
-    frac = args.frac
-    radius = args.radius
-    vertical_gradient = args.vertical_gradient
-    bias_skip = args.bias_skip
-
-    # 1) Process MRI
-    print("T2 Preprocessing  \33[5m...\33[0m (wait!)", end="\r")
-
-    # generate log - file
-    sys.stdout = open(os.path.join(os.path.dirname(inputFile), 'preprocess.log'), 'w')
-
-    # print parameters
-    print("Frac: %s" % frac)
-    print("Radius: %s" % radius)
-    print("Gradient: %s" %vertical_gradient)
-
-    #intensity correction using non parametric bias field correction algorithm
-    if bias_skip == 0:
-        outputMICO = applyMICO.run_MICO(inputFile,os.path.dirname(inputFile))
-    else:
-        outputMICO = inputFile
-    # get rid of your skull
-    outputBET = applyBET(input_file=outputMICO,frac=frac,radius=radius,vertical_gradient=vertical_gradient)
-
-    sys.stdout = sys.__stdout__
-    print('T2 Preprocessing  \033[0;30;42m COMPLETED \33[0m')
-
-
-
-
-
-
-
-
-
-
+    startPreprocessing(args.inputFile, args.frac, args.radius, args.vertical_gradient, args.bias_skip)
@@ -14,6 +14,9 @@ import numpy as np
 import nibabel as nii
 import glob
 
+# path of the AIDAmri lib folder
+libPath = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'lib'))
+
 def BET_2_MPIreg(inputVolume, stroke_mask,brain_template, allenBrain_template,allenBrain_anno,allenBrain_annorsfMRI,outfile,opt):
     output = os.path.join(outfile, os.path.basename(inputVolume).split('.')[0] + '_TemplateAff.nii.gz')
     outputCPPAff = os.path.join(outfile, os.path.basename(inputVolume).split('.')[0] + 'MatrixAff.txt')
@@ -101,6 +104,41 @@ def find_mask(inputVolume):
 
 
 
+def startRegistration(inputVolume, deformationStrength=3,
+                      brain_template=os.path.join(libPath, 'NP_template_sc0.nii.gz'),
+                      allenBrain_template=os.path.join(libPath, 'average_template_50.nii.gz'),
+                      allenBrain_anno=os.path.join(libPath, 'annotation_50CHANGEDanno.nii.gz'),
+                      allenBrain_annorsfMRI=os.path.join(libPath, 'annoVolume+2000_rsfMRI.nii.gz')):
+    """Registration of the Allen Brain atlas to the brain extracted T2 data (inputVolume)"""
+    for path in [inputVolume, allenBrain_template, allenBrain_anno, allenBrain_annorsfMRI, brain_template]:
+        if not os.path.exists(path):
+            sys.exit("Error: '%s' is not an existing directory." % (path,))
+
+    outfile = os.path.join(os.path.dirname(inputVolume))
+    if not os.path.exists(outfile):
+        os.makedirs(outfile)
+
+    stroke_mask = find_mask(inputVolume)
+    if len(stroke_mask) == 0:
+        stroke_mask = []
+        print("Notice: '%s' has no defined reference (stroke) mask - will proceed without." % (inputVolume,))
+    else:
+        stroke_mask = stroke_mask[0]
+
+    print("T2 Registration \33[5m...\33[0m (wait!)", end="\r")
+    # generate log - file
+    stdout = sys.stdout
+    sys.stdout = open(os.path.join(os.path.dirname(inputVolume), 'reg.log'), 'w')
+    try:
+        transInput = BET_2_MPIreg(inputVolume, stroke_mask,brain_template,allenBrain_template,allenBrain_anno,allenBrain_annorsfMRI,outfile,deformationStrength)
+        #result = ARA_2_input(transInput, allenBrain_template, allenBrain_anno ,outfile)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print('T2 Registration  \033[0;30;42m COMPLETED \33[0m')
+    return transInput
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -112,71 +150,16 @@ if __name__ == "__main__":
     parser.add_argument('-s', '--deformationStrength', help='integer: 1 - very strong deformation, 2 - strong deformation, 3 - medium deformation, 4 - weak deformation ', nargs='?', type=int,
                         default=3)
     parser.add_argument('-g', '--template', help='File: Templates for Allen Brain', nargs='?', type=str,
-                        default=os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/NP_template_sc0.nii.gz')
+                        default=os.path.join(libPath, 'NP_template_sc0.nii.gz'))
     parser.add_argument('-t','--allenBrain_template', help='File: Templates of Allen Brain', nargs='?', type=str,
-                        default=os.path.abspath(
-                            os.path.join(os.getcwd(), os.pardir, os.pardir)) + '/lib/average_template_50.nii.gz')
+                        default=os.path.join(libPath, 'average_template_50.nii.gz'))
     parser.add_argument('-a','--allenBrain_anno', help='File: Annotations of Allen Brain', nargs='?', type=str,
-                        default=os.path.abspath(
-                            os.path.join(os.getcwd(), os.pardir, os.pardir)) + '/lib/annotation_50CHANGEDanno.nii.gz')
+                        default=os.path.join(libPath, 'annotation_50CHANGEDanno.nii.gz'))
     parser.add_argument('-f', '--allenBrain_annorsfMRI', help='File: Annotations of Allen Brain', nargs='?',
                         type=str,
-                        default=os.path.abspath(
-                            os.path.join(os.getcwd(), os.pardir, os.pardir)) + '/lib/annoVolume+2000_rsfMRI.nii.gz')
+                        default=os.path.join(libPath, 'annoVolume+2000_rsfMRI.nii.gz'))
 
     args = parser.parse_args()
 
-    inputVolume = None
-    allenBrain_template = None
-    allenBrain_anno = None
-    brain_template = None
-    allenBrain_annorsfMRI = None
-    deformationStrength = args.deformationStrength
-
-    if args.inputVolume is not None:
-        inputVolume = args.inputVolume
-    if not os.path.exists(inputVolume):
-        sys.exit("Error: '%s' is not an existing directory." % (inputVolume,))
-
-    if args.allenBrain_template is not None:
-        allenBrain_template = args.allenBrain_template
-    if not os.path.exists(allenBrain_template):
-        sys.exit("Error: '%s' is not an existing directory." % (allenBrain_template,))
-
-    if args.allenBrain_anno is not None:
-        allenBrain_anno = args.allenBrain_anno
-    if not os.path.exists(allenBrain_anno):
-        sys.exit("Error: '%s' is not an existing directory." % (allenBrain_anno,))
-
-    if args.allenBrain_annorsfMRI is not None:
-        allenBrain_annorsfMRI = args.allenBrain_annorsfMRI
-    if not os.path.exists(allenBrain_annorsfMRI):
-        sys.exit("Error: '%s' is not an existing directory." % (allenBrain_annorsfMRI,))
-
-    if args.template is not None:
-        brain_template = args.template
-    if not os.path.exists(brain_template):
-        sys.exit("Error: '%s' is not an existing directory." % (brain_template,))
-
-
-    outfile = os.path.join(os.path.dirname(inputVolume))
-    if not os.path.exists(outfile):
-        os.makedirs(outfile)
-
-    stroke_mask = find_mask(inputVolume)
-    if len(stroke_mask) is 0:
-        stroke_mask = []
-        print("Notice: '%s' has no defined reference (stroke) mask - will proceed without." % (inputVolume,))
-    else:
-        stroke_mask = stroke_mask[0]
-
-    print("T2 Registration \33[5m...\33[0m (wait!)", end="\r")
-    # generate log - file
-    sys.stdout = open(os.path.join(os.path.dirname(inputVolume), 'reg.log'), 'w')
-
-    transInput = BET_2_MPIreg(inputVolume, stroke_mask,brain_template,allenBrain_template,allenBrain_anno,allenBrain_annorsfMRI,outfile,deformationStrength)
-    #result = ARA_2_input(transInput, allenBrain_template, allenBrain_anno ,outfile)
-    sys.stdout = sys.__stdout__
-    print('T2 Registration  \033[0;30;42m COMPLETED \33[0m')
-
-
+    startRegistration(args.inputVolume, args.deformationStrength, args.template, args.allenBrain_template,
+                      args.allenBrain_anno, args.allenBrain_annorsfMRI)
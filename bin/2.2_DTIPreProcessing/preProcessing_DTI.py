@@ -11,10 +11,14 @@ University Hospital Cologne
 
 import nipype.interfaces.fsl as fsl
 import os, sys
+import shutil
 import nibabel as nii
 import numpy as np
 import applyMICO
 import cv2
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import niiWriter
+from scratchSpace import makeScratchDir
 
 # 1) Process MRI
 def applyBET(input_file: str, frac: float, radius: int, output_path: str) -> str:
@@ -34,14 +38,17 @@ def applyBET(input_file: str, frac: float, radius: int, output_path: str) -> str
     scaledNiiData = nii.as_closest_canonical(scaledNiiData)
     print('Orientation:' + str(nii.aff2axcodes(scaledNiiData.affine)))
 
-    fsl_path = os.path.join(os.getcwd(),'fslScaleTemp.nii.gz')
-    nii.save(scaledNiiData, fsl_path)
+    scratch = makeScratchDir(os.path.basename(input_file).split('.')[0])
+    try:
+        fsl_path = os.path.join(scratch, os.path.basename(input_file).split('.')[0] + '_fslScaleTemp.nii.gz')
+        niiWriter.save(scaledNiiData, fsl_path, final=False)
 
-    # extract brain
-    output_file = os.path.join(output_path, os.path.basename(input_file).split('.')[0] + 'Bet.nii.gz')
-    myBet = fsl.BET(in_file=fsl_path, out_file=output_file,frac=frac,radius=radius,robust=True, mask = True)
-    myBet.run()
-    os.remove(fsl_path)
+        # extract brain
+        output_file = os.path.join(output_path, os.path.basename(input_file).split('.')[0] + 'Bet.nii.gz')
+        myBet = fsl.BET(in_file=fsl_path, out_file=output_file,frac=frac,radius=radius,robust=True, mask = True)
+        myBet.run()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
 
 
     # unscale result data by factor 10ˆ(-1)
@@ -53,7 +60,7 @@ def applyBET(input_file: str, frac: float, radius: int, output_path: str) -> str
     unscaledNiiData = nii.Nifti1Image(imgOut, dataOut.affine * scale)
     hdrOut = unscaledNiiData.header
     hdrOut.set_xyzt_units('mm')
-    nii.save(unscaledNiiData, output_file)
+    niiWriter.save(unscaledNiiData, output_file)
 
     print('Brain extraction DONE!')
     return output_file
@@ -72,7 +79,7 @@ def smoothIMG(input_file, output_path):
     hdrOut.set_xyzt_units('mm')
     output_file = os.path.join(os.path.dirname(input_file),
                                os.path.basename(input_file).split('.')[0] + 'DN.nii.gz')
-    nii.save(unscaledNiiData, output_file)
+    niiWriter.save(unscaledNiiData, output_file, final=False)
     input_file = output_file
     output_file = os.path.join(output_path, os.path.basename(input_file).split('.')[0] + 'Smooth.nii.gz')
     myGauss =  fsl.SpatialFilter(
@@ -103,64 +110,54 @@ def cropToSmall(input_file,output_path):
     return  output_file
 
 
-if __name__ == "__main__":
-    import argparse
-
-
-    parser = argparse.ArgumentParser(description='Preprocessing of DTI Data')
-
-    requiredNamed = parser.add_argument_group('required named arguments')
-    requiredNamed.add_argument('-i', '--input', help='Path to the raw NIfTI DTI file', required=True)
-
-    parser.add_argument('-f', '--frac', help='Fractional intensity threshold - default=0.3, smaller values give larger brain outline estimates', nargs='?', type=float,default=0.3)
-    parser.add_argument('-r', '--radius', help='Head radius (mm not voxels) - default=45', nargs='?', type=int ,default=45)
-    parser.add_argument('-g', '--vertical_gradient', help='Vertical gradient in fractional intensity threshold - default=0.0, positive values give larger brain outlines at bottom and smaller brain outlines at top', nargs='?',
-                        type=float,default=0.0)
-    args = parser.parse_args()
-
-    # set parameters
-    input_file = None
-    if args.input is not None and args.input is not None:
-        input_file = args.input
-
+def startPreprocessing(input_file, frac=0.3, radius=45, vertical_gradient=0.0):
+    """
+    Smoothing, bias field correction (MICO) and brain extraction of a raw NIfTI DTI file (input_file). Returns the path of the brain extracted file.
+    """
     if not os.path.exists(input_file):
-        sys.exit("Error: '%s' is not an existing directory or file %s is not in directory." % (input_file, args.file,))
-
-    frac = args.frac
-    radius = args.radius
-    vertical_gradient = args.vertical_gradient
+        sys.exit("Error: '%s' is not an existing directory or file." % (input_file,))
     output_path = os.path.dirname(input_file)
 
     # 1) Process DTI
     print("DTI Preprocessing  \33[5m...\33[0m (wait!)", end="\r")
 
     # generate log - file
+    stdout = sys.stdout
     sys.stdout = open(os.path.join(os.path.dirname(input_file), 'preprocess.log'), 'w')
-
-    # print parameters
-    print("Frac: %s" % frac)
-    print("Radius: %s" % radius)
-    print("Gradient: %s" % vertical_gradient)
-
-    # 1) Process MRI
-    print('Start Preprocessing ...')
-
-    output_smooth = smoothIMG(input_file = input_file, output_path = output_path)
-    # intensity correction using non parametric bias field correction algorithm
-    output_mico = applyMICO.run_MICO(output_smooth, output_path)
-
-    # get rid of your skull
-    outputBET = applyBET(input_file = output_mico, frac = frac, radius = radius, output_path = output_path)
-
-    sys.stdout = sys.__stdout__
+    try:
+        # print parameters
+        print("Frac: %s" % frac)
+        print("Radius: %s" % radius)
+        print("Gradient: %s" % vertical_gradient)
+
+        # 1) Process MRI
+        print('Start Preprocessing ...')
+
+        output_smooth = smoothIMG(input_file = input_file, output_path = output_path)
+        # intensity correction using non parametric bias field correction algorithm
+        output_mico = applyMICO.run_MICO(output_smooth, output_path)
+
+        # get rid of your skull
+        outputBET = applyBET(input_file = output_mico, frac = frac, radius = radius, output_path = output_path)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
     print('DTI Preprocessing  \033[0;30;42m COMPLETED \33[0m')
+    return outputBET
 
+if __name__ == "__main__":
+    import argparse
 
 
+    parser = argparse.ArgumentParser(description='Preprocessing of DTI Data')
 
+    requiredNamed = parser.add_argument_group('required named arguments')
+    requiredNamed.add_argument('-i', '--input', help='Path to the raw NIfTI DTI file', required=True)
 
+    parser.add_argument('-f', '--frac', help='Fractional intensity threshold - default=0.3, smaller values give larger brain outline estimates', nargs='?', type=float,default=0.3)
+    parser.add_argument('-r', '--radius', help='Head radius (mm not voxels) - default=45', nargs='?', type=int ,default=45)
+    parser.add_argument('-g', '--vertical_gradient', help='Vertical gradient in fractional intensity threshold - default=0.0, positive values give larger brain outlines at bottom and smaller brain outlines at top', nargs='?',
+                        type=float,default=0.0)
+    args = parser.parse_args()
 
-
-
-
-
+    startPreprocessing(args.input, args.frac, args.radius, args.vertical_gradient)
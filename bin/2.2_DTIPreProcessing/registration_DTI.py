@@ -26,6 +26,9 @@ import numpy as np
 import shutil
 import glob
 
+# path of the AIDAmri lib folder
+libPath = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'lib'))
+
 def regABA2DTI(inputVolume,stroke_mask,refStroke_mask,T2data, brain_template,brain_anno, splitAnno,splitAnno_rsfMRI,anno_rsfMRI,bsplineMatrix,outfile):
     outputT2w = os.path.join(outfile, os.path.basename(inputVolume).split('.')[0] + '_T2w.nii.gz')
     outputAff = os.path.join(outfile, os.path.basename(inputVolume).split('.')[0] + 'transMatrixAff.txt')
@@ -127,7 +130,7 @@ def regABA2DTI(inputVolume,stroke_mask,refStroke_mask,T2data, brain_template,bra
         hdrOut = unscaledNiiDataMask.header
         hdrOut.set_xyzt_units('mm')
         nii.save(unscaledNiiDataMask, outputMaskScaled)
-        src_file = os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/', 'ARA_annotationR+2000.nii.txt')
+        src_file = os.path.join(libPath, 'ARA_annotationR+2000.nii.txt')
         dst_file = os.path.join(outfileDSI, os.path.basename(inputVolume).split('.')[0] + 'StrokeMask_scaled.txt')#> removed '.nii.' ending to correct atlas implementation // VVF 23/05/10
         superPosAnnoStroke = np.flip(superPosAnnoStroke, 2)
         shutil.copyfile(src_file, dst_file)
@@ -161,7 +164,7 @@ def regABA2DTI(inputVolume,stroke_mask,refStroke_mask,T2data, brain_template,bra
         hdrOut = unscaledNiiDataMask.header
         hdrOut.set_xyzt_units('mm')
         nii.save(unscaledNiiDataMask, outputMaskScaled)
-        src_file = os.path.join(os.path.abspath(os.path.join(os.getcwd(),os.pardir,os.pardir))+'/lib/annoVolume+2000_rsfMRI.nii.txt') 
+        src_file = os.path.join(libPath, 'annoVolume+2000_rsfMRI.nii.txt') 
         dst_file = os.path.join(outfileDSI, os.path.basename(inputVolume).split('.')[0] + 'rsfMRI_Mask_scaled.txt') #> removed '.nii.' ending to correct atlas implementation // VVF 23/05/10
         superPosAnnoStroke = np.flip(superPosAnnoStroke, 2)
         shutil.copyfile(src_file, dst_file)
@@ -188,11 +191,11 @@ def regABA2DTI(inputVolume,stroke_mask,refStroke_mask,T2data, brain_template,bra
         0] + 'Anno_rsfMRISplit_scaled.nii')  #> removed '.gz' ending to correct atlas implementation // VVF 23/05/10
     outputAllenBScaled = os.path.join(outfileDSI, os.path.basename(inputVolume).split('.')[0] + 'Allen_scaled.nii') #> removed '.gz' ending to correct atlas implementation // VVF 23/05/10
 
-    src_file = os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/', 'ARA_annotationR+2000.nii.txt')
+    src_file = os.path.join(libPath, 'ARA_annotationR+2000.nii.txt')
     dst_file = os.path.join(outfileDSI, os.path.basename(inputVolume).split('.')[0] + 'Anno_scaled.txt') #> removed '.nii.' ending to correct atlas implementation // VVF 23/05/10
     shutil.copyfile(src_file, dst_file)
 
-    src_file = os.path.join(os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/', 'annoVolume+2000_rsfMRI.nii.txt')
+    src_file = os.path.join(libPath, 'annoVolume+2000_rsfMRI.nii.txt')
     dst_file = os.path.join(outfileDSI, os.path.basename(inputVolume).split('.')[0] + 'Anno_rsfMRISplit_scaled.txt') #> removed '.nii.' ending to correct atlas implementation // VVF 23/05/10
     shutil.copyfile(src_file, dst_file)
 
@@ -258,36 +261,12 @@ def find_relatedData(pathBase):
 
 
 
-if __name__ == "__main__":
-    import argparse
-
-    parser = argparse.ArgumentParser(description='Registration Allen Brain to DTI')
-    requiredNamed = parser.add_argument_group('required named arguments')
-    requiredNamed.add_argument('-i', '--inputVolume', help='Path to the BET file of DTI data after preprocessing',
-                               required=True)
-
-    parser.add_argument('-r', '--referenceDay', help='Reference Stroke mask (for example: P5)', nargs='?', type=str,
-                        default=None)
-    parser.add_argument('-s', '--splitAnno', help='Split annotations atlas', nargs='?', type=str,
-                        default=os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/ARA_annotationR+2000.nii.gz')
-    parser.add_argument('-f', '--splitAnno_rsfMRI', help='Split annotations atlas for rsfMRI/DTI', nargs='?', type=str,
-                        default=os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/annoVolume+2000_rsfMRI.nii.gz')
-    parser.add_argument('-a', '--anno_rsfMRI', help='Parental Annotations atlas for rsfMRI/DTI', nargs='?', type=str,
-                        default=os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/annoVolume.nii.gz')
-
-    args = parser.parse_args()
-
-
-
+def startRegistration(inputVolume, referenceDay=None,
+                      splitAnno=os.path.join(libPath, 'ARA_annotationR+2000.nii.gz'),
+                      splitAnno_rsfMRI=os.path.join(libPath, 'annoVolume+2000_rsfMRI.nii.gz'),
+                      anno_rsfMRI=os.path.join(libPath, 'annoVolume.nii.gz')):
+    """Registration of the Allen Brain atlas to the brain extracted DTI data (inputVolume) via the related T2 data"""
     stroke_mask = None
-    inputVolume = None
-    refStrokePath = None
-    splitAnno = None
-    splitAnno_rsfMRI = None
-    anno_rsfMRI = None
-
-    if args.inputVolume is not None:
-        inputVolume = args.inputVolume
     if not os.path.exists(inputVolume):
         sys.exit("Error: '%s' is not an existing directory." % (inputVolume,))
 
@@ -297,77 +276,80 @@ if __name__ == "__main__":
 
     print("DTI Registration  \33[5m...\33[0m (wait!)", end="\r")
     # generate log - file
+    stdout = sys.stdout
     sys.stdout = open(os.path.join(os.path.dirname(inputVolume), 'registration.log'), 'w')
+    try:
+        # find related  data
+        pathT2, pathStroke_mask, pathAnno, pathTemplate, bsplineMatrix = find_relatedData(os.path.dirname(outfile))
+        if len(pathT2) == 0:
+            sys.exit("Error: %s' has no reference T2 template." % (os.path.basename(inputVolume),))
+        else:
+            T2data = pathT2[0]
 
-
-    # find related  data
-    pathT2, pathStroke_mask, pathAnno, pathTemplate, bsplineMatrix = find_relatedData(os.path.dirname(outfile))
-    if len(pathT2) is 0:
-        T2data = []
-        sys.exit("Error: %s' has no reference T2 template." % (os.path.basename(inputVolume),))
-    else:
-        T2data = pathT2[0]
-
-    if len(pathStroke_mask) is 0:
-        pathStroke_mask = []
-        print("Notice: '%s' has no defined reference (stroke) mask - will proceed without." % (os.path.basename(inputVolume),))
-    else:
-        stroke_mask = pathStroke_mask[0]
-
-    if len(pathAnno) is 0:
-        pathAnno = []
-        sys.exit("Error: %s' has no reference annotations." % (os.path.basename(inputVolume),))
-    else:
-        brain_anno = pathAnno[0]
-
-    if len(pathTemplate) is 0:
-        pathTemplate = []
-        sys.exit("Error: %s' has no reference template." % (os.path.basename(inputVolume),))
-    else:
-        brain_template = pathTemplate[0]
-
-    if len(bsplineMatrix) is 0:
-        bsplineMatrix = []
-        sys.exit("Error: %s' has no bspline Matrix." % (os.path.basename(inputVolume),))
-    else:
-        bsplineMatrix = bsplineMatrix[0]
-
-
-    # finde reference stroke mask
-    refStroke_mask = None
-    if args.referenceDay is not None:
-        referenceDay = args.referenceDay
-        refStrokePath = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(outfile))), referenceDay)
-
-        if not os.path.exists(refStrokePath):
-            sys.exit("Error: '%s' is not an existing directory." % (refStrokePath,))
-        refStroke_mask = find_RefStroke(refStrokePath, inputVolume)
-        if len(refStroke_mask) is 0:
-            refStroke_mask = []
+        if len(pathStroke_mask) == 0:
             print("Notice: '%s' has no defined reference (stroke) mask - will proceed without." % (os.path.basename(inputVolume),))
         else:
-            refStroke_mask = refStroke_mask[0]
+            stroke_mask = pathStroke_mask[0]
 
-    if args.splitAnno is not None:
-        splitAnno = args.splitAnno
-    if not os.path.exists(splitAnno):
-        sys.exit("Error: '%s' is not an existing directory." % (splitAnno,))
+        if len(pathAnno) == 0:
+            sys.exit("Error: %s' has no reference annotations." % (os.path.basename(inputVolume),))
+        else:
+            brain_anno = pathAnno[0]
 
-    if args.splitAnno_rsfMRI is not None:
-        splitAnno_rsfMRI = args.splitAnno_rsfMRI
-    if not os.path.exists(splitAnno_rsfMRI):
-        sys.exit("Error: '%s' is not an existing directory." % (splitAnno_rsfMRI,))
+        if len(pathTemplate) == 0:
+            sys.exit("Error: %s' has no reference template." % (os.path.basename(inputVolume),))
+        else:
+            brain_template = pathTemplate[0]
 
-    if args.anno_rsfMRI is not None:
-        anno_rsfMRI = args.anno_rsfMRI
-    if not os.path.exists(anno_rsfMRI):
-        sys.exit("Error: '%s' is not an existing directory." % (anno_rsfMRI,))
+        if len(bsplineMatrix) == 0:
+            sys.exit("Error: %s' has no bspline Matrix." % (os.path.basename(inputVolume),))
+        else:
+            bsplineMatrix = bsplineMatrix[0]
+
+        # finde reference stroke mask
+        refStroke_mask = None
+        if referenceDay is not None:
+            refStrokePath = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(outfile))), referenceDay)
+
+            if not os.path.exists(refStrokePath):
+                sys.exit("Error: '%s' is not an existing directory." % (refStrokePath,))
+            refStroke_mask = find_RefStroke(refStrokePath, inputVolume)
+            if len(refStroke_mask) == 0:
+                refStroke_mask = []
+                print("Notice: '%s' has no defined reference (stroke) mask - will proceed without." % (os.path.basename(inputVolume),))
+            else:
+                refStroke_mask = refStroke_mask[0]
+
+        for path in [splitAnno, splitAnno_rsfMRI, anno_rsfMRI]:
+            if not os.path.exists(path):
+                sys.exit("Error: '%s' is not an existing directory." % (path,))
+
+        output = regABA2DTI(inputVolume, stroke_mask, refStroke_mask, T2data, brain_template, brain_anno, splitAnno,splitAnno_rsfMRI,anno_rsfMRI,bsplineMatrix,outfile)
+        print(output + '...DONE!')
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print('DTI Registration  \033[0;30;42m COMPLETED \33[0m')
+    return output
 
 
-    output = regABA2DTI(inputVolume, stroke_mask, refStroke_mask, T2data, brain_template, brain_anno, splitAnno,splitAnno_rsfMRI,anno_rsfMRI,bsplineMatrix,outfile)
-    print(output + '...DONE!')
-    sys.stdout = sys.__stdout__
-    print('DTI Registration  \033[0;30;42m COMPLETED \33[0m')
+if __name__ == "__main__":
+    import argparse
 
+    parser = argparse.ArgumentParser(description='Registration Allen Brain to DTI')
+    requiredNamed = parser.add_argument_group('required named arguments')
+    requiredNamed.add_argument('-i', '--inputVolume', help='Path to the BET file of DTI data after preprocessing',
+                               required=True)
 
+    parser.add_argument('-r', '--referenceDay', help='Reference Stroke mask (for example: P5)', nargs='?', type=str,
+                        default=None)
+    parser.add_argument('-s', '--splitAnno', help='Split annotations atlas', nargs='?', type=str,
+                        default=os.path.join(libPath, 'ARA_annotationR+2000.nii.gz'))
+    parser.add_argument('-f', '--splitAnno_rsfMRI', help='Split annotations atlas for rsfMRI/DTI', nargs='?', type=str,
+                        default=os.path.join(libPath, 'annoVolume+2000_rsfMRI.nii.gz'))
+    parser.add_argument('-a', '--anno_rsfMRI', help='Parental Annotations atlas for rsfMRI/DTI', nargs='?', type=str,
+                        default=os.path.join(libPath, 'annoVolume.nii.gz'))
+
+    args = parser.parse_args()
 
+    startRegistration(args.inputVolume, args.referenceDay, args.splitAnno, args.splitAnno_rsfMRI, args.anno_rsfMRI)
@@ -12,9 +12,13 @@ University Hospital Cologne
 
 import nipype.interfaces.fsl as fsl
 import os,sys
+import shutil
 import nibabel as nii
 import numpy as np
 import nipype.interfaces.ants as ants
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import niiWriter
+from scratchSpace import makeScratchDir
 
 
 # 1) Process MRI
@@ -34,14 +38,17 @@ def applyBET(input_file,frac,radius,outputPath):
     scaledNiiData = nii.as_closest_canonical(scaledNiiData)
     print('Orientation:' + str(nii.aff2axcodes(scaledNiiData.affine)))
 
-    fslPath = os.path.join(os.getcwd(),'fslScaleTemp.nii.gz')
-    nii.save(scaledNiiData, fslPath)
+    scratch = makeScratchDir(os.path.basename(input_file).split('.')[0])
+    try:
+        fslPath = os.path.join(scratch, os.path.basename(input_file).split('.')[0] + '_fslScaleTemp.nii.gz')
+        niiWriter.save(scaledNiiData, fslPath, final=False)
 
-    # extract brain
-    output_file = os.path.join(outputPath, os.path.basename(input_file).split('.')[0] + 'Bet.nii.gz')
-    myBet = fsl.BET(in_file=fslPath, out_file=output_file,frac=frac,radius=radius,robust=True, mask = True)
-    myBet.run()
-    os.remove(fslPath)
+        # extract brain
+        output_file = os.path.join(outputPath, os.path.basename(input_file).split('.')[0] + 'Bet.nii.gz')
+        myBet = fsl.BET(in_file=fslPath, out_file=output_file,frac=frac,radius=radius,robust=True, mask = True)
+        myBet.run()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
 
 
     # unscale result data by factor 10ˆ(-1)
@@ -53,7 +60,7 @@ def applyBET(input_file,frac,radius,outputPath):
     unscaledNiiData = nii.Nifti1Image(imgOut, dataOut.affine * scale)
     hdrOut = unscaledNiiData.header
     hdrOut.set_xyzt_units('mm')
-    nii.save(unscaledNiiData, output_file)
+    niiWriter.save(unscaledNiiData, output_file)
 
     print('Brain extraction DONE!')
     return output_file
@@ -67,6 +74,7 @@ def biasfieldcorr(input_file,outputPath):
     return output_file
 
 def smoothIMG(input_file,outputPath):
+    inputFile = input_file
     data = nii.load(input_file)
 
     vol = data.get_data()
@@ -78,7 +86,7 @@ def smoothIMG(input_file,outputPath):
     output_file = os.path.join(os.path.dirname(input_file),
                                os.path.basename(input_file).split('.')[0] + 'DN.nii.gz')
     # hdrOut['sform_code'] = 1
-    nii.save(unscaledNiiData, output_file)
+    niiWriter.save(unscaledNiiData, output_file, final=False)
     input_file = output_file
     #output_file =  os.path.join(os.path.dirname(input_file),os.path.basename(input_file).split('.')[0] + 'Smooth.nii.gz')
     output_file = os.path.join(outputPath, os.path.basename(inputFile).split('.')[0] + 'Smooth.nii.gz')
@@ -104,6 +112,38 @@ def cropToSmall(input_file,outputPath):
     return  output_file
 
 
+def startPreprocessing(inputFile,frac=0.15,radius=45,vertical_gradient=0.0):
+    """Smoothing and brain extraction of a raw rsfMRI NIfTI file"""
+    if not os.path.exists(inputFile):
+        sys.exit("Error: '%s' is not an existing directory or file." % (inputFile,))
+    outputPath = os.path.dirname(inputFile)
+
+    # 1) Process fMRI
+    print("rsfMRI Preprocessing  \33[5m...\33[0m (wait!)", end="\r")
+
+    # generate log - file
+    stdout = sys.stdout
+    sys.stdout = open(os.path.join(os.path.dirname(inputFile), 'preprocess.log'), 'w')
+    try:
+        # print parameters
+        print("Frac: %s" % frac)
+        print("Radius: %s" % radius)
+        print("Gradient: %s" % vertical_gradient)
+
+        # 1) Process MRI
+        print('Start Preprocessing ...')
+
+        outputSmooth = smoothIMG(input_file=inputFile,outputPath=outputPath)
+
+        # get rid of your skull
+        outputBET = applyBET(input_file=outputSmooth,frac=frac,radius=radius,outputPath=outputPath)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print('rsfMRI Preprocessing  \033[0;30;42m COMPLETED \33[0m')
+    return outputBET
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -121,47 +161,4 @@ if __name__ == "__main__":
                         type=float,default=0.0)
     args = parser.parse_args()
 
-    # set parameters
-    inputFile = None
-    if args.input is not None and args.input is not None:
-        inputFile = args.input
-
-    if not os.path.exists(inputFile):
-        sys.exit("Error: '%s' is not an existing directory or file %s is not in directory." % (inputFile, args.file,))
-
-    frac = args.frac
-    radius = args.radius
-    vertical_gradient = args.vertical_gradient
-    outputPath = os.path.dirname(inputFile)
-
-    # 1) Process fMRI
-    print("rsfMRI Preprocessing  \33[5m...\33[0m (wait!)", end="\r")
-
-    # generate log - file
-    sys.stdout = open(os.path.join(os.path.dirname(inputFile), 'preprocess.log'), 'w')
-
-    # print parameters
-    print("Frac: %s" % frac)
-    print("Radius: %s" % radius)
-    print("Gradient: %s" % vertical_gradient)
-
-    # 1) Process MRI
-    print('Start Preprocessing ...')
-
-    outputSmooth = smoothIMG(input_file=inputFile,outputPath=outputPath)
-
-    # get rid of your skull
-    outputBET = applyBET(input_file=outputSmooth,frac=frac,radius=radius,outputPath=outputPath)
-
-    sys.stdout = sys.__stdout__
-    print('rsfMRI Preprocessing  \033[0;30;42m COMPLETED \33[0m')
-
-
-
-
-
-
-
-
-
-
+    startPreprocessing(args.input, args.frac, args.radius, args.vertical_gradient)
@@ -12,6 +12,9 @@ import sys,os
 import glob
 import shutil as sh
 
+# path of the AIDAmri lib folder
+libPath = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'lib'))
+
 
 def regABA2rsfMRI(inputVolume, T2data, brain_template, brain_anno, splitAnno, splitAnno_rsfMRI, anno_rsfMRI,
                   bsplineMatrix, dref, outfile):
@@ -100,37 +103,11 @@ def find_relatedData(pathBase):
     return pathT2,pathStroke_mask,pathAnno,pathAllen,bsplineMatrix
 
 
-if __name__ == "__main__":
-    import argparse
-
-    parser = argparse.ArgumentParser(description='Registration of Allen Brain Atlas to rsfMRI')
-    requiredNamed = parser.add_argument_group('required named arguments')
-    requiredNamed.add_argument('-i', '--inputVolume', help='Path to rsfMRI data after preprocessing', required=True)
-    parser.add_argument('-d', '--dtiasRef', action='store_true', help='use DTI as reference if data quality is low')
-    parser.add_argument('-r', '--referenceDay', help='Reference Stroke mask', nargs='?', type=str,
-                        default=None)
-    parser.add_argument('-s', '--splitAnno', help='Split annotations atlas', nargs='?', type=str,
-                        default=os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/ARA_annotationR+2000.nii.gz')
-    parser.add_argument('-f', '--splitAnno_rsfMRI', help='Split annotations atlas for rsfMRI', nargs='?', type=str,
-                        default=os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/annoVolume+2000_rsfMRI.nii.gz')
-    parser.add_argument('-a', '--anno_rsfMRI', help='Annotations atlas for rsfMRI', nargs='?', type=str,
-                        default=os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/annoVolume.nii.gz')
-
-
-
-    args = parser.parse_args()
-
-
-
-    stroke_mask = None
-    inputVolume = None
-    refStrokePath = None
-    splitAnno = None
-    splitAnno_rsfMRI = None
-    anno_rsfMRI = None
-
-    if args.inputVolume is not None:
-        inputVolume = args.inputVolume
+def startRegistration(inputVolume, dtiasRef=False, referenceDay=None,
+                      splitAnno=os.path.join(libPath, 'ARA_annotationR+2000.nii.gz'),
+                      splitAnno_rsfMRI=os.path.join(libPath, 'annoVolume+2000_rsfMRI.nii.gz'),
+                      anno_rsfMRI=os.path.join(libPath, 'annoVolume.nii.gz')):
+    """Registration of the Allen Brain atlas to the preprocessed rsfMRI data (inputVolume) via the related T2 data"""
     if not os.path.exists(inputVolume):
         sys.exit("Error: '%s' is not an existing directory." % (inputVolume,))
 
@@ -140,77 +117,77 @@ if __name__ == "__main__":
 
     print("rsfMRI Registration  \33[5m...\33[0m (wait!)", end="\r")
     # generate log - file
+    stdout = sys.stdout
     sys.stdout = open(os.path.join(os.path.dirname(inputVolume), 'registration.log'), 'w')
+    try:
+        # find related  data
+        pathT2, pathStroke_mask, pathAnno, pathTemplate, bsplineMatrix = find_relatedData(os.path.dirname(outfile))
+        if len(pathT2) == 0:
+            sys.exit("Error: %s' has no reference T2 template." % (os.path.basename(inputVolume),))
+        else:
+            T2data = pathT2[0]
 
+        if len(pathStroke_mask) == 0:
+            print("Notice: '%s' has no defined reference (stroke) mask - will proceed without." % (os.path.basename(inputVolume),))
 
-    # find related  data
-    pathT2, pathStroke_mask, pathAnno, pathTemplate, bsplineMatrix = find_relatedData(os.path.dirname(outfile))
-    if len(pathT2) is 0:
-        T2data = []
-        sys.exit("Error: %s' has no reference T2 template." % (os.path.basename(inputVolume),))
-    else:
-        T2data = pathT2[0]
-
-    if len(pathStroke_mask) is 0:
-        pathStroke_mask = []
-        print("Notice: '%s' has no defined reference (stroke) mask - will proceed without." % (os.path.basename(inputVolume),))
-    else:
-        stroke_mask = pathStroke_mask[0]
+        if len(pathAnno) == 0:
+            sys.exit("Error: %s' has no reference annotations." % (os.path.basename(inputVolume),))
+        else:
+            brain_anno = pathAnno[0]
 
-    if len(pathAnno) is 0:
-        pathAnno = []
-        sys.exit("Error: %s' has no reference annotations." % (os.path.basename(inputVolume),))
-    else:
-        brain_anno = pathAnno[0]
+        if len(pathTemplate) == 0:
+            sys.exit("Error: %s' has no reference template." % (os.path.basename(inputVolume),))
+        else:
+            brain_template = pathTemplate[0]
 
-    if len(pathTemplate) is 0:
-        pathTemplate = []
-        sys.exit("Error: %s' has no reference template." % (os.path.basename(inputVolume),))
-    else:
-        brain_template = pathTemplate[0]
+        if len(bsplineMatrix) == 0:
+            sys.exit("Error: %s' has no bspline Matrix." % (os.path.basename(inputVolume),))
+        else:
+            bsplineMatrix = bsplineMatrix[0]
+
+        # find reference stroke mask
+        if referenceDay is not None:
+            refStrokePath = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(outfile))), referenceDay)
+
+            if not os.path.exists(refStrokePath):
+                sys.exit("Error: '%s' is not an existing directory." % (refStrokePath,))
+            refStroke_mask = find_RefStroke(refStrokePath, inputVolume)
+            if len(refStroke_mask) == 0:
+                print("Notice: '%s' has no defined reference (stroke) mask - will proceed without." % (os.path.basename(inputVolume),))
+
+        for path in [splitAnno, splitAnno_rsfMRI, anno_rsfMRI]:
+            if not os.path.exists(path):
+                sys.exit("Error: '%s' is not an existing directory." % (path,))
+
+        output = regABA2rsfMRI(inputVolume, T2data, brain_template, brain_anno, splitAnno, splitAnno_rsfMRI,
+                               anno_rsfMRI, bsplineMatrix, dtiasRef, outfile)
+        print(output + '...DONE!')
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print('rsfMRI Registration  \033[0;30;42m COMPLETED \33[0m')
+    return output
 
-    if len(bsplineMatrix) is 0:
-        bsplineMatrix = []
-        sys.exit("Error: %s' has no bspline Matrix." % (os.path.basename(inputVolume),))
-    else:
-        bsplineMatrix = bsplineMatrix[0]
 
+if __name__ == "__main__":
+    import argparse
 
-    # find reference stroke mask
-    refStroke_mask = None
-    if args.referenceDay is not None:
-        referenceDay = args.referenceDay
-        refStrokePath = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(outfile))), referenceDay)
+    parser = argparse.ArgumentParser(description='Registration of Allen Brain Atlas to rsfMRI')
+    requiredNamed = parser.add_argument_group('required named arguments')
+    requiredNamed.add_argument('-i', '--inputVolume', help='Path to rsfMRI data after preprocessing', required=True)
+    parser.add_argument('-d', '--dtiasRef', action='store_true', help='use DTI as reference if data quality is low')
+    parser.add_argument('-r', '--referenceDay', help='Reference Stroke mask', nargs='?', type=str,
+                        default=None)
+    parser.add_argument('-s', '--splitAnno', help='Split annotations atlas', nargs='?', type=str,
+                        default=os.path.join(libPath, 'ARA_annotationR+2000.nii.gz'))
+    parser.add_argument('-f', '--splitAnno_rsfMRI', help='Split annotations atlas for rsfMRI', nargs='?', type=str,
+                        default=os.path.join(libPath, 'annoVolume+2000_rsfMRI.nii.gz'))
+    parser.add_argument('-a', '--anno_rsfMRI', help='Annotations atlas for rsfMRI', nargs='?', type=str,
+                        default=os.path.join(libPath, 'annoVolume.nii.gz'))
 
-        if not os.path.exists(refStrokePath):
-            sys.exit("Error: '%s' is not an existing directory." % (refStrokePath,))
-        refStroke_mask = find_RefStroke(refStrokePath, inputVolume)
-        if len(refStroke_mask) is 0:
-            refStroke_mask = []
-            print("Notice: '%s' has no defined reference (stroke) mask - will proceed without." % (os.path.basename(inputVolume),))
-        else:
-            refStroke_mask = refStroke_mask[0]
-
-    if args.splitAnno is not None:
-        splitAnno = args.splitAnno
-    if not os.path.exists(splitAnno):
-        sys.exit("Error: '%s' is not an existing directory." % (splitAnno,))
-
-    if args.splitAnno_rsfMRI is not None:
-        splitAnno_rsfMRI = args.splitAnno_rsfMRI
-    if not os.path.exists(splitAnno_rsfMRI):
-        sys.exit("Error: '%s' is not an existing directory." % (splitAnno_rsfMRI,))
-
-    if args.anno_rsfMRI is not None:
-        anno_rsfMRI = args.anno_rsfMRI
-    if not os.path.exists(anno_rsfMRI):
-        sys.exit("Error: '%s' is not an existing directory." % (anno_rsfMRI,))
-
-    output = regABA2rsfMRI(inputVolume, T2data, brain_template, brain_anno, splitAnno, splitAnno_rsfMRI,
-                           anno_rsfMRI, bsplineMatrix, args.dtiasRef, outfile)
-    print(output + '...DONE!')
-    sys.stdout = sys.__stdout__
-    print('rsfMRI Registration  \033[0;30;42m COMPLETED \33[0m')
 
 
+    args = parser.parse_args()
 
+    startRegistration(args.inputVolume, args.dtiasRef, args.referenceDay, args.splitAnno, args.splitAnno_rsfMRI,
+                      args.anno_rsfMRI)
@@ -18,12 +18,15 @@ import numpy as np
 import scipy.io as sc
 import scipy.ndimage as ndimage
 
+# path of the AIDAmri lib folder
+libPath = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'lib'))
+
 
 def find_nearest(array,value):
     idx = (np.abs(array-value)).argmin()
     return array[idx]
 
-def thresholdingSlc(volumeMR,maskImg,thres):
+def thresholdingSlc(volumeMR,maskImg,thres,outfile):
     volumeMR=ndimage.gaussian_filter(volumeMR, sigma=(1.2, 1.2, 1))
 
     volumeMR = volumeMR * maskImg[:, :, :, 0]
@@ -140,7 +143,7 @@ def incidenceMap(path_listInc,path_listMR ,path_listAnno, araDataTemplate,incide
     strokeVolumeInCubicMM = np.sum(maskImg * (dataMR.affine[0, 0] * dataMR.affine[1, 1] * dataMR.affine[2, 2]))
     brainVolumeInCubicMM = np.sum(betMaskImg * (dataMR.affine[0, 0] * dataMR.affine[1, 1] * dataMR.affine[2, 2]))
 
-    lines =open(os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+ '/lib/annoVolume.nii.txt').readlines()
+    lines =open(os.path.join(libPath, 'annoVolume.nii.txt')).readlines()
     o=open(os.path.join(outfile, 'affectedRegions_Parental.txt'), 'w')
     o.write("Stroke: %0.2f %% - Stroke Volume: %0.2f mm^3\n"  % (((strokeVolumeInCubicMM/brainVolumeInCubicMM)*100),strokeVolumeInCubicMM,))
     matIndex = 0
@@ -202,43 +205,15 @@ def findRegisteredAnno(path):
 
     return regANNO_list
 
-if __name__ == "__main__":
-    import argparse
-
-    parser = argparse.ArgumentParser(description='Calculate incidence sizes of parental regions. You do not need to enter single files, but the path to the .../T2w folder')
-    requiredNamed = parser.add_argument_group('Required named arguments')
-    requiredNamed.add_argument('-i', '--inputFolder', help='.../T2w')
-
-    parser.add_argument('-t', '--threshold', help='Threshold for stroke values ',  nargs='?', type=int,
-                        default=0)
-    parser.add_argument('-a', '--allenBrain_anno', help='File: Annotations of Allen Brain', nargs='?', type=str,
-                        default=os.path.abspath(
-                            os.path.join(os.getcwd(), os.pardir, os.pardir)) + '/lib/average_template_50.nii.gz')
-
-    inputFolder = None
-    allenBrain_template = None
-    allenBrain_anno = None
-    outfile = None
-
-    args = parser.parse_args()
-
-
-    if args.inputFolder is not None:
-        inputFolder = args.inputFolder
-        outfile = args.inputFolder
+def startIncidenceSize(inputFolder, thres=0, allenBrain_anno=os.path.join(libPath, 'average_template_50.nii.gz'),
+                       labels=os.path.join(libPath, 'rsfMRILablelID.mat'),
+                       araDataTemplate=os.path.join(libPath, 'annoVolume.nii.gz')):
+    """Calculates the incidence sizes of parental regions of all registered data in the T2w folder (inputFolder)"""
     if not os.path.exists(inputFolder):
         sys.exit("Error: '%s' is not an existing directory." % (inputFolder,))
-
-
-
-    if args.allenBrain_anno is not None:
-        allenBrain_anno = args.allenBrain_anno
     if not os.path.exists(allenBrain_anno):
         sys.exit("Error: '%s' is not an existing directory." % (allenBrain_anno,))
-
-    thres = args.threshold
-    labels = os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+ '/lib/rsfMRILablelID.mat'
-    araDataTemplate = os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+ '/lib/annoVolume.nii.gz'
+    outfile = inputFolder
 
     if len(glob.glob(inputFolder+'/*Stroke_mask.nii.gz')) > 0:
         incidenceMask = glob.glob(inputFolder+'/*Stroke_mask.nii.gz')[0]
@@ -256,4 +231,21 @@ if __name__ == "__main__":
     if not len(regANNO_list) == len(regMR_list):
         sys.exit("Error: For one or more annotations is no corresponding MR file defined in '%s'." % (inputFolder,))
 
-    incidenceMap(regMR_list,regInc_list,regANNO_list,araDataTemplate,incidenceMask,thres,outfile,labels)
+    return incidenceMap(regMR_list,regInc_list,regANNO_list,araDataTemplate,incidenceMask,thres,outfile,labels)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Calculate incidence sizes of parental regions. You do not need to enter single files, but the path to the .../T2w folder')
+    requiredNamed = parser.add_argument_group('Required named arguments')
+    requiredNamed.add_argument('-i', '--inputFolder', help='.../T2w')
+
+    parser.add_argument('-t', '--threshold', help='Threshold for stroke values ',  nargs='?', type=int,
+                        default=0)
+    parser.add_argument('-a', '--allenBrain_anno', help='File: Annotations of Allen Brain', nargs='?', type=str,
+                        default=os.path.join(libPath, 'average_template_50.nii.gz'))
+
+    args = parser.parse_args()
+
+    startIncidenceSize(args.inputFolder, args.threshold, args.allenBrain_anno)
@@ -54,42 +54,21 @@ def extractDTIData(img,rois,outfile,txt_file):
 
 
 
-if __name__ == '__main__':
-    # default values
-
-
-    parser = argparse.ArgumentParser(description='Extracts the major DTI parameters (apparent diffusion coefficients) '
-                                                 'axial diffusivity (AD), fractional anisotropy (FA), mean diffusivity (MD), and radial diffusivity (RD)')
-    requiredNamed = parser.add_argument_group('Required named arguments')
-    requiredNamed.add_argument('image_file', help='Input file of AIDA pipeline with related folder')
-    requiredNamed.add_argument('roi_file', help='Input file of related roi')
-    parser.add_argument('-t', '--translatorTXT',
-                        help='txt file to translate ROI Number to acronyms',type=str)
-    args = parser.parse_args()
-
+def startExtraction(image_file, roi_file, txt_file=None):
+    """Writes the mean DTI parameter of image_file for every region of roi_file to a txt file"""
     # read image data
-    image_file=None
-    if args.image_file is not None and args.image_file is not None:
-        image_file = args.image_file
-        if not os.path.exists(image_file):
-            sys.exit("Error: '%s' is not an existing image nii-file." % (image_file))
-
+    if not os.path.exists(image_file):
+        sys.exit("Error: '%s' is not an existing image nii-file." % (image_file))
     img_data=nii.load(image_file)
     img = img_data.get_data()
 
     # read roi data
-    roi_file = None
-    if args.roi_file is not None and args.roi_file is not None:
-        roi_file = args.roi_file
-        if not os.path.exists(roi_file):
-            sys.exit("Error: '%s' is not an existing roi file." % (roi_file))
+    if not os.path.exists(roi_file):
+        sys.exit("Error: '%s' is not an existing roi file." % (roi_file))
 
     # read translation TXT file
-    txt_file = None
-    if args.translatorTXT is not None:
-        txt_file = args.translatorTXT
-        if  not os.path.exists(args.translatorTXT):
-            sys.exit("Error: '%s' is not an existing translation txt file." % (txt_file))
+    if txt_file is not None and not os.path.exists(txt_file):
+        sys.exit("Error: '%s' is not an existing translation txt file." % (txt_file))
 
     roi_data = nii.load(roi_file)
     rois = roi_data.get_data()
@@ -97,5 +76,20 @@ if __name__ == '__main__':
     outFile = getOutfile(roi_file, image_file)
     file = extractDTIData(img,rois,outFile,txt_file)
     print("\033[0;30;42m Done \33[0m'  %s" % file)
-    # save output image and txtFile
-    #save_data(image_out, peaks)
+    return file
+
+
+if __name__ == '__main__':
+    # default values
+
+
+    parser = argparse.ArgumentParser(description='Extracts the major DTI parameters (apparent diffusion coefficients) '
+                                                 'axial diffusivity (AD), fractional anisotropy (FA), mean diffusivity (MD), and radial diffusivity (RD)')
+    requiredNamed = parser.add_argument_group('Required named arguments')
+    requiredNamed.add_argument('image_file', help='Input file of AIDA pipeline with related folder')
+    requiredNamed.add_argument('roi_file', help='Input file of related roi')
+    parser.add_argument('-t', '--translatorTXT',
+                        help='txt file to translate ROI Number to acronyms',type=str)
+    args = parser.parse_args()
+
+    startExtraction(args.image_file, args.roi_file, args.translatorTXT)
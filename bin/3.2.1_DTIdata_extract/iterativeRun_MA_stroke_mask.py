@@ -10,6 +10,7 @@ process all DTI data
 import glob
 import os
 import numpy as np
+import DTIdata_extract
 
 def findData(path):
 
@@ -33,6 +34,9 @@ if __name__ == "__main__":
 
     pathData = args.pathData
 
+    # translation file of the region acronyms
+    acronymsFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'acronyms_splitted_ARA.txt')
+
     listAtlas = findData(pathData)
     print(listAtlas)
     for i in range(np.size(listAtlas)):
@@ -41,25 +45,25 @@ if __name__ == "__main__":
         dti = glob.glob(curPath+'/*.md.nii.gz')
         if dti:
             print('python DTIdata_extract.py ' + dti[0] + ' ' + listAtlas[i] + ' -t ./acronyms_ARA.txt')
-            os.system('python DTIdata_extract.py ' +dti[0]+ ' ' +listAtlas[i]+ ' -t ./acronyms_splitted_ARA.txt')
+            DTIdata_extract.startExtraction(dti[0], listAtlas[i], acronymsFile)
     for i in range(np.size(listAtlas)):
         print(listAtlas[i])
         curPath = os.path.dirname(listAtlas[i])
         dti = glob.glob(curPath + '/*.fa0.nii.gz')
         if dti:
             print('python DTIdata_extract.py ' + dti[0] + ' ' + listAtlas[i] + ' -t ./acronyms_ARA.txt')
-            os.system('python DTIdata_extract.py ' + dti[0] + ' ' + listAtlas[i] + ' -t ./acronyms_splitted_ARA.txt')
+            DTIdata_extract.startExtraction(dti[0], listAtlas[i], acronymsFile)
     for i in range(np.size(listAtlas)):
         print(listAtlas[i])
         curPath = os.path.dirname(listAtlas[i])
         dti = glob.glob(curPath + '/*.rd.nii.gz')
         if dti:
             print('python DTIdata_extract.py ' + dti[0] + ' ' + listAtlas[i] + ' -t ./acronyms_ARA.txt')
-            os.system('python DTIdata_extract.py ' + dti[0] + ' ' + listAtlas[i] + ' -t ./acronyms_splitted_ARA.txt')
+            DTIdata_extract.startExtraction(dti[0], listAtlas[i], acronymsFile)
     for i in range(np.size(listAtlas)):
         print(listAtlas[i])
         curPath = os.path.dirname(listAtlas[i])
         dti = glob.glob(curPath + '/*.ad.nii.gz')
         if dti:
             print('python DTIdata_extract.py ' + dti[0] + ' ' + listAtlas[i] + ' -t ./acronyms_ARA.txt')
-            os.system('python DTIdata_extract.py ' + dti[0] + ' ' + listAtlas[i] + ' -t ./acronyms_splitted_ARA.txt')
\ No newline at end of file
+            DTIdata_extract.startExtraction(dti[0], listAtlas[i], acronymsFile)
\ No newline at end of file
@@ -33,17 +33,28 @@ import nipype.interfaces.fsl as fsl
 
 import shutil
 import subprocess
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import niiWriter
+from scratchSpace import makeScratchDir
 
 
-def scaleBy10(input_path, inv):
+def threadCount():
+    # DSI Studio ignores OMP_NUM_THREADS, so the thread budget of batchProc
+    # (or of the user) is passed on with --thread_count
+    threads = os.environ.get('OMP_NUM_THREADS', '')
+    if threads.isdigit() and int(threads) > 0:
+        return int(threads)
+    return os.cpu_count() or 1
+
+def scaleBy10(input_path, inv, scratch=None):
     data = nii.load(input_path)
     imgTemp = data.get_data()
     if inv is False:
         scale = np.eye(4) * 10
         scale[3][3] = 1
         scaledNiiData = nii.Nifti1Image(imgTemp, data.affine * scale)
-        fslPath = os.path.join(os.path.dirname(input_path), 'fslScaleTemp.nii.gz')
-        nii.save(scaledNiiData, fslPath)
+        fslPath = os.path.join(scratch or os.path.dirname(input_path), 'fslScaleTemp.nii.gz')
+        niiWriter.save(scaledNiiData, fslPath, final=False)
         return fslPath
     elif inv is True:
         scale = np.eye(4) / 10
@@ -53,7 +64,7 @@ def scaleBy10(input_path, inv):
         hdrOut.set_xyzt_units('mm')
 
         # hdrOut['sform_code'] = 1
-        nii.save(unscaledNiiData, input_path)
+        niiWriter.save(unscaledNiiData, input_path)
         return input_path
     else:
         sys.exit("Error: inv - parameter should be a boolean.")
@@ -71,24 +82,28 @@ def findSlicesData(path, pre):
 def fsl_SeparateSliceMoCo(input_file, par_folder):
     # scale Nifti data by factor 10
     dataName = os.path.basename(input_file).split('.')[0]
-    fslPath = scaleBy10(input_file, inv=False)
-    mySplit = fsl.Split(in_file=fslPath, dimension='z', out_base_name=dataName)
-    print(mySplit.cmdline)
-    mySplit.run()
-    os.remove(fslPath)
-
-    # sparate ref and src volume in slices
-    sliceFiles = findSlicesData(os.getcwd(), dataName)
-    print('For all slices ... ')
-
-    # start to correct motions slice by slice
-    for i in range(len(sliceFiles)):
-        slc = sliceFiles[i]
-        output_file = os.path.join(par_folder, os.path.basename(slc))
-        myMCFLIRT = fsl.preprocess.MCFLIRT(in_file=slc, out_file=output_file, save_plots=True, terminal_output='none')
-        print(myMCFLIRT.cmdline)
-        myMCFLIRT.run()
-        os.remove(slc)
+    scratch = makeScratchDir(dataName)
+    try:
+        fslPath = scaleBy10(input_file, inv=False, scratch=scratch)
+        mySplit = fsl.Split(in_file=fslPath, dimension='z', out_base_name=os.path.join(scratch, dataName))
+        print(mySplit.cmdline)
+        mySplit.run()
+        os.remove(fslPath)
+
+        # sparate ref and src volume in slices
+        sliceFiles = findSlicesData(scratch, dataName)
+        print('For all slices ... ')
+
+        # start to correct motions slice by slice
+        for i in range(len(sliceFiles)):
+            slc = sliceFiles[i]
+            output_file = os.path.join(par_folder, os.path.basename(slc))
+            myMCFLIRT = fsl.preprocess.MCFLIRT(in_file=slc, out_file=output_file, save_plots=True, terminal_output='none')
+            print(myMCFLIRT.cmdline)
+            myMCFLIRT.run()
+            os.remove(slc)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
 
     # merge slices to a single volume
     mcf_sliceFiles = findSlicesData(par_folder, dataName)
@@ -154,7 +169,7 @@ def connectivity(dsi_studio, dir_in, dir_seeds, dir_out, dir_con):
 
     # change to input directory
     os.chdir(os.path.dirname(dir_in))
-    cmd_ana = r'%s --action=%s --source=%s --tract=%s --connectivity=%s --connectivity_value=%s --connectivity_type=%s'
+    cmd_ana = r'%s --action=%s --source=%s --tract=%s --connectivity=%s --connectivity_value=%s --connectivity_type=%s --thread_count=%d'
 
     filename = glob.glob(dir_in+'/*fib.gz')[0]
     file_trk = glob.glob(dir_in+'/*trk.gz')[0]
@@ -163,7 +178,7 @@ def connectivity(dsi_studio, dir_in, dir_seeds, dir_out, dir_con):
     # Performs analysis on every connectivity value within the list ('qa' may not be necessary; might be removed in the future.)
     connect_vals = ['qa', 'count']
     for i in connect_vals:
-        parameters = (dsi_studio, 'ana', filename, file_trk, file_seeds, i, 'pass,end')
+        parameters = (dsi_studio, 'ana', filename, file_trk, file_seeds, i, 'pass,end', threadCount())
         os.system(cmd_ana % parameters)
 
     #move_files(dir_in, dir_con, re.escape(filename) + '\.' + re.escape(pre_seeds) + '.*(?:\.pass\.|\.end\.)')
@@ -259,7 +274,7 @@ def srcgen(dsi_studio, dir_in, dir_msk, dir_out, b_table):
     os.chdir(os.path.dirname(dir_in))
 
     cmd_src = r'%s --action=%s --source=%s --output=%s --b_table=%s'
-    cmd_rec = r'%s --action=%s --source=%s --mask=%s --method=%d --param0=%s --check_btable=%d --half_sphere=%d'
+    cmd_rec = r'%s --action=%s --source=%s --mask=%s --method=%d --param0=%s --check_btable=%d --half_sphere=%d --thread_count=%d'
 
     # create source files
     filename = os.path.basename(dir_in)
@@ -271,7 +286,7 @@ def srcgen(dsi_studio, dir_in, dir_msk, dir_out, b_table):
 
     # create fib files
     file_msk = dir_msk
-    parameters = (dsi_studio, 'rec', file_src, file_msk, 1, '16', 0, 1)
+    parameters = (dsi_studio, 'rec', file_src, file_msk, 1, '16', 0, 1, threadCount())
     print("Generate fib-File %s:" % cmd_rec % parameters)
     os.system(cmd_rec % parameters)
 
@@ -323,10 +338,10 @@ def tracking(dsi_studio, dir_in):
     os.chdir(os.path.dirname(dir_in))
 
     # qa threshold for 60/65 = 0.05; for Alzheimer: 0.03
-    cmd_trk = r'%s --action=%s --source=%s --output=%s --fiber_count=%d --interpolation=%d --step_size=%s --turning_angle=%s --check_ending=%d --fa_threshold=%s --smoothing=%s --min_length=%s --max_length=%s'
+    cmd_trk = r'%s --action=%s --source=%s --output=%s --fiber_count=%d --interpolation=%d --step_size=%s --turning_angle=%s --check_ending=%d --fa_threshold=%s --smoothing=%s --min_length=%s --max_length=%s --thread_count=%d'
 
     filename = glob.glob(dir_in+'/*fib.gz')[0]
-    parameters = (dsi_studio, 'trk', filename, os.path.join(dir_in, filename+'.trk.gz'), 1000000, 0, '.5', '55', 0, '.02', '.1', '.5', '12.0')
+    parameters = (dsi_studio, 'trk', filename, os.path.join(dir_in, filename+'.trk.gz'), 1000000, 0, '.5', '55', 0, '.02', '.1', '.5', '12.0', threadCount())
     print("Track neuronal pathes %s:" % cmd_trk % parameters)
     os.system(cmd_trk % parameters)
 
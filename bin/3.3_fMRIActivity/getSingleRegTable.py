@@ -16,6 +16,9 @@ import shutil
 import parReader
 import i32Reader
 
+# path of the AIDAmri lib folder
+libPath = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'lib'))
+
 
 def findData(path,addon):
     reg_list = []
@@ -49,7 +52,7 @@ def getRegrTable(file_name,physio_Folder,parPath_folder):
         sys.exit("Error: %s is not an existing directory or file." % (i32_Path,))
 
     if not physio_Folder:
-        physio_Folder= os.path.abspath(os.path.join(os.getcwd(), os.pardir,os.pardir))+'/lib/physio%s.i32'%str(numberOfAllRepitionsParTable)
+        physio_Folder= os.path.join(libPath, 'physio%s.i32')%str(numberOfAllRepitionsParTable)
 
     # generate target Folder
 
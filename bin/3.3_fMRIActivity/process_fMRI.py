@@ -20,6 +20,12 @@ import getSingleRegTable
 import scipy.misc as mc
 import create_seed_rois
 import fsl_mean_ts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import niiWriter
+from scratchSpace import makeScratchDir
+
+# path of the AIDAmri lib folder
+libPath = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'lib'))
 
 def copyAtlasOfData(path,post,labels):
     fileALL = glob.glob(path + '/*' + post + '.nii.gz')
@@ -41,15 +47,18 @@ def imgScaleResize(img):
 
     return newImg
 
-def scaleBy10(input_path,inv):
+def scaleBy10(input_path,inv,scratch=None):
     data = nii.load(input_path)
     imgTemp = data.get_data()
     if inv is False:
         scale = np.eye(4) * 10
         scale[3][3] = 1
         scaledNiiData = nii.Nifti1Image(imgTemp, data.affine * scale)
-        fslPath = os.path.join(os.path.dirname(input_path), 'fslScaleTemp.nii.gz')
-        nii.save(scaledNiiData, fslPath)
+        if scratch is None:
+            fslPath = os.path.join(os.path.dirname(input_path), 'fslScaleTemp.nii.gz')
+        else:
+            fslPath = os.path.join(scratch, os.path.basename(input_path).split('.')[0] + '_fslScaleTemp.nii.gz')
+        niiWriter.save(scaledNiiData, fslPath, final=False)
         return fslPath
     elif inv is True:
         scale = np.eye(4) / 10
@@ -59,7 +68,7 @@ def scaleBy10(input_path,inv):
         hdrOut.set_xyzt_units('mm')
 
         # hdrOut['sform_code'] = 1
-        nii.save(unscaledNiiData, input_path)
+        niiWriter.save(unscaledNiiData, input_path)
         return input_path
     else:
         sys.exit("Error: inv - parameter should be a boolean.")
@@ -88,7 +97,7 @@ def getRASorientation(file_name,proc_Path):
     epiData_RAS = nii.as_closest_canonical(epiData)
     print('Orientation:' + str(nii.aff2axcodes(epiData_RAS.affine)))
     output_file = os.path.join(proc_Path, os.path.basename(file_name))
-    nii.save(epiData, output_file)
+    niiWriter.save(epiData, output_file)
     return output_file
 
 def getEPIMean(file_name,proc_Path):
@@ -102,27 +111,33 @@ def getEPIMean(file_name,proc_Path):
 def applyBET(input_file,frac,radius,vertical_gradient):
 
     # scale Nifti data by factor 10
-    fslPath = scaleBy10(input_file,inv=False)
-    # extract brain
-    output_file = os.path.join(os.path.dirname(input_file),os.path.basename(input_file).split('.')[0]) + 'Bet.nii.gz'
-    maskFile = os.path.join(os.path.dirname(input_file), os.path.basename(input_file).split('.')[0]) + 'Bet_mask.nii.gz'
-    myBet = fsl.BET(in_file=fslPath, out_file=output_file,frac=frac,radius=radius,
-                    vertical_gradient=vertical_gradient,robust=True, mask = True)
-    print(myBet.cmdline)
-    myBet.run()
-    os.remove(fslPath)
+    scratch = makeScratchDir(os.path.basename(input_file).split('.')[0])
+    try:
+        fslPath = scaleBy10(input_file,inv=False,scratch=scratch)
+        # extract brain
+        output_file = os.path.join(os.path.dirname(input_file),os.path.basename(input_file).split('.')[0]) + 'Bet.nii.gz'
+        maskFile = os.path.join(os.path.dirname(input_file), os.path.basename(input_file).split('.')[0]) + 'Bet_mask.nii.gz'
+        myBet = fsl.BET(in_file=fslPath, out_file=output_file,frac=frac,radius=radius,
+                        vertical_gradient=vertical_gradient,robust=True, mask = True)
+        print(myBet.cmdline)
+        myBet.run()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
     # unscale result data by factor 10ˆ(-1)
     output_file = scaleBy10(output_file,inv=True)
     return output_file,maskFile
 
 def applyMask(input_file,mask_file):
-    fslPath = scaleBy10(input_file, inv=False)
-    # maks apply
-    output_file = os.path.join(os.path.dirname(input_file), os.path.basename(input_file).split('.')[0]) + 'BET.nii.gz'
-    myMaskapply = fsl.ApplyMask(in_file=fslPath, out_file=output_file, mask_file=mask_file)
-    print(myMaskapply.cmdline)
-    myMaskapply.run()
-    os.remove(fslPath)
+    scratch = makeScratchDir(os.path.basename(input_file).split('.')[0])
+    try:
+        fslPath = scaleBy10(input_file, inv=False, scratch=scratch)
+        # maks apply
+        output_file = os.path.join(os.path.dirname(input_file), os.path.basename(input_file).split('.')[0]) + 'BET.nii.gz'
+        myMaskapply = fsl.ApplyMask(in_file=fslPath, out_file=output_file, mask_file=mask_file)
+        print(myMaskapply.cmdline)
+        myMaskapply.run()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
     # unscale result data by factor 10ˆ(-1)
     output_file = scaleBy10(output_file, inv=True)
     return output_file
@@ -130,30 +145,34 @@ def applyMask(input_file,mask_file):
 def fsl_SeparateSliceMoCo(input_file,par_folder):
     # scale Nifti data by factor 10
     dataName = os.path.basename(input_file).split('.')[0]
-    fslPath = scaleBy10(input_file, inv=False)
-    mySplit= fsl.Split(in_file=fslPath,dimension='z',out_base_name = dataName)
-    print(mySplit.cmdline)
-    mySplit.run()
-    os.remove(fslPath)
-
-
-    # sparate ref and src volume in slices
-    sliceFiles = findSlicesData(os.getcwd(),dataName)
-    # refFiles = findSlicesData(os.getcwd(),'ref')
-    print('For all slices ... ')
-
-
-    #start to correct motions slice by slice
-    for i in  range(len(sliceFiles)):
-        slc = sliceFiles[i]
-        # ref = refFiles[i]
-        # take epi as ref
-        output_file = os.path.join(par_folder,os.path.basename(slc))
-        myMCFLIRT = fsl.preprocess.MCFLIRT(in_file=slc,out_file=output_file,save_plots=True,terminal_output='none')
-        print(myMCFLIRT.cmdline)
-        myMCFLIRT.run()
-        os.remove(slc)
-        # os.remove(ref)
+    scratch = makeScratchDir(dataName)
+    try:
+        fslPath = scaleBy10(input_file, inv=False, scratch=scratch)
+        mySplit= fsl.Split(in_file=fslPath,dimension='z',out_base_name = os.path.join(scratch,dataName))
+        print(mySplit.cmdline)
+        mySplit.run()
+        os.remove(fslPath)
+
+
+        # sparate ref and src volume in slices
+        sliceFiles = findSlicesData(scratch,dataName)
+        # refFiles = findSlicesData(scratch,'ref')
+        print('For all slices ... ')
+
+
+        #start to correct motions slice by slice
+        for i in  range(len(sliceFiles)):
+            slc = sliceFiles[i]
+            # ref = refFiles[i]
+            # take epi as ref
+            output_file = os.path.join(par_folder,os.path.basename(slc))
+            myMCFLIRT = fsl.preprocess.MCFLIRT(in_file=slc,out_file=output_file,save_plots=True,terminal_output='none')
+            print(myMCFLIRT.cmdline)
+            myMCFLIRT.run()
+            os.remove(slc)
+            # os.remove(ref)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
 
     # merge slices to a single volume
 
@@ -224,40 +243,70 @@ def startProcess(Rawfile_name):
     print("fMRI Processing \33[5m...\33[0m (wait!)", end="\r")
 
     # generate log - file
+    stdout = sys.stdout
     sys.stdout = open(os.path.join(os.path.dirname(Rawfile_name), 'process.log'), 'w')
+    try:
 
-    # bring dataset to RAS orientation
-    file_name = getRASorientation(Rawfile_name,proc_Path)
-
-    # calculate EPIMean
-    file_nameEPI = getEPIMean(file_name,proc_Path)
+        # bring dataset to RAS orientation
+        file_name = getRASorientation(Rawfile_name,proc_Path)
 
-    # apply BET on EPImean
-    file_nameEPI_BET,mask_file = applyBET(file_nameEPI,frac=0.35,radius=45,vertical_gradient=0.1)
+        # calculate EPIMean
+        file_nameEPI = getEPIMean(file_name,proc_Path)
 
-    #apply Mask on original dataset
-    maskedFile_data = applyMask(file_name,mask_file)
+        # apply BET on EPImean
+        file_nameEPI_BET,mask_file = applyBET(file_nameEPI,frac=0.35,radius=45,vertical_gradient=0.1)
 
-    # apply motion correction on original dataset with EPImean as reference
-    mcfFile_name=fsl_SeparateSliceMoCo(file_name,par_Path)
+        #apply Mask on original dataset
+        maskedFile_data = applyMask(file_name,mask_file)
 
-    # apply mean on motion corrected data
-    meanMcfFile_name = getEPIMean(mcfFile_name, proc_Path)
+        # apply motion correction on original dataset with EPImean as reference
+        mcfFile_name=fsl_SeparateSliceMoCo(file_name,par_Path)
 
-    # copy physio data to rawMonData-Folder
-    relatedPhysioFolder = copyRawPhysioData(Rawfile_name,i32_Path)
+        # apply mean on motion corrected data
+        meanMcfFile_name = getEPIMean(mcfFile_name, proc_Path)
 
-    # get Regression Values
-    if len(relatedPhysioFolder) is not 0:
-        getSingleRegTable.getRegrTable(os.path.dirname(Rawfile_name),relatedPhysioFolder,par_Path)
-    else:
-        print("Error: Processing not possible, because either there is no folder called Physio or the related physio data for the scan is missing there.")
+        # copy physio data to rawMonData-Folder
+        relatedPhysioFolder = copyRawPhysioData(Rawfile_name,i32_Path)
 
-    sys.stdout = sys.__stdout__
+        # get Regression Values
+        if len(relatedPhysioFolder) is not 0:
+            getSingleRegTable.getRegrTable(os.path.dirname(Rawfile_name),relatedPhysioFolder,par_Path)
+        else:
+            print("Error: Processing not possible, because either there is no folder called Physio or the related physio data for the scan is missing there.")
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
     print('fMRI Processing  \033[0;30;42m COMPLETED \33[0m')
 
     return mcfFile_name
 
+
+def startProcessing(inputFile, TR=1.42, cutOff_sec=100.0, FWHM=3.0, slice_time=True,
+                    labels=os.path.join(libPath, 'annotation_50CHANGEDanno_label_IDs.txt'),
+                    labelNames=os.path.join(libPath, 'annoVolume.nii.txt'),
+                    labels2000=os.path.join(libPath, 'annotation_50CHANGEDanno_label_IDs+2000.txt'),
+                    labelNames2000=os.path.join(libPath, 'annoVolume+2000_rsfMRI.nii.txt')):
+    """Complete rsfMRI processing of the raw rsfMRI NIfTI file (inputFile): preprocessing and motion
+    correction (startProcess), physio regression (regress.startRegression) and the mean time
+    courses of the atlas regions (fsl_mean_ts)"""
+    if not os.path.exists(inputFile):
+        sys.exit("Error: '%s' is not an existing directory or file." % (inputFile,))
+
+    mcfFile_name = startProcess(inputFile)
+    rgr_file, srgr_file, sfrgr_file = regress.startRegression(mcfFile_name, FWHM, cutOff_sec, TR, slice_time)
+    print("sfrgr_file",sfrgr_file)
+
+    atlasPath = os.path.dirname(inputFile)
+    roisPath = copyAtlasOfData(atlasPath,'Anno_rsfMRI',labels)
+
+    fslMeantsFile = fsl_mean_ts.start_fsl_mean_ts(sfrgr_file, roisPath, labelNames, 'MasksTCs.')
+
+    roisPath = copyAtlasOfData(atlasPath, 'AnnoSplit_rsfMRI', labels2000)
+
+    fslMeantsFile = fsl_mean_ts.start_fsl_mean_ts(sfrgr_file, roisPath, labelNames2000, 'MasksTCsSplit.')
+    return sfrgr_file
+
+
 if __name__ == "__main__":
 
     TR = 1.42
@@ -277,28 +326,4 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
 
-    labels = os.path.abspath(
-        os.path.join(os.getcwd(), os.pardir, os.pardir)) + '/lib/annotation_50CHANGEDanno_label_IDs.txt'
-    labelNames = os.path.abspath(os.path.join(os.getcwd(), os.pardir, os.pardir)) + '/lib/annoVolume.nii.txt'
-    labels2000 = os.path.abspath(
-        os.path.join(os.getcwd(), os.pardir, os.pardir)) + '/lib/annotation_50CHANGEDanno_label_IDs+2000.txt'
-    labelNames2000 = os.path.abspath(
-        os.path.join(os.getcwd(), os.pardir, os.pardir)) + '/lib/annoVolume+2000_rsfMRI.nii.txt'
-    input = None
-    if args.input is not None and args.input is not None:
-        input = args.input
-    if not os.path.exists(input):
-        sys.exit("Error: '%s' is not an existing directory or file %s is not in directory." % (input, args.file,))
-
-    mcfFile_name = startProcess(input)
-    rgr_file, srgr_file, sfrgr_file = regress.startRegression(mcfFile_name, FWHM, cutOff_sec, TR, args.slice_time)
-    print("sfrgr_file",sfrgr_file)
-
-    atlasPath = os.path.dirname(input)
-    roisPath = copyAtlasOfData(atlasPath,'Anno_rsfMRI',labels)
-
-    fslMeantsFile = fsl_mean_ts.start_fsl_mean_ts(sfrgr_file, roisPath, labelNames, 'MasksTCs.')
-
-    roisPath = copyAtlasOfData(atlasPath, 'AnnoSplit_rsfMRI', labels2000)
-
-    fslMeantsFile = fsl_mean_ts.start_fsl_mean_ts(sfrgr_file, roisPath, labelNames2000, 'MasksTCsSplit.')
+    startProcessing(args.input, float(args.TR), float(args.cutOff_sec), float(args.FWHM), args.slice_time)
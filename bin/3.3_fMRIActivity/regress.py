@@ -14,18 +14,22 @@ import numpy as np
 import nipype.interfaces.fsl as fsl
 import glob
 import shutil
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import niiWriter
+from scratchSpace import makeScratchDir
 
 
 
-def scaleBy10(input_path,inv):
+def scaleBy10(input_path,inv,scratch=None):
     data = nii.load(input_path)
     imgTemp = data.get_data()
     if inv == False:
         scale = np.eye(4) * 10
         scale[3][3] = 1
         scaledNiiData = nii.Nifti1Image(imgTemp, data.affine * scale)
-        fslPath = os.path.join(os.path.dirname(input_path), os.path.basename(input_path).split('.')[0]+'_fslScaleTemp.nii.gz')
-        nii.save(scaledNiiData, fslPath)
+        tempPath = scratch if scratch is not None else os.path.dirname(input_path)
+        fslPath = os.path.join(tempPath, os.path.basename(input_path).split('.')[0]+'_fslScaleTemp.nii.gz')
+        niiWriter.save(scaledNiiData, fslPath, final=False)
         return fslPath
     elif inv == True:
         scale = np.eye(4) / 10
@@ -35,7 +39,7 @@ def scaleBy10(input_path,inv):
         hdrOut.set_xyzt_units('mm')
 
         # hdrOut['sform_code'] = 1
-        nii.save(unscaledNiiData, input_path)
+        niiWriter.save(unscaledNiiData, input_path)
         return input_path
     else:
         sys.exit("Error: inv - parameter should be a boolean.")
@@ -58,13 +62,16 @@ def findSlicesData(path,pre):
 
 def delete5Slides(input_file,regr_Path):
     # scale Nifti data by factor 10
-    fslPath = scaleBy10(input_file, inv=False)
-    # delete 5 slides
-    output_file = os.path.join(os.path.dirname(input_file), os.path.basename(input_file).split('.')[0]) + '_f.nii.gz'
-    myROI = fsl.ExtractROI(in_file=fslPath, roi_file=output_file, t_min=5, t_size=-1)
-    print(myROI.cmdline)
-    myROI.run()
-    os.remove(fslPath)
+    scratch = makeScratchDir(os.path.basename(input_file).split('.')[0])
+    try:
+        fslPath = scaleBy10(input_file, inv=False, scratch=scratch)
+        # delete 5 slides
+        output_file = os.path.join(os.path.dirname(input_file), os.path.basename(input_file).split('.')[0]) + '_f.nii.gz'
+        myROI = fsl.ExtractROI(in_file=fslPath, roi_file=output_file, t_min=5, t_size=-1)
+        print(myROI.cmdline)
+        myROI.run()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
     # unscale result data by factor 10ˆ(-1)
     output_file = scaleBy10(output_file, inv=True)
     return output_file
@@ -83,35 +90,39 @@ def fsl_RegrSliceWise(input_file,txtregr_Path,regr_Path):
         return output_file
 
 
-    fslPath = scaleBy10(input_file, inv=False)
-    # split input_file in slices
-    mySplit = fsl.Split(in_file=fslPath, dimension='z', out_base_name=dataName)
-    print(mySplit.cmdline)
-    mySplit.run()
-    os.remove(fslPath)
+    scratch = makeScratchDir(dataName)
+    try:
+        fslPath = scaleBy10(input_file, inv=False, scratch=scratch)
+        # split input_file in slices
+        mySplit = fsl.Split(in_file=fslPath, dimension='z', out_base_name=os.path.join(scratch, dataName))
+        print(mySplit.cmdline)
+        mySplit.run()
+        os.remove(fslPath)
 
-    # sparate ref and src volume in slices
-    sliceFiles = findSlicesData(os.getcwd(), dataName)
+        # sparate ref and src volume in slices
+        sliceFiles = findSlicesData(scratch, dataName)
 
 
 
 
-    if not len(regrTextFiles) == len(sliceFiles):
-        sys.exit('Error: Not enough .txt-Files in %s' % txtregr_Path)
+        if not len(regrTextFiles) == len(sliceFiles):
+            sys.exit('Error: Not enough .txt-Files in %s' % txtregr_Path)
 
-    print('Start separate slice Regression ... ')
+        print('Start separate slice Regression ... ')
 
-    # start to regression slice by slice
-    print('For all slices ...')
-    for i in range(len(sliceFiles)):
-        slc = sliceFiles[i]
-        regr = regrTextFiles[i]
-        # only take the columns [1,2,7,9,11,12,13] of the reg-.txt Files
-        output_file = os.path.join(regr_Path, os.path.basename(slc))
-        myRegr = fsl.FilterRegressor(in_file=slc,design_file=regr,out_file=output_file,filter_columns=[1,2,7,9,11,12,13])
-        print(myRegr.cmdline)
-        myRegr.run()
-        os.remove(slc)
+        # start to regression slice by slice
+        print('For all slices ...')
+        for i in range(len(sliceFiles)):
+            slc = sliceFiles[i]
+            regr = regrTextFiles[i]
+            # only take the columns [1,2,7,9,11,12,13] of the reg-.txt Files
+            output_file = os.path.join(regr_Path, os.path.basename(slc))
+            myRegr = fsl.FilterRegressor(in_file=slc,design_file=regr,out_file=output_file,filter_columns=[1,2,7,9,11,12,13])
+            print(myRegr.cmdline)
+            myRegr.run()
+            os.remove(slc)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
 
 
     # merge slices to a single volume
@@ -160,17 +171,19 @@ def getMean(input_file,appendix):
 
 def applySusan(input_file,meanintensity,FWHM,mean_func):
     # scale Nifti data by factor 10
-    fslPath = scaleBy10(input_file, inv=False)
-    meanPath = scaleBy10(mean_func, inv=False)
-    output_file = os.path.join(os.path.dirname(input_file),
-                               os.path.basename(input_file).split('RGR')[0]) + 'SRGR.nii.gz'
-
-    mySusan = fsl.SUSAN(in_file=fslPath, brightness_threshold=meanintensity, fwhm=FWHM, dimension=2,
-                        use_median=1, usans=[(meanPath, meanintensity), ], out_file=output_file)
-    print(mySusan.cmdline)
-    mySusan.run()
-    os.remove(fslPath)
-    os.remove(meanPath)
+    scratch = makeScratchDir(os.path.basename(input_file).split('.')[0])
+    try:
+        fslPath = scaleBy10(input_file, inv=False, scratch=scratch)
+        meanPath = scaleBy10(mean_func, inv=False, scratch=scratch)
+        output_file = os.path.join(os.path.dirname(input_file),
+                                   os.path.basename(input_file).split('RGR')[0]) + 'SRGR.nii.gz'
+
+        mySusan = fsl.SUSAN(in_file=fslPath, brightness_threshold=meanintensity, fwhm=FWHM, dimension=2,
+                            use_median=1, usans=[(meanPath, meanintensity), ], out_file=output_file)
+        print(mySusan.cmdline)
+        mySusan.run()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
     output_file = scaleBy10(output_file, inv=True)
     return  output_file
 
@@ -208,15 +221,18 @@ def filterFSL(input_file,highpass,tempMean):
 def applyBET(input_file,frac,radius,vertical_gradient):
 
     # scale Nifti data by factor 10
-    fslPath = scaleBy10(input_file,inv=False)
-    # extract brain
-    output_file = os.path.join(os.path.dirname(input_file),os.path.basename(input_file).split('.')[0]) + 'Bet.nii.gz'
-    maskFile = os.path.join(os.path.dirname(input_file), os.path.basename(input_file).split('.')[0]) + 'Bet_mask.nii.gz'
-    myBet = fsl.BET(in_file=fslPath, out_file=output_file,frac=frac,radius=radius,
-                    vertical_gradient=vertical_gradient,robust=True, mask = True)
-    print(myBet.cmdline)
-    myBet.run()
-    os.remove(fslPath)
+    scratch = makeScratchDir(os.path.basename(input_file).split('.')[0])
+    try:
+        fslPath = scaleBy10(input_file,inv=False,scratch=scratch)
+        # extract brain
+        output_file = os.path.join(os.path.dirname(input_file),os.path.basename(input_file).split('.')[0]) + 'Bet.nii.gz'
+        maskFile = os.path.join(os.path.dirname(input_file), os.path.basename(input_file).split('.')[0]) + 'Bet_mask.nii.gz'
+        myBet = fsl.BET(in_file=fslPath, out_file=output_file,frac=frac,radius=radius,
+                        vertical_gradient=vertical_gradient,robust=True, mask = True)
+        print(myBet.cmdline)
+        myBet.run()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
     # unscale result data by factor 10ˆ(-1)
     output_file = scaleBy10(output_file,inv=True)
     maskFile = scaleBy10(maskFile,inv=True)
@@ -234,74 +250,77 @@ def startRegression(input_File, FWHM, cutOff_sec, TR, sl):
     os.mkdir(regr_Path)
 
     # generatre log-File
+    stdout = sys.stdout
     sys.stdout = open(os.path.join(regr_Path,'regress.log'),'w')
+    try:
 
-    # delete the first slides
-    input_File5Sub = delete5Slides(input_File, regr_Path)
-
-    # perform slice time correction
-    if sl == True:
-        input_File5Sub = fsl_slicetimeCorrector(input_File5Sub, TR)
+        # delete the first slides
+        input_File5Sub = delete5Slides(input_File, regr_Path)
 
+        # perform slice time correction
+        if sl == True:
+            input_File5Sub = fsl_slicetimeCorrector(input_File5Sub, TR)
 
-    # proof regression files
-    txtregr_Path = os.path.join(origin_Path, 'txtRegrPython')
 
-    # slive wise regression with physio data
-    regr_FileReal = fsl_RegrSliceWise(input_File5Sub, txtregr_Path, regr_Path)
+        # proof regression files
+        txtregr_Path = os.path.join(origin_Path, 'txtRegrPython')
 
-    # get mean
-    meanRegr_File = getMean(regr_FileReal,'mean2')
-    file_nameEPI_BET, mask_file = applyBET(meanRegr_File, frac=0.35, radius=45, vertical_gradient=0.1)
-    os.remove(meanRegr_File)
-    regr_File = applyMask(regr_FileReal,mask_file,'')
+        # slive wise regression with physio data
+        regr_FileReal = fsl_RegrSliceWise(input_File5Sub, txtregr_Path, regr_Path)
 
+        # get mean
+        meanRegr_File = getMean(regr_FileReal,'mean2')
+        file_nameEPI_BET, mask_file = applyBET(meanRegr_File, frac=0.35, radius=45, vertical_gradient=0.1)
+        os.remove(meanRegr_File)
+        regr_File = applyMask(regr_FileReal,mask_file,'')
 
-    #  "robust intensity range" which calculates values similar to the 98% percentiles
-    myStat = fsl.ImageStats(in_file=regr_File,op_string='-p 98',terminal_output='allatonce')
-    print(myStat.cmdline)
-    stat_result = myStat.run()
-    upperp = stat_result.outputs.out_stat
 
-    # get binary mask
-    mask = getMask(regr_File, upperp)
+        #  "robust intensity range" which calculates values similar to the 98% percentiles
+        myStat = fsl.ImageStats(in_file=regr_File,op_string='-p 98',terminal_output='allatonce')
+        print(myStat.cmdline)
+        stat_result = myStat.run()
+        upperp = stat_result.outputs.out_stat
 
-    # "robust intensity range" which calculates values similar to the 50% percentiles with mask
-    myStat = fsl.ImageStats(in_file=regr_File, op_string=' -k ' +mask+ ' -p 50 ',mask_file=mask ,terminal_output='allatonce')
-    print(myStat.cmdline)
-    stat_result = myStat.run()
-    meanintensity = stat_result.outputs.out_stat
-    meanintensity = meanintensity*0.75
+        # get binary mask
+        mask = getMask(regr_File, upperp)
 
-    # maxmium filter of mask
-    mask = dilF(mask)
+        # "robust intensity range" which calculates values similar to the 50% percentiles with mask
+        myStat = fsl.ImageStats(in_file=regr_File, op_string=' -k ' +mask+ ' -p 50 ',mask_file=mask ,terminal_output='allatonce')
+        print(myStat.cmdline)
+        stat_result = myStat.run()
+        meanintensity = stat_result.outputs.out_stat
+        meanintensity = meanintensity*0.75
 
-    # apply mask on regrFile
-    thresRegr_file = applyMask(regr_File,mask,'thres')
+        # maxmium filter of mask
+        mask = dilF(mask)
 
-    # get mean of masked regr-Dataset
-    mean_func = getMean(thresRegr_file,'mean_func')
+        # apply mask on regrFile
+        thresRegr_file = applyMask(regr_File,mask,'thres')
 
-    # FWHM = 3.0
-    # sigma = FWHM/(2 * np.sqrt(2 * np.log(2))) = 1.27
-    srgr_file = applySusan(thresRegr_file,meanintensity,FWHM,mean_func)
+        # get mean of masked regr-Dataset
+        mean_func = getMean(thresRegr_file,'mean_func')
 
-    # apply mask on srgr_file
-    smmothSRegr_file = applyMask(srgr_file,mask,'_smooth')
-    inscalefactor = 10000.0/meanintensity
+        # FWHM = 3.0
+        # sigma = FWHM/(2 * np.sqrt(2 * np.log(2))) = 1.27
+        srgr_file = applySusan(thresRegr_file,meanintensity,FWHM,mean_func)
 
-    # multiply image with inscalefactor
-    intnormSrgr_file = mathOperation(smmothSRegr_file,inscalefactor)
+        # apply mask on srgr_file
+        smmothSRegr_file = applyMask(srgr_file,mask,'_smooth')
+        inscalefactor = 10000.0/meanintensity
 
-    # mean of scaled Dataset
-    tempMean  =  getMean(intnormSrgr_file,'tempMean')
+        # multiply image with inscalefactor
+        intnormSrgr_file = mathOperation(smmothSRegr_file,inscalefactor)
 
-    # filter image cut-off frequency 0.01 Hz
-    highpass = (cutOff_sec / (2.0 * TR))
-    #highpass = 17.6056338028
-    filtered_image = filterFSL(intnormSrgr_file,highpass,tempMean)
+        # mean of scaled Dataset
+        tempMean  =  getMean(intnormSrgr_file,'tempMean')
 
-    sys.stdout = sys.__stdout__
+        # filter image cut-off frequency 0.01 Hz
+        highpass = (cutOff_sec / (2.0 * TR))
+        #highpass = 17.6056338028
+        filtered_image = filterFSL(intnormSrgr_file,highpass,tempMean)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
     print('Regression  \033[0;30;42m COMPLETED \33[0m')
     return regr_FileReal, srgr_file ,filtered_image
 
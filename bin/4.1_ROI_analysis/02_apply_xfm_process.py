@@ -105,7 +105,7 @@ def xfm_T2w_rsfMRI(raw_dir, timepoint_P7, timepoint, group, subject, expno_T2w,
 
     # rsfMRI data
     pv = pvr.ParaVision(os.path.join(pt.proc_out_dir, timepoint, group), raw_dir, subject, expno_rsfMRI, procno_rsfMRI)
-    pv.read_2dseq(map_raw=False, map_pv6=False, roll_fg=False, squeeze=False, compact=False, swap_vd=False, scale=1.0)
+    pv.read_header(roll_fg=False, squeeze=False, compact=False, swap_vd=False, scale=1.0)
     #pv.save_nifti(ftype='NIFTI_GZ')
     matrix_rsfMRI, matrix_rsfMRI_inv = pv.get_matrix()
     #data_rsfMRI = np.mean(pv.nifti_image.get_data(), axis=3)
@@ -207,7 +207,7 @@ def xfm_T2w_DTI(raw_dir, timepoint_P7, timepoint, group, subject, expno_T2w, exp
 
     # DTI data
     pv = pvr.ParaVision(os.path.join(pt.proc_out_dir, timepoint, group), raw_dir, subject, expno_DTI, procno_DTI)
-    pv.read_2dseq(map_raw=False, map_pv6=False, roll_fg=False, squeeze=False, compact=False, swap_vd=False, scale=1.0)
+    pv.read_header(roll_fg=False, squeeze=False, compact=False, swap_vd=False, scale=1.0)
     #pv.save_nifti(ftype='NIFTI_GZ')
     matrix_DTI, matrix_DTI_inv = pv.get_matrix()
     #data_DTI = np.mean(pv.nifti_image.get_data(), axis=3)
@@ -6,14 +6,26 @@ Michael Diedenhofen
 Max Planck Institute for Metabolism Research, Cologne
 
 Read Bruker ParaVision JCAMP parameter files (e.g. acqp, method, visu_pars).
+
+tokenize() splits a file into its comments and labelled data records (LDRs)
+in a single pass over the lines. It is shared by read_param_file() and the
+parser of pv_parseBruker_md_np.
+
+read_cached() keeps the parsed parameters in a cache folder (environment
+variable AIDA_PARAM_CACHE, default ~/.cache/AIDAmri/params, an empty value
+disables it). An entry is used as long as path, modification time and size
+of the parameter file are unchanged, so repeated runs do not parse again.
 '''
 
 from __future__ import print_function
 
-VERSION = 'pv_parser.py v 1.0.2 20200820'
+VERSION = 'pv_parser.py v 1.1.0 20261018'
 
+import os
 import re
 import sys
+import pickle
+import hashlib
 
 import collections
 
@@ -215,26 +227,15 @@ def parse_struct(string, str_list):
     return (obj_list, restored)
 
 def check_array_list(values):
-    flag_int = True
-    flag_float = True
-    for value in values:
-        if flag_int:
-            try:
-                value = int(value)
-            except ValueError:
-                flag_int = False
-            else:
-                continue
-        try:
-            value = float(value)
-        except ValueError:
-            flag_float = False
-            break
-    if flag_int:
+    # NumPy converts the strings, the first matching type is used
+    try:
         return np.array(values, dtype=np.int32)
-    if flag_float:
+    except ValueError:
+        pass
+    try:
         return np.array(values, dtype=np.float64)
-    return np.array(values, dtype=object)
+    except ValueError:
+        return np.array(values, dtype=object)
 
 def get_array_values(label, sizes, data):
     # Removing whitespaces at the edge of strings
@@ -259,54 +260,75 @@ def get_array_values(label, sizes, data):
             print("%s:" % (label,), values)
             sys.exit("Not all replaced JCAMP strings are restored (%d of %d)." % (restored, len(str_list)))
     else: # ... or a simple array (most frequently numeric)
-        values = re.findall(r'[^\s]+', data)
-        #values = data.split()
+        #values = re.findall(r'[^\s]+', data)
+        values = data.split()
         values = np.reshape(check_array_list(values), sizes)
 
     return values
 
-def read_param_file(filename):
-    # Open parameter file
-    try:
-        fid = open(filename, 'r')
-    except IOError as V:
-        if V.errno == 2:
-            sys.exit("Cannot open parameter file %s" % (filename,))
-        else:
-            raise
-
-    # Generate header information
-    header = collections.OrderedDict()
+def tokenize(fid):
+    # Single pass over a JCAMP file. Yields every LDR as (index, line, data,
+    # comment): index and text of the line starting with '##', the following
+    # lines joined without line breaks and whether a JCAMP comment ('$$') was
+    # found inside. Comment lines are yielded in file order as (index, line,
+    # None, False), those inside an LDR after the LDR.
+    text = fid.read()
+    if '\r' in text:
+        text = text.replace('\r\n', '\n')
+    index = 0
+    for chunk in re.split(r'\n(?=[ \t]*##)', text):
+        if '$$' not in chunk: # LDR without comments
+            line, _sep, data = chunk.partition('\n')
+            data = data.split('\n')
+            line = line.lstrip(' \t')
+            if line.startswith('##'):
+                yield (index, line, ''.join(data), False)
+            index += len(data) + 1 if len(_sep) > 0 else 1
+        else: # LDR or file header with comment lines
+            count = chunk.count('\n') + 1
+            record = None
+            comments = []
+            for offset, line in enumerate(chunk.split('\n')):
+                stripped = line.lstrip(' \t')
+                if (offset == 0) and stripped.startswith('##'):
+                    record = [index, stripped, [], '$$' in stripped]
+                elif stripped.startswith('$$'):
+                    comments.append((index + offset, stripped, None, False))
+                elif record is not None:
+                    record[2].append(line)
+                    record[3] = record[3] or ('$$' in line)
+            if record is not None:
+                yield (record[0], record[1], ''.join(record[2]), record[3])
+            for comment in comments:
+                yield comment
+            index += count
+
+def read_header_line(header, index, line):
+    # Add a header LDR (##label=value) or a comment ($$) to the header
     weekdays = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
 
-    line = ''
-    for index, line in enumerate(fid):
-        line = line.lstrip(' \t').rstrip('\r\n')
-        if line.startswith('##$'):
-            break
-        #print("line:%d:%s:" % (len(line), line))
-
-        if line.startswith('##'): # It's a variable with ##
-            # Retrieve the Labeled Data Record
-            label, value = strtok(line, delimiters='=')
-            label = strtok(label, delimiters='#')[0].strip()
-            value = strtok(value, delimiters='=')[0].strip()
-            # Save value without $
-            #value = strtok(value, delimiters='$')[0].strip()
-            header[label] = value
-        elif line.startswith('$$'): # It's a comment
-            comment = strtok(line, delimiters='$')[0].strip()
-            if comment.startswith('/'):
-                header['Path'] = comment
-            elif comment.startswith('process'):
-                header['Process'] = comment[8:]
+    if line.startswith('##'): # It's a variable with ##
+        # Retrieve the Labeled Data Record
+        label, value = strtok(line, delimiters='=')
+        label = strtok(label, delimiters='#')[0].strip()
+        value = strtok(value, delimiters='=')[0].strip()
+        # Save value without $
+        #value = strtok(value, delimiters='$')[0].strip()
+        header[label] = value
+    elif line.startswith('$$'): # It's a comment
+        comment = strtok(line, delimiters='$')[0].strip()
+        if comment.startswith('/'):
+            header['Path'] = comment
+        elif comment.startswith('process'):
+            header['Process'] = comment[8:]
+        else:
+            pos = strfind(comment[:10], '-')
+            if (comment[:3] in weekdays) or ((comment[:2] in ('19', '20')) and (len(pos) == 2)):
+                header['Date'] = comment
             else:
-                pos = strfind(comment[:10], '-')
-                if (comment[:3] in weekdays) or ((comment[:2] in ('19', '20')) and (len(pos) == 2)):
-                    header['Date'] = comment
-                else:
-                    header['Header' + str(index + 1)] = comment
+                header['Header' + str(index + 1)] = comment
 
+def check_version(header, filename):
     # Check if using a supported version of JCAMP file format
     if 'JCAMPDX' in header:
         version = float(header['JCAMPDX'])
@@ -318,53 +340,49 @@ def read_param_file(filename):
     if (version != 4.24) and (version != 5):
         print("Warning: JCAMP version %s is not supported (%s)." % (version, filename), file=sys.stderr)
 
-    params = collections.OrderedDict()
+def read_param_file(filename):
+    # Open parameter file
+    try:
+        fid = open(filename, 'r')
+    except IOError as V:
+        if V.errno == 2:
+            sys.exit("Cannot open parameter file %s" % (filename,))
+        else:
+            raise
 
-    # Loop for reading parameters
-    while line.lstrip(' \t').startswith('##'):
-        result = re.search(r'##(.*)=(.*)', line)
-        result = [] if result is None else list(result.groups())
+    # Generate header information
+    header = collections.OrderedDict()
+    params = collections.OrderedDict()
+    flag_header = True
+    label = None
+
+    # Loop for reading header and parameters
+    for index, line, data, flag_comment in tokenize(fid):
+        if flag_header and line.startswith('##$'):
+            check_version(header, filename)
+            flag_header = False
+        if flag_header:
+            read_header_line(header, index, line)
+            continue
+        if data is None: # Skip comment line
+            continue
 
         # Checking if label present and removing proprietary tag
-        try:
-            label = result[0]
-        except:
+        label, sep, value = line[2:].rpartition('=')
+        if len(sep) == 0:
             label = None
-        else:
-            if label.startswith('$'):
-                label = label[1:]
-            #print("label:%d:%s:" % (len(label), label))
-
-        # Checking if value present otherwise value is set to empty string
-        try:
-            value = result[1]
-        except:
-            value = ''
+            break
+        if label.startswith('$'):
+            label = label[1:]
+        #print("label:%d:%s:" % (len(label), label))
         #print("value:%d:%s:" % (len(value), value))
-
-        flag_comment = True if '$$' in line else False
-
-        line = ''
-        data = []
-        for line in fid:
-            if line.lstrip(' \t').startswith('##'):
-                break
-            if not line.lstrip(' \t').startswith('$$'): # Skip comment line
-                if (not flag_comment) and ('$$' in line):
-                    flag_comment = True
-                #data.append(line.rstrip('\\\r\n'))
-                data.append(line.rstrip('\r\n'))
-                #print("line:%d:%s:" % (len(data[-1]), data[-1]))
-
-        # Create data string
-        data = ''.join(data)
         #print("data:%d:%s:" % (len(data), data))
 
         if flag_comment:
             sys.exit("Found JCAMP comment ('$$') in LDR %s." % (label,))
 
         # Checking for END tag
-        if (label is None) or (label == 'END'):
+        if label == 'END':
             break
 
         # Checking if value is a string or an array, a struct or a single value
@@ -387,11 +405,75 @@ def read_param_file(filename):
 
     fid.close()
 
+    if flag_header:
+        check_version(header, filename)
+
     if label != 'END':
         sys.exit("Unexpected end of file: Missing END Statement")
 
     return (header, params)
 
+# Parsed parameter files of this process: key -> ((mtime, size), pickled parameters),
+# at most cache_size files, the least recently used one is dropped first
+cache_entries = collections.OrderedDict()
+cache_size = 64
+
+def remember_entry(key, entry):
+    cache_entries[key] = entry
+    cache_entries.move_to_end(key)
+    while len(cache_entries) > cache_size:
+        cache_entries.popitem(last=False)
+
+def cache_folder():
+    folder = os.environ.get('AIDA_PARAM_CACHE')
+    if folder is None:
+        folder = os.path.join(os.path.expanduser('~'), '.cache', 'AIDAmri', 'params')
+    return folder
+
+def read_cached(filename, parse, parser_id):
+    # Returns parse(filename) from the cache if the file is unchanged,
+    # otherwise parses it and stores the result. parser_id names the parser
+    # (not the module it was imported as), so all importers share the entries.
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return parse(filename)
+    state = (stat.st_mtime_ns, stat.st_size)
+    key = '\n'.join([VERSION, parser_id, os.path.realpath(filename)])
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    folder = cache_folder()
+    fpath = os.path.join(folder, key + '.pkl') if len(folder) > 0 else None
+
+    entry = cache_entries.get(key)
+    if (entry is None) and (fpath is not None) and os.path.isfile(fpath):
+        try:
+            with open(fpath, 'rb') as fid:
+                entry = pickle.load(fid)
+        except Exception: # A broken entry is replaced
+            entry = None
+    if (entry is not None) and (entry[0] == state):
+        remember_entry(key, entry)
+        return pickle.loads(entry[1])
+
+    result = parse(filename)
+    entry = (state, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+    remember_entry(key, entry)
+    if fpath is not None:
+        # Written under a temporary name, parallel processes may write the same entry
+        tmp_path = '%s.%d.tmp' % (fpath, os.getpid())
+        try:
+            if not os.path.isdir(folder):
+                os.makedirs(folder, exist_ok=True)
+            with open(tmp_path, 'wb') as fid:
+                pickle.dump(entry, fid, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, fpath)
+        except OSError as V:
+            print("Warning: Cannot write parameter cache %s (%s)." % (fpath, V), file=sys.stderr)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return result
+
 def main():
     import argparse
 
@@ -6,6 +6,7 @@
 #    Apr 29, 2019 01:28:17 PM CEST  platform: Darwin
 
 import sys, os
+import pipelineStages
 
 try:
     import Tkinter as tk
@@ -178,13 +179,16 @@ def open_cmd():
 
 
 def apply_cmdT():
-    os.chdir(dataPrefix.get())
-    print('cd ' + dataPrefix.get())
+    # run the selected script in this process (see pipelineStages), its modules
+    # stay imported for the next run
+    script = commandPrefix.get().split()[0]
     fullComand = pythonPrefix + commandPrefix.get() + filenameStr.get()
     print(fullComand)
-    os.system(fullComand)
+    try:
+        pipelineStages.runStage(script, filenameStr.get())
+    except RuntimeError as e:
+        print(e)
 
-    os.chdir('..')
     sys.stdout.flush()
     filenameStr.set("")
 
@@ -12,11 +12,66 @@ For the script to work, it needs to be placed within the /bin folder of AIDAmri.
 
 Example:
 python batchProc.py -f /Volumes/Desktop/MRI/proc_data -g Treatment_C3a Treatment_PBS -d Baseline P7 P14 P28 P42 P56 -t fMRI DTI
+
+The stages of all subjects form a dependency graph: the DTI and fMRI chains
+of a subject start as soon as its own T2w registration exists. With
+-j/--jobs N, N stages are processed at the same time:
+python batchProc.py -f /Volumes/Desktop/MRI/proc_data -g Treatment_C3a Treatment_PBS -d Baseline P7 -t T2w fMRI DTI -j 8
+
+Every subject folder gets a processingManifest.json with the input hashes,
+parameters and outputs of its finished stages. A rerun skips all stages whose
+inputs and parameters did not change; --force DTI_registration (or a data
+type, or all) processes selected stages again.
+
+Wall time, CPU time and peak memory of every processed stage are written to
+processingReport.json in the subject folder and, for the whole run, to
+processingReport_<date>_<time>.json in the project folder (see stageMetrics).
+
+The stages share a budget of threads (all cores or --threads N). Every stage
+gets the unused part of it divided by the number of stages that may still
+start, so the tools of all running stages together never use more threads
+than the budget (see threadBudget).
+
+Temporary files of the stages (scaled copies, split slices) are written to
+per-step folders below --scratch DIR (AIDA_SCRATCH, default: the system temp
+folder), preferably a local disk or tmpfs, and removed after each step.
+
+With --stageLocal the data type folder of a subject is copied to the scratch
+folder before its first stage, all its stages run on the local copy and only
+the results are copied back after every stage (see localStaging), e.g. for a
+proc_data folder on a network share:
+python batchProc.py -f /mnt/nfs/proc_data -g Treatment_C3a -d Baseline -t T2w fMRI DTI -j 4 --scratch /local/tmp --stageLocal
+
+The .nii.gz files written by the stages are compressed by several threads
+(see niiWriter.py). --niiLevel sets the zlib level
+(AIDA_NII_LEVEL), --fastIntermediates stores intermediate files like the
+scaled copies for FSL uncompressed and compresses only the results
+(AIDA_NII_POLICY=fast).
+
+With --plan nothing is processed: every subject and stage is listed with its
+state (up to date, to run, missing inputs) and the runtime is estimated from
+the reports of previous runs.
+
+With --index the subjects are taken from the raw data index written by
+conv2Nifti_auto.py --index (see rawIndex.py) instead of listing the group
+folders: the subject folders that hold converted scans of the given days and
+groups.
 """
 
 import glob
 import os
+import sys
 import fnmatch
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import pipelineStages
+import stageManifest
+import stageMetrics
+import threadBudget
+import localStaging
+import scratchSpace
+import rawIndex
 
 def findData(projectPath, days, groups):
     # This function screens all existing paths based on the specified days
@@ -30,110 +85,381 @@ def findData(projectPath, days, groups):
             fullPath_list.append(os.path.join(checkPath, subject))
     return(fullPath_list)
 
-def executeScripts(fullPath, dataTypeInput, *optargs):
-    # For every datatype (T2w, fMRI, DTI), go in all days/group/subjects folders
-    # and execute the respective (pre-)processing/registration-scripts.
-    # If a certain file does not exist, a note will be created in the errorList.
-    # cwd should contain the path of the /bin folder (the user needs to navigate to the /bin folder before executing this script)
-    errorList = [];
-    message = '';
-    cwd = str(os.getcwd())
+# Stages of one subject as a dependency graph. Every stage lists the files it
+# needs relative to the subject folder (the first one is handed to the script
+# with -i), the stages it depends on and the files it produces. Stages of
+# data types that are not processed in the current run are not waited for,
+# their outputs only have to exist.
+STAGES = [
+    {'name': 'T2w_preProcessing', 'dataType': 'T2w',
+     'script': 'preProcessing_T2.py',
+     'inputs': ['T2w/*1.nii.gz'], 'requires': [],
+     'outputs': ['T2w/*BiasBet.nii.gz']},
+    {'name': 'T2w_registration', 'dataType': 'T2w',
+     'script': 'registration_T2.py',
+     'inputs': ['T2w/*BiasBet.nii.gz'], 'requires': ['T2w_preProcessing'],
+     'outputs': ['T2w/*MatrixBspline.nii', 'T2w/*_Anno.nii.gz', 'T2w/*_TemplateAllen.nii.gz']},
+    # the incidence size needs a manually drawn stroke mask, without one it is skipped
+    {'name': 'T2w_incidenceSize_par', 'dataType': 'T2w', 'optional': True,
+     'script': 'getIncidenceSize_par.py',
+     'inputs': ['T2w', 'T2w/*Stroke_mask.nii.gz'], 'requires': ['T2w_registration'],
+     'outputs': ['T2w/affectedRegions_Parental.txt']},
+    {'name': 'T2w_incidenceSize', 'dataType': 'T2w', 'optional': True,
+     'script': 'getIncidenceSize.py',
+     'inputs': ['T2w', 'T2w/*Stroke_mask.nii.gz'], 'requires': ['T2w_registration'],
+     'outputs': ['T2w/affectedRegions.txt']},
+    {'name': 'DTI_preProcessing', 'dataType': 'DTI',
+     'script': 'preProcessing_DTI.py',
+     'inputs': ['DTI/*1.nii.gz'], 'requires': [],
+     'outputs': ['DTI/*SmoothMicoBet.nii.gz']},
+    {'name': 'DTI_registration', 'dataType': 'DTI',
+     'script': 'registration_DTI.py',
+     'inputs': ['DTI/*SmoothMicoBet.nii.gz', 'T2w/*BiasBet.nii.gz', 'T2w/*MatrixBspline.nii',
+                'T2w/*_Anno.nii.gz', 'T2w/*_TemplateAllen.nii.gz'],
+     'requires': ['DTI_preProcessing', 'T2w_registration'],
+     'outputs': ['DTI/DSI_studio/*BetMask_scaled.nii', 'DTI/DSI_studio/*Anno_scaled.nii']},
+    {'name': 'DTI_connectivity', 'dataType': 'DTI',
+     'script': 'dsi_main.py',
+     'inputs': ['DTI/*1.nii.gz', 'DTI/DSI_studio/*BetMask_scaled.nii'], 'requires': ['DTI_registration'],
+     'outputs': ['DTI/connectivity/*']},
+    {'name': 'fMRI_preProcessing', 'dataType': 'fMRI',
+     'script': 'preProcessing_fMRI.py',
+     'inputs': ['fMRI/*1.nii.gz'], 'requires': [],
+     'outputs': ['fMRI/*SmoothBet.nii.gz']},
+    {'name': 'fMRI_registration', 'dataType': 'fMRI',
+     'script': 'registration_rsfMRI.py',
+     'inputs': ['fMRI/*SmoothBet.nii.gz', 'T2w/*BiasBet.nii.gz', 'T2w/*MatrixBspline.nii',
+                'T2w/*_Anno.nii.gz', 'T2w/*_TemplateAllen.nii.gz'],
+     'requires': ['fMRI_preProcessing', 'T2w_registration'],
+     'outputs': ['fMRI/*_Anno_rsfMRI.nii.gz', 'fMRI/*_AnnoSplit_rsfMRI.nii.gz']},
+    {'name': 'fMRI_processing', 'dataType': 'fMRI',
+     'script': 'process_fMRI.py',
+     'inputs': ['fMRI/*1.nii.gz', 'fMRI/*_Anno_rsfMRI.nii.gz'], 'requires': ['fMRI_registration'],
+     'outputs': ['fMRI/regr/*SFRGR.nii.gz']},
+]
+
+# Intermediate files that stay on the local copy with --stageLocal (relative to
+# the subject folder). Everything else the stages write is copied back.
+STAGING_EXCLUDES = [
+    'DTI/src/*.src.gz',
+    'fMRI/regr/*_f.nii.gz',
+    'fMRI/regr/*_f_st.nii.gz',
+    'fMRI/regr/*_intnorm.nii.gz',
+    'fMRI/regr/mask.nii.gz',
+    'fMRI/regr/mean_func.nii.gz',
+    'fMRI/regr/tempMean.nii.gz',
+]
+
+def findInputs(subjectPath, stage):
+    # Resolves the inputs of a stage within the subject folder. Returns the
+    # list of found files and the list of patterns without a match.
+    found = []
+    missing = []
+    for pattern in stage['inputs']:
+        path = os.path.join(subjectPath, pattern)
+        if not glob.has_magic(pattern):
+            files = [path] if os.path.exists(path) else []
+        else:
+            files = find(os.path.basename(pattern), os.path.dirname(path))
+        if len(files) > 0:
+            found.append(files[0])
+        else:
+            missing.append(pattern)
+    return found, missing
+
+def findOutputs(subjectPath, stage):
+    # Returns the declared outputs of a stage that do not exist (yet)
+    return [pattern for pattern in stage['outputs'] if len(glob.glob(os.path.join(subjectPath, pattern))) == 0]
+
+def stageArguments(stage, optargs=()):
+    # Keyword arguments of a stage function besides the input file
+    kwargs = {}
+    # Appends optional (fa0, nii_gz) flags to DTI main process if passed
+    if stage['name'] == 'DTI_connectivity' and len(optargs) > 0:
+        kwargs['optional'] = [a for arg in optargs for a in str(arg).split()]
+    return kwargs
+
+def runStage(stage, inputFile, kwargs, threads):
+    # Worker function: runs one stage of one subject in this worker process.
+    # The workers live for the whole batch, so the stage modules (nipype,
+    # nibabel, scipy, ...) are imported only once per worker.
+    # Returns the resource usage of the stage and the error message, if it failed.
+    print('Run %s -i %s (%d threads)' % (stage['script'], inputFile, threads))
+    measurement = stageMetrics.startMeasurement()
+    try:
+        with threadBudget.limitThreads(threads):
+            pipelineStages.runStage(stage['script'], inputFile, **kwargs)
+    except Exception as e:
+        return stageMetrics.stopMeasurement(measurement), str(e)
+    return stageMetrics.stopMeasurement(measurement), None
+
+def isForced(stage, force):
+    # True if the stage is selected by --force (stage name, data type or 'all')
+    return 'all' in force or stage['name'] in force or stage['dataType'] in force
+
+def buildGraph(fullPath, dataTypeInput):
+    # Creates the stage nodes (subjectPath, stage) of all subjects for the
+    # requested data types. Missing data type folders are reported directly.
+    nodes = []
+    errorList = []
     for dataFormat in dataTypeInput:
-        for currentPath in fullPath:
-            currentPath_wData = os.path.join(currentPath,dataFormat)
-            # currentPath_wData = projectfolder/day/group/subject/dataFormat (e.g. T2w, fMRI, DTI)
-            if os.path.isdir(currentPath_wData):
-                if dataFormat == 'T2w':
-                    os.chdir(cwd + '/2.1_T2PreProcessing')
-                    currentFile = find("*1.nii.gz", currentPath_wData)
-                    if len(currentFile)>0:
-                        print('Run python 2.1_T2PreProcessing/preProcessing_T2.py -i '+currentFile[0])
-                        os.system('python preProcessing_T2.py -i '+currentFile[0])
-                    else:
-                        message = 'Could not find *1.nii.gz in '+currentPath_wData;
-                        print(message)
-                        errorList.append(message)
-                    currentFile = find("*BiasBet.nii.gz", currentPath_wData)
-                    if len(currentFile)>0:
-                        print('Run python 2.1_T2PreProcessing/registration_T2.py -i '+currentFile[0])
-                        os.system('python registration_T2.py -i '+currentFile[0])
-                    else:
-                        message = 'Could not find *BiasBet.nii.gz in '+currentPath_wData;
-                        print(message)
-                        errorList.append(message)
-                    print('Run python 3.1_T2Processing/getIncidenceSize_par.py -i '+currentPath_wData)
-                    os.chdir(cwd + '/3.1_T2Processing')
-                    os.system('python getIncidenceSize_par.py -i '+currentPath_wData)
-                    print('Run python 3.1_T2Processing/getIncidenceSize.py -i '+currentPath_wData)
-                    os.system('python getIncidenceSize.py -i '+currentPath_wData)
-                    os.chdir(cwd)
-                elif dataFormat == 'fMRI':
-                    os.chdir(cwd + '/2.3_fMRIPreProcessing')
-                    currentFile = find("*1.nii.gz", currentPath_wData)
-                    if len(currentFile)>0:
-                        print('Run python 2.3_fMRIPreProcessing/preProcessing_fMRI.py -i '+currentFile[0])
-                        os.system('python preProcessing_fMRI.py -i '+currentFile[0])
-                    else:
-                        message = 'Could not find *1.nii.gz in '+currentPath_wData;
-                        print(message)
-                        errorList.append(message)
-                    currentFile = find("*SmoothBet.nii.gz", currentPath_wData)
-                    if len(currentFile)>0:
-                        print('Run python 2.3_fMRIPreProcessing/registration_rsfMRI.py -i '+currentFile[0])
-                        os.system('python registration_rsfMRI.py -i '+currentFile[0])
-                    else:
-                        message = 'Could not find *SmoothBet.nii.gz in '+currentPath_wData;
-                        print(message)
-                        errorList.append(message)
-                    currentFile = find("*1.nii.gz", currentPath_wData)
-                    if len(currentFile)>0:
-                        print('Run python 3.3_fMRIActivity/process_fMRI.py -i '+ currentFile[0])
-                        os.chdir(cwd + '/3.3_fMRIActivity')
-                        os.system('python process_fMRI.py -i '+ currentFile[0])
-                    os.chdir(cwd)
-                elif dataFormat == 'DTI':
-                    os.chdir(cwd + '/2.2_DTIPreProcessing')
-                    currentFile = find("*1.nii.gz", currentPath_wData)
-                    if len(currentFile)>0:
-                        print('Run python 2.2_DTIPreProcessing/preProcessing_DTI.py -i '+currentFile[0])
-                        os.system('python preProcessing_DTI.py -i '+currentFile[0])
-                    else:
-                        message = 'Could not find *1.nii.gz in '+currentPath_wData;
-                        print(message)
-                        errorList.append(message)
-                    currentFile = find("*SmoothMicoBet.nii.gz", currentPath_wData)
-                    if len(currentFile)>0:
-                        print('Run python 2.2_DTIPreProcessing/registration_DTI.py -i '+currentFile[0])
-                        os.system('python registration_DTI.py -i '+currentFile[0])
+        if dataFormat not in [stage['dataType'] for stage in STAGES]:
+            errorList.append('The data folders'' names do not match T2w, fMRI or DTI')
+    for currentPath in fullPath:
+        # the scripts run in their stage folders, so relative paths would break
+        currentPath = os.path.abspath(currentPath)
+        for dataFormat in dataTypeInput:
+            stages = [stage for stage in STAGES if stage['dataType'] == dataFormat]
+            if len(stages) == 0:
+                continue
+            if not os.path.isdir(os.path.join(currentPath, dataFormat)):
+                errorList.append('The folder '+dataFormat+' does not exist in '+currentPath)
+                continue
+            nodes += [(currentPath, stage) for stage in stages]
+    return nodes, errorList
+
+def executeScripts(fullPath, dataTypeInput, *optargs, jobs=1, force=(), reportFolder=None, threads=None,
+                   stageLocal=False, scratchRoot=None):
+    # Runs all stages of all subjects as a dependency graph on a pool of jobs
+    # long-lived worker processes, which call the stage functions directly
+    # (see pipelineStages). A stage is started as soon as the stages it depends on
+    # are finished for the same subject, so the T2w, DTI and fMRI chains of
+    # different subjects run side by side. If a certain file does not exist,
+    # a note will be created in the errorList.
+    # Stages whose inputs and parameters did not change since their last run
+    # (see stageManifest) are skipped, unless they or one of the stages they
+    # depend on are processed again or they are selected by force.
+    # The resource usage of all stages is summarized at the end and written to
+    # a report in reportFolder (see stageMetrics).
+    # The running stages share threads threads (default: all cores).
+    # With stageLocal every data type chain of a subject runs on a copy below
+    # scratchRoot (see localStaging).
+    if threads is None:
+        threads = threadBudget.availableCores()
+    runStart = time.perf_counter()
+    records = []
+    nodes, errorList = buildGraph(fullPath, dataTypeInput)
+    inGraph = set((subjectPath, stage['name']) for subjectPath, stage in nodes)
+    status = {}
+    running = {}
+    pending = list(nodes)
+    processed = set()
+    manifests = {}
+    staged = {}
+    chains = {}
+    for subjectPath, stage in nodes:
+        chains.setdefault((subjectPath, stage['dataType']), set()).add((subjectPath, stage['name']))
+    for subjectPath, stage in nodes:
+        if subjectPath not in manifests:
+            manifests[subjectPath] = stageManifest.loadManifest(subjectPath)
+        if isForced(stage, force):
+            stageManifest.invalidateStage(manifests[subjectPath], stage['name'])
+
+    def finish(key, state, message=None, metrics=None):
+        status[key] = state
+        record = dict(metrics or {}, subject=key[0], stage=key[1], status=state)
+        records.append(record)
+        if metrics is not None:
+            stageMetrics.updateReport(key[0], key[1], record)
+        # the local copy is removed as soon as its chain is finished
+        for chain, keys in chains.items():
+            if key in keys and chain in staged and all(k in status for k in keys):
+                localStaging.cleanUp(staged.pop(chain))
+        if message is not None:
+            print(message)
+            errorList.append(message)
+
+    # A worker killed by a signal (segfault, OOM killer) breaks the pool: the stages
+    # running on it fail and the next ones are run by a new pool
+    pool = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        while pending or running:
+            for node in list(pending):
+                # at most jobs stages are handed to the pool, the others wait here,
+                # so a broken pool only takes the running stages with it
+                if len(running) >= jobs:
+                    break
+                subjectPath, stage = node
+                key = (subjectPath, stage['name'])
+                requires = [(subjectPath, name) for name in stage['requires'] if (subjectPath, name) in inGraph]
+                if any(req not in status for req in requires):
+                    continue
+                pending.remove(node)
+                failed = [req[1] for req in requires if status[req] not in ('done', 'unchanged')]
+                if len(failed) > 0 and not stage.get('optional', False):
+                    finish(key, 'skipped', 'Skipped %s of %s because %s did not finish' % (stage['name'], subjectPath, ', '.join(failed)))
+                    continue
+                inputs, missing = findInputs(subjectPath, stage)
+                if len(missing) > 0:
+                    if stage.get('optional', False):
+                        finish(key, 'skipped')
                     else:
-                        message = 'Could not find *SmoothMicoBet.nii.gz in '+currentPath_wData;
-                        print(message)
-                        errorList.append(message)
-                    currentFile = find("*1.nii.gz", currentPath_wData)
-
-                    # Appends optional (fa0, nii_gz) flags to DTI main process if passed
-                    if len(currentFile)>0:
-                        cli_str = r'dsi_main.py -i %s' % currentFile[0]
-                        if len(optargs) > 0:
-                            cli_str += ' -o'
-                            for arg in optargs:
-                                cli_str += ' %s' % arg
-                        print('Run python 3.2_DTIConnectivity/%s' % cli_str)
-                        os.chdir(cwd + '/3.2_DTIConnectivity')
-                        os.system('python %s' % cli_str)
-                    os.chdir(cwd)
+                        finish(key, 'failed', 'Could not find %s in %s' % (', '.join(missing), subjectPath))
+                    continue
+                kwargs = stageArguments(stage, optargs)
+                params = dict(kwargs, script=stage['script'])
+                manifest = manifests[subjectPath]
+                if not any(req in processed for req in requires) and \
+                        stageManifest.isUpToDate(subjectPath, manifest, stage['name'], inputs, params, stage['outputs']):
+                    finish(key, 'unchanged')
+                    print('Skip %s of %s - inputs and parameters unchanged' % (stage['name'], subjectPath))
+                    continue
+                stageManifest.invalidateStage(manifest, stage['name'])
+                stageManifest.saveManifest(subjectPath, manifest)
+                runPath = subjectPath
+                if stageLocal:
+                    chain = (subjectPath, stage['dataType'])
+                    if chain not in staged:
+                        try:
+                            staged[chain] = localStaging.stageIn(subjectPath, stage['dataType'], scratchRoot)
+                        except OSError as e:
+                            finish(key, 'failed', 'Could not copy %s of %s to the scratch folder: %s' % (stage['dataType'], subjectPath, e))
+                            continue
+                        print('Copied %s of %s to %s' % (stage['dataType'], subjectPath, staged[chain]['root']))
+                    # the same files, but on the local copy
+                    runPath = staged[chain]['subject']
+                    inputs, missing = findInputs(runPath, stage)
+                usedThreads = sum(item[4] for item in running.values())
+                stageThreads = threadBudget.shareThreads(threads, usedThreads, min(jobs - len(running), len(pending) + 1))
+                try:
+                    future = pool.submit(runStage, stage, inputs[0], kwargs, stageThreads)
+                except BrokenProcessPool:
+                    pool.shutdown()
+                    pool = ProcessPoolExecutor(max_workers=jobs)
+                    future = pool.submit(runStage, stage, inputs[0], kwargs, stageThreads)
+                running[future] = (key, stage, inputs, params, stageThreads, runPath)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, stage, inputs, params, stageThreads, runPath = running.pop(future)
+                processed.add(key)
+                try:
+                    metrics, error = future.result()
+                except BrokenProcessPool:
+                    metrics, error = None, 'the worker process was terminated (e.g. a crash or out of memory)'
+                except Exception as e:
+                    metrics, error = None, e
+                missing = findOutputs(runPath, stage)
+                if runPath != key[0]:
+                    # results (and logs of failed stages) are copied back after every stage
+                    try:
+                        localStaging.syncBack(staged[(key[0], stage['dataType'])], STAGING_EXCLUDES)
+                    except OSError as e:
+                        error = 'could not copy the results back: %s' % (e,)
+                if error is not None:
+                    finish(key, 'failed', 'Processing of %s in %s failed: %s' % (stage['name'], key[0], error), metrics)
+                    continue
+                if len(missing) > 0:
+                    finish(key, 'failed', '%s of %s did not create %s' % (stage['name'], key[0], ', '.join(missing)), metrics)
                 else:
-                    message = 'The data folders'' names do not match T2w, fMRI or DTI';
-                    print(message);
-                    errorList.append(message)
-            else:
-                message = 'The folder '+dataFormat+' does not exist in '+currentPath
-                print(message)
-                errorList.append(message)
+                    manifest = manifests[key[0]]
+                    stageManifest.recordStage(runPath, manifest, stage['name'], inputs, params, stage['outputs'])
+                    stageManifest.saveManifest(key[0], manifest)
+                    finish(key, 'done', metrics=metrics)
+                    print('Finished %s of %s in %.1f s' % (stage['name'], key[0], metrics['wallTime']))
+    finally:
+        pool.shutdown()
+    report = {'jobs': jobs, 'wallTime': time.perf_counter() - runStart, 'records': records,
+              'stages': stageMetrics.summarizeStages(records)}
+    if reportFolder is not None:
+        report = stageMetrics.writeCohortReport(reportFolder, records, report['wallTime'], jobs)
+    stageMetrics.printSummary(report)
     print('')
     print('Errors:')
     print(errorList)
- 
+    return errorList
+
+def estimateStage(subjectPath, stageName, reports):
+    # Expected wall time of a stage: the last measurement of this subject or
+    # the mean over all subjects, None if the stage was never measured
+    record = reports[subjectPath]['stages'].get(stageName)
+    if record is not None and record.get('status') == 'done':
+        return record['wallTime']
+    times = [report['stages'][stageName]['wallTime'] for report in reports.values()
+             if report['stages'].get(stageName, {}).get('status') == 'done']
+    if len(times) == 0:
+        return None
+    return sum(times) / len(times)
+
+def planScripts(fullPath, dataTypeInput, *optargs, jobs=1, force=()):
+    # Dry run of executeScripts: lists the state of every stage of every
+    # subject without processing or changing anything and estimates the
+    # runtime from previous reports. Inputs which a stage to run creates
+    # are not required to exist. Returns the list of stages to run.
+    nodes, errorList = buildGraph(fullPath, dataTypeInput)
+    inGraph = set((subjectPath, stage['name']) for subjectPath, stage in nodes)
+    stagesByName = dict((stage['name'], stage) for stage in STAGES)
+    manifests = {}
+    reports = {}
+    for subjectPath, stage in nodes:
+        if subjectPath not in manifests:
+            manifests[subjectPath] = stageManifest.loadManifest(subjectPath)
+            reports[subjectPath] = stageMetrics.loadReport(subjectPath)
+
+    # STAGES is ordered, so the stages a stage depends on are planned before it
+    state = {}
+    estimates = {}
+    toRun = []
+    currentSubject = None
+    for subjectPath, stage in nodes:
+        key = (subjectPath, stage['name'])
+        if subjectPath != currentSubject:
+            currentSubject = subjectPath
+            print('')
+            print(subjectPath)
+        requires = [(subjectPath, name) for name in stage['requires'] if (subjectPath, name) in inGraph]
+        planned = [req for req in requires if state[req] == 'run']
+        blocked = [req[1] for req in requires if state[req] in ('missing', 'blocked')]
+        created = [pattern for req in planned for pattern in stagesByName[req[1]]['outputs']]
+        inputs, missing = findInputs(subjectPath, stage)
+        missing = [pattern for pattern in missing if pattern not in created]
+        estimate = estimateStage(subjectPath, stage['name'], reports)
+        if len(blocked) > 0 and not stage.get('optional', False):
+            state[key] = 'blocked'
+            note = 'blocked by ' + ', '.join(blocked)
+        elif len(missing) > 0:
+            state[key] = 'skip' if stage.get('optional', False) else 'missing'
+            note = 'missing ' + ', '.join(missing)
+        elif len(planned) == 0 and not isForced(stage, force) and \
+                stageManifest.isUpToDate(subjectPath, manifests[subjectPath], stage['name'], inputs,
+                                         dict(stageArguments(stage, optargs), script=stage['script']), stage['outputs']):
+            state[key] = 'up to date'
+            note = ''
+        else:
+            state[key] = 'run'
+            toRun.append(key)
+            estimates[key] = estimate
+            note = 'estimated %.0f s' % estimate if estimate is not None else 'no previous measurement'
+        print('  %-24s %-11s %s' % (stage['name'], state[key], note))
+
+    # the chains of one subject are sequential, the subjects are processed side by side
+    known = [t for t in estimates.values() if t is not None]
+    longestChain = 0.0
+    for subjectPath in manifests:
+        finished = {}
+        for node in nodes:
+            key = (node[0], node[1]['name'])
+            if node[0] != subjectPath:
+                continue
+            start = max([finished.get((subjectPath, name), 0.0) for name in node[1]['requires']] + [0.0])
+            finished[key] = start + (estimates.get(key) or 0.0)
+        longestChain = max([longestChain] + list(finished.values()))
+    print('')
+    print('Plan: %d stages to run, %d up to date, %d with missing inputs, %d blocked' % (
+        len(toRun), list(state.values()).count('up to date'), list(state.values()).count('missing'),
+        list(state.values()).count('blocked')))
+    if len(known) > 0:
+        print('Estimated processing time: %.1f h of stage time, about %.1f h with %d jobs' % (
+            sum(known) / 3600.0, max(sum(known) / jobs, longestChain) / 3600.0, jobs))
+    if len(known) < len(estimates):
+        print('%d stages to run were never measured and are not part of the estimate' % (len(estimates) - len(known)))
+    if len(errorList) > 0:
+        print('')
+        print('Errors:')
+        print(errorList)
+    return toRun
+
 def find(pattern, path):
     # This function finds all files with a specified fragment within
     # the given path
@@ -157,6 +483,16 @@ if __name__ == "__main__":
     optionalNamed = parser.add_argument_group('optional arguments')
     optionalNamed.add_argument('-o', '--optional', nargs = '*', help = 'Optional arguments.\n\t"fa0": Renames the FA metric data to former DSI naming convention.\n\t"nii_gz": Converts ROI labeling relating files from .nii to .nii.gz format to match former data structures.')
 
+    optionalNamed.add_argument('-j', '--jobs', type=int, default=1, help='Number of stages processed in parallel (default: 1)')
+    optionalNamed.add_argument('--threads', type=int, default=None, help='Number of threads shared by all stages processed in parallel (default: all cores)')
+    optionalNamed.add_argument('--scratch', default=None, help='Folder for the temporary files of the stages, e.g. on a local disk or tmpfs (default: AIDA_SCRATCH or the system temp folder)')
+    optionalNamed.add_argument('--stageLocal', action='store_true', help='Process every data type folder on a copy in the scratch folder and copy only the results back, e.g. if the project folder is on a network share')
+    optionalNamed.add_argument('--niiLevel', type=int, default=None, help='zlib level 0-9 of the written .nii.gz files (default: AIDA_NII_LEVEL or 1)')
+    optionalNamed.add_argument('--fastIntermediates', action='store_true', help='Write intermediate .nii.gz files uncompressed, only the results are compressed')
+    optionalNamed.add_argument('--plan', action='store_true', help='Only list the state of every stage and estimate the runtime, nothing is processed')
+    optionalNamed.add_argument('--index', nargs='?', const='', default=None, help='Find the subjects in the raw data index of conv2Nifti_auto.py --index (optionally the path of the database, default: %s next to the project folder)' % (rawIndex.indexName,))
+    optionalNamed.add_argument('--force', nargs='+', default=[], help='Process these stages again even if their inputs and parameters did not change. Stage names (e.g. DTI_registration), data types (e.g. DTI) or all. Available stages: '+', '.join(stage['name'] for stage in STAGES))
+
     args = parser.parse_args()
     pathToData = args.folder
     groupNames = args.groups
@@ -173,8 +509,37 @@ if __name__ == "__main__":
     print(dataTypes)
     print('Optional arguments: [%s]' % optionals)
 
-    listMr = findData(pathToData, dayNames, groupNames)
+    if args.jobs < 1:
+        sys.exit("Error: The number of jobs has to be at least 1.")
+    if args.threads is not None and args.threads < args.jobs:
+        sys.exit("Error: The number of threads has to be at least the number of jobs.")
+    if args.scratch is not None:
+        if not os.path.isdir(args.scratch):
+            sys.exit("Error: '%s' is not an existing directory." % (args.scratch,))
+        # inherited by the worker processes and the tools they start
+        os.environ['AIDA_SCRATCH'] = os.path.abspath(args.scratch)
+    if args.niiLevel is not None:
+        if not 0 <= args.niiLevel <= 9:
+            sys.exit("Error: The compression level has to be between 0 and 9.")
+        os.environ['AIDA_NII_LEVEL'] = str(args.niiLevel)
+    if args.fastIntermediates:
+        os.environ['AIDA_NII_POLICY'] = 'fast'
+
+    if args.index is None:
+        listMr = findData(pathToData, dayNames, groupNames)
+    else:
+        database = args.index or rawIndex.defaultDatabase(pathToData)
+        if not os.path.isfile(database):
+            sys.exit("Error: '%s' is no raw data index, run conv2Nifti_auto.py with --index first." % (database,))
+        rawIndex.updateProcPaths(database, pathToData, dayNames)
+        listMr = rawIndex.subjectFolders(database, pathToData, dayNames, groupNames)
+    if args.plan:
+        optargs = (optionals,) if optionals is not None else ()
+        planScripts(listMr, dataTypes, *optargs, jobs=args.jobs, force=args.force)
+        sys.exit(0)
     if optionals is not None:
-        executeScripts(listMr, dataTypes, optionals)
+        executeScripts(listMr, dataTypes, optionals, jobs=args.jobs, force=args.force, reportFolder=pathToData,
+                       threads=args.threads, stageLocal=args.stageLocal, scratchRoot=scratchSpace.scratchRoot())
     else:
-        executeScripts(listMr, dataTypes)
+        executeScripts(listMr, dataTypes, jobs=args.jobs, force=args.force, reportFolder=pathToData,
+                       threads=args.threads, stageLocal=args.stageLocal, scratchRoot=scratchSpace.scratchRoot())
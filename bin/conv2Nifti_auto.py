@@ -17,11 +17,24 @@ created in the same directory where the raw data folder is located.
 
 Example:
 python conv2Nifti_auto.py -f /Volumes/Desktop/MRI/raw_data -d Baseline P1 P7 P14
+
+With -j several subjects are converted at the same time and with -s the scans of
+each subject, e.g. -j 4 -s 2 keeps up to eight conversions running. With
+--protocols T2w,DTI,fMRI only the scans of these protocol classes are converted.
+
+With --index the subject folders are taken from the raw data index (see
+rawIndex.py), which is updated first, instead of listing the day folders.
+Study folders without any indexed scan (no visu_pars) are still added from
+the day folders, so the same subjects are converted as without --index.
 """
 
 import os
+import sys
 import csv
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pipelineStages
+import rawIndex
 
 def findData(projectPath, days):
 # This function screens all existing paths based on the specified days
@@ -35,12 +48,25 @@ def findData(projectPath, days):
             fullPath_list.append(os.path.join(checkPath, subject))
     return(fullPath_list)
     
-def convertToNifti(subjectFolder):
-    print('Run python 1_PV2NIfTiConverter/pv_conv2Nifti.py -i '+subjectFolder)
-    os.system('python 1_PV2NIfTiConverter/pv_conv2Nifti.py -i '+subjectFolder)
+def convertToNifti(subjectFolder, scanJobs=1, protocols=None):
+    # The converter runs in this process, so its modules are imported only once.
+    # Returns False if the conversion of the subject failed, the other subjects
+    # are converted anyway.
+    print('Run 1_PV2NIfTiConverter/pv_conv2Nifti.py -i '+subjectFolder)
+    try:
+        pipelineStages.runStage('pv_conv2Nifti.py', subjectFolder, jobs=scanJobs, protocols=protocols)
+    except Exception as e:
+        reportFailure(subjectFolder, e)
+        return False
     print('Done')
+    return True
+
+def reportFailure(subjectFolder, error):
+    print("Error: '%s' could not be converted (%s: %s)." % (subjectFolder, type(error).__name__, error))
     
 def moveFolder(newSubjectFolder, destination):
+    # Only called by the main process, the workers just convert
+    os.makedirs(destination, exist_ok=True)
     shutil.move(newSubjectFolder, destination)
     
 def getGroupName(subjectName):
@@ -56,6 +82,22 @@ def getSubjectAndDay(subjectPath):
     dayName = os.path.basename(dayPath)
     return subjectName, dayName
 
+def moveSubject(procDataFolder, subjectFolder, subGroup):
+# Moves the new generated, processed subject folder to proc_data/day/group
+    subName, subDay = getSubjectAndDay(subjectFolder)
+    currentDest = os.path.join(subjectFolder,subName)
+    moveFolder(currentDest,os.path.join(procDataFolder,subDay,subGroup))
+
+def finishSubject(procDataFolder, subjectFolder, subGroup, converted, failed):
+# Moves a converted subject, failed subjects are collected and not moved
+    if converted:
+        try:
+            moveSubject(procDataFolder, subjectFolder, subGroup)
+            return
+        except Exception as e:
+            reportFailure(subjectFolder, e)
+    failed.append(subjectFolder)
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description='This script automates the conversion from the raw bruker data format to the NIfTI format using 1_PV2NIfTiConverter/pv_conv2Nifti.py. The raw data needs to be in the following structure: projectfolder/days/subjects/data/. For this script to work, the groupMapping.csv needs to be adjusted, where the group name of every subject''s folder in the raw data structure needs to be specified. This script computes the converison either for all data in the raw project folder or for certain days and/or groups specified through the optional arguments -d and -g. During the processing a new folder called proc_data is being created in the same directory where the raw data folder is located. Example: python conv2Nifti_auto.py -f /Volumes/Desktop/MRI/raw_data -d Baseline P1 P7 P14 P28')
@@ -63,67 +105,101 @@ if __name__ == "__main__":
                         help='Path to the parent project folder of the dataset, e.g. raw_data')
     parser.add_argument('-g', '--groups', nargs='+', type=str, required=False, help='Group names as in the bruker raw project folder')
     parser.add_argument('-d', '--days', nargs='+', type=str, required=False, help='Day names as in the bruker raw project folder')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of subjects converted in parallel - default: 1')
+    parser.add_argument('-s', '--scanJobs', type=int, default=1, help='Number of scans of a subject converted in parallel - default: 1')
+    parser.add_argument('--protocols', type=str, default=None, help='Comma separated protocol classes to convert, e.g. T2w,DTI,fMRI,T2map - default: all scans')
+    parser.add_argument('--index', nargs='?', const='', default=None, help='Find the subjects in the raw data index (optionally the path of the database, default: %s next to the raw project folder)' % (rawIndex.indexName,))
 
     args = parser.parse_args()
     pathToRawData = args.folder
     groupNames = args.groups
     dayNames = args.days
+    if args.jobs < 1 or args.scanJobs < 1:
+        sys.exit("Error: The number of jobs must be at least 1.")
+    protocols = None
+    if args.protocols is not None:
+        protocols = pipelineStages.loadModule('1_PV2NIfTiConverter', 'pv_conv2Nifti').parseProtocols(args.protocols)
+
+    print('Entered information:')
+
+    if dayNames == None:
+        # if no days were specified, collect all subfolders (day folders) within the
+        # raw project folder
+        dayNames = [f.name for f in os.scandir(pathToRawData) if f.is_dir()]
+    print('Days to process: ', dayNames)
+
+    # Open the *.csv-file, read the subject/group pairs and save both columns in separate lists
+    csv_listSubjects = []
+    csv_listGroups = []
+    with open('groupMapping.csv', newline='') as csv_file:
+        reader = csv.reader(csv_file, delimiter=';')
+        next(reader, None) # Skip the header
+        for subjects, groups in reader:
+            csv_listSubjects.append(subjects)
+            csv_listGroups.append(groups)
+
+    if groupNames == None:
+        # If no groups were specified, get all unique names of the .csv group column
+        # using set()
+        groupNames = list(set(csv_listGroups))
+    print('Groups to process: ', groupNames)
+
+    # Get all subject paths (projectfolder/days/subjects/)
+    if args.index is None:
+        rawData_subfolders = findData(pathToRawData,dayNames)
+    else:
+        database = args.index or rawIndex.defaultDatabase(pathToRawData)
+        parsed, unchanged, removed = rawIndex.updateIndex(pathToRawData, database, dayNames)
+        print('Raw data index: %d scans parsed, %d unchanged, %d removed' % (parsed, unchanged, removed))
+        rawData_subfolders = rawIndex.studyFolders(database, dayNames)
+        # study folders without any reconstruction (visu_pars) are not in the index
+        for folder in findData(pathToRawData, [day for day in dayNames if os.path.isdir(os.path.join(pathToRawData, day))]):
+            folder = os.path.abspath(folder)
+            if folder not in rawData_subfolders:
+                print("Notice: '%s' has no indexed scans, it is converted like without --index." % (folder,))
+                rawData_subfolders.append(folder)
+
+    #countSubjects = 0
+    #countSubjects = [csv_listGroups.count(group) for group in groupNames]
+    #print('In Total: '+str(sum(countSubjects))+' subject folders to process...')
+
+    # Create the proc_data folder in the same hierarchical level where the raw data is located
+    rawDataDirectory = os.path.dirname(os.path.join(pathToRawData))
+    procDataFolder = os.path.join(rawDataDirectory, 'proc_data')
+    if not os.path.isdir(procDataFolder):
+        os.mkdir(procDataFolder)
+
+    # Now comes the serious part: Convert every subject folder to the NIfTI format,
+    # if the subject's group was specified or no group specification was made.
+    # Move the new generated, processed subject folder to the new proc_data folder.
+    # Generate the corresponding path beforehand, if necessary.
+    selectedSubfolders = []
+    for current_subfolder in rawData_subfolders:
+        subName, subDay = getSubjectAndDay(current_subfolder)
+        subGroup = getGroupName(subName)
+        if subGroup in groupNames:
+            selectedSubfolders.append((current_subfolder, subGroup))
+
+    failed = []
+    if args.jobs == 1:
+        for current_subfolder, subGroup in selectedSubfolders:
+            converted = convertToNifti(current_subfolder, args.scanJobs, protocols)
+            finishSubject(procDataFolder, current_subfolder, subGroup, converted, failed)
+    else:
+        # The subjects are converted by a pool of workers, the converted folders
+        # are moved one after another by this process as soon as they are finished
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = {pool.submit(convertToNifti, current_subfolder, args.scanJobs, protocols): (current_subfolder, subGroup)
+                       for current_subfolder, subGroup in selectedSubfolders}
+            for future in as_completed(futures):
+                current_subfolder, subGroup = futures[future]
+                try:
+                    converted = future.result()
+                except Exception as e:
+                    # e.g. a worker process that died
+                    reportFailure(current_subfolder, e)
+                    converted = False
+                finishSubject(procDataFolder, current_subfolder, subGroup, converted, failed)
 
-print('Entered information:')
-
-if dayNames == None:
-    # if no days were specified, collect all subfolders (day folders) within the
-    # raw project folder
-    dayNames = [f.name for f in os.scandir(pathToRawData) if f.is_dir()]
-print('Days to process: ', dayNames)
-
-# Open the *.csv-file, read the subject/group pairs and save both columns in separate lists
-csv_listSubjects = []
-csv_listGroups = []
-with open('groupMapping.csv', newline='') as csv_file:
-    reader = csv.reader(csv_file, delimiter=';')
-    next(reader, None) # Skip the header
-    for subjects, groups in reader:
-        csv_listSubjects.append(subjects)
-        csv_listGroups.append(groups)
-        
-if groupNames == None:
-    # If no groups were specified, get all unique names of the .csv group column
-    # using set()
-    groupNames = list(set(csv_listGroups))
-print('Groups to process: ', groupNames)
-
-# Get all subject paths (projectfolder/days/subjects/)
-rawData_subfolders = findData(pathToRawData,dayNames)
-
-# Get the number of all subject paths
-numberOfSubjectFolders = len(rawData_subfolders)
-
-#countSubjects = 0
-#countSubjects = [csv_listGroups.count(group) for group in groupNames]
-#print('In Total: '+str(sum(countSubjects))+' subject folders to process...')
-
-# Create the proc_data folder in the same hierarchical level where the raw data is located
-rawDataDirectory = os.path.dirname(os.path.join(pathToRawData))
-procDataFolder = os.path.join(rawDataDirectory, 'proc_data')
-if not os.path.isdir(procDataFolder):
-    os.mkdir(procDataFolder)
-
-# Now comes the serious part: Convert every subject folder to the NIfTI format,
-# if the subject's group was specified or no group specification was made.
-# Move the new generated, processed subject folder to the new proc_data folder.
-# Generate the corresponding path beforehand, if necessary.
-for i in range(numberOfSubjectFolders):
-    current_subfolder = rawData_subfolders[i]
-    subName, subDay = getSubjectAndDay(current_subfolder)
-    subGroup = getGroupName(subName)
-    if subGroup in groupNames:
-        convertToNifti(current_subfolder)
-        newDest_Day = os.path.join(procDataFolder,subDay)
-        newDest_DayGroup = os.path.join(procDataFolder,subDay,subGroup)
-        if not os.path.isdir(newDest_Day):
-            os.mkdir(newDest_Day)
-        if not os.path.isdir(newDest_DayGroup):
-            os.mkdir(newDest_DayGroup)
-        currentDest = os.path.join(current_subfolder,subName)
-        moveFolder(currentDest,newDest_DayGroup)
+    if len(failed) > 0:
+        sys.exit("Error: %d of %d subjects could not be converted: %s" % (len(failed), len(selectedSubfolders), ', '.join(failed)))
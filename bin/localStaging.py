@@ -0,0 +1,101 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Local staging of a subject's data type folder (T2w, DTI or fMRI). If proc_data
+lies on a network share, batchProc.py --stageLocal copies the folder once to a
+local scratch folder, processes all stages of the chain there and copies only
+the results back, so the many intermediate files never go over the network.
+
+The local copy mirrors the project structure the scripts rely on:
+
+    <scratch>/<subject>_<dataType>_xxxx/
+        Physio -> <group>/Physio
+        <subject>/
+            <dataType>/          copy of the data type folder
+            T2w -> <subject>/T2w (all other entries are links)
+
+After every stage the new and changed files are copied back. Every file is
+written to a temporary name next to its destination first and then renamed,
+so the project folder never contains partially copied files.
+"""
+
+import os
+import shutil
+import fnmatch
+import tempfile
+
+def scanTree(folder):
+    # Size and modification time of all files below folder (relative paths)
+    files = {}
+    for root, dirs, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            files[os.path.relpath(path, folder)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+def stageIn(subjectPath, dataType, scratchRoot=None):
+    # Copies the data type folder of a subject to a new local folder below
+    # scratchRoot (default: the system temp folder) and returns the staging
+    # entry used by syncBack and cleanUp
+    subjectName = os.path.basename(subjectPath)
+    stageRoot = tempfile.mkdtemp(prefix='%s_%s_' % (subjectName, dataType), dir=scratchRoot)
+    try:
+        localSubject = os.path.join(stageRoot, subjectName)
+        os.mkdir(localSubject)
+        shutil.copytree(os.path.join(subjectPath, dataType), os.path.join(localSubject, dataType), symlinks=True)
+        for entry in os.listdir(subjectPath):
+            if entry != dataType:
+                os.symlink(os.path.join(subjectPath, entry), os.path.join(localSubject, entry))
+        # the physiological recordings are looked up next to the subject folders
+        physioPath = os.path.join(os.path.dirname(subjectPath), 'Physio')
+        if os.path.isdir(physioPath):
+            os.symlink(physioPath, os.path.join(stageRoot, 'Physio'))
+    except OSError:
+        shutil.rmtree(stageRoot, ignore_errors=True)
+        raise
+    localFolder = os.path.join(localSubject, dataType)
+    return {'root': stageRoot, 'subject': localSubject, 'source': subjectPath, 'dataType': dataType,
+            'files': scanTree(localFolder)}
+
+def copyAtomic(source, destination):
+    # Copies source to destination under a temporary name and renames it
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmpPath = os.path.join(os.path.dirname(destination), '.%s.staging' % os.path.basename(destination))
+    try:
+        shutil.copy2(source, tmpPath)
+        os.replace(tmpPath, destination)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+def syncBack(staging, excludes=()):
+    # Copies all files of the local data type folder that are new or changed
+    # since the last sync back to the subject folder, except the intermediate
+    # files matching excludes (patterns relative to the subject folder, e.g.
+    # 'fMRI/regr/mask.nii.gz'). Files the stage deleted locally are deleted in
+    # the subject folder as well. Returns the number of copied bytes.
+    dataType = staging['dataType']
+    localFolder = os.path.join(staging['subject'], dataType)
+    targetFolder = os.path.join(staging['source'], dataType)
+    current = scanTree(localFolder)
+    copied = 0
+    for relPath, state in sorted(current.items()):
+        if staging['files'].get(relPath) == state:
+            continue
+        if any(fnmatch.fnmatch(os.path.join(dataType, relPath), pattern) for pattern in excludes):
+            continue
+        copyAtomic(os.path.join(localFolder, relPath), os.path.join(targetFolder, relPath))
+        copied += state[0]
+    for relPath in staging['files']:
+        if relPath not in current and os.path.isfile(os.path.join(targetFolder, relPath)):
+            os.remove(os.path.join(targetFolder, relPath))
+    staging['files'] = current
+    return copied
+
+def cleanUp(staging):
+    # Removes the local copy
+    shutil.rmtree(staging['root'], ignore_errors=True)
@@ -0,0 +1,177 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Writer of compressed NIfTI files (.nii.gz). nibabel compresses with a single
+thread; here the file is cut into blocks of blockSize bytes which are
+compressed in parallel, each as a gzip member of its own. A file of several
+members is a valid gzip file (RFC 1952) and is read by nibabel, FSL, NiftyReg
+and DSI Studio like one written at once.
+
+    import niiWriter
+    niiWriter.save(image, 'rs-fMRI_mcf.nii.gz')               # final result
+    niiWriter.save(image, 'fslScaleTemp.nii.gz', final=False)  # intermediate
+
+The compression is set through environment variables:
+
+    AIDA_NII_LEVEL    zlib level 0-9 of the written files (default: 1, as nibabel)
+    AIDA_NII_POLICY   'compressed' (default): all files are compressed,
+                      'fast': intermediates are stored uncompressed (level 0,
+                      still a .nii.gz file), final results are compressed
+    AIDA_NII_THREADS  number of compression threads (default: the thread budget
+                      OMP_NUM_THREADS of batchProc.py or all cores)
+
+The stage scripts import it from the bin folder, like scratchSpace:
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import niiWriter
+"""
+
+import io
+import os
+import sys
+import zlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import nibabel as nib
+from nibabel.openers import Opener
+from nibabel.fileholders import FileHolder
+
+# uncompressed size of one gzip member
+blockSize = 1024 * 1024
+
+def compressLevel(final=True):
+    # zlib level of a final result or an intermediate file
+    level = os.environ.get('AIDA_NII_LEVEL', '')
+    level = int(level) if level.isdigit() else Opener.default_compresslevel
+    if level > 9:
+        sys.exit("Error: AIDA_NII_LEVEL must be between 0 and 9.")
+    policy = os.environ.get('AIDA_NII_POLICY') or 'compressed'
+    if policy not in ('compressed', 'fast'):
+        sys.exit("Error: AIDA_NII_POLICY must be 'compressed' or 'fast'.")
+    if policy == 'fast' and not final:
+        return 0
+    return level
+
+def compressThreads():
+    # AIDA_NII_THREADS, else the thread budget, else all cores of this process
+    for name in ('AIDA_NII_THREADS', 'OMP_NUM_THREADS'):
+        threads = os.environ.get(name, '')
+        if threads.isdigit() and int(threads) > 0:
+            return int(threads)
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def compressBlock(block, level):
+    # One complete gzip member (header, deflate stream, CRC32 and size).
+    # zlib releases the GIL while compressing, so the threads run in parallel.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+class GzipWriter(io.IOBase):
+    """
+    Write-only file object of a multi member gzip file. The written data is
+    collected in blocks which are compressed by a pool of threads and written
+    in order; at most one block per thread is held in memory.
+    """
+
+    def __init__(self, path, level=None, threads=None):
+        super().__init__()
+        self.path = path
+        self.name = path
+        self.level = compressLevel() if level is None else level
+        self.threads = compressThreads() if threads is None else threads
+        self.buffer = bytearray()
+        self.position = 0
+        self.pending = collections.deque()
+        self.pool = ThreadPoolExecutor(max_workers=self.threads) if self.threads > 1 else None
+        self.fid = open(path, 'wb')
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            # no partially written file is left behind
+            self.abort()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        # position in the uncompressed data
+        return self.position
+
+    def seek(self, offset, whence=0):
+        # only the current position can be reached, nibabel writes zeros instead
+        if whence == 1:
+            offset += self.position
+        if whence not in (0, 1) or offset != self.position:
+            raise OSError('GzipWriter cannot seek')
+        return self.position
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        self.position += len(data)
+        start = 0
+        while start < len(data):
+            size = min(blockSize - len(self.buffer), len(data) - start)
+            self.buffer += data[start:start + size]
+            start += size
+            if len(self.buffer) == blockSize:
+                self.submit()
+        return len(data)
+
+    def submit(self):
+        block = bytes(self.buffer)
+        self.buffer = bytearray()
+        if self.pool is None:
+            self.fid.write(compressBlock(block, self.level))
+            return
+        self.pending.append(self.pool.submit(compressBlock, block, self.level))
+        while len(self.pending) > self.threads:
+            self.fid.write(self.pending.popleft().result())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if len(self.buffer) > 0 or self.position == 0:
+                self.submit()
+            while len(self.pending) > 0:
+                self.fid.write(self.pending.popleft().result())
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.fid.close()
+            super().close()
+
+    def abort(self):
+        if not self.closed:
+            if self.pool is not None:
+                # blocks not compressed yet are dropped, the running ones are waited for
+                while len(self.pending) > 0:
+                    self.pending.popleft().cancel()
+                self.pool.shutdown(wait=True)
+            self.fid.close()
+            super().close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def save(image, path, final=True):
+    """
+    Saves a nibabel image like nibabel.save. Files ending with .gz are written
+    by GzipWriter, final=False marks intermediate files for AIDA_NII_POLICY=fast.
+    """
+    if not path.endswith('.gz') or not isinstance(image, nib.Nifti1Image):
+        nib.save(image, path)
+        return
+    with GzipWriter(path, compressLevel(final)) as fileobj:
+        fileHolder = FileHolder(filename=path, fileobj=fileobj)
+        image.to_file_map({'image': fileHolder})
+    image.file_map = image.filespec_to_file_map(path)
@@ -0,0 +1,101 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+In-process stage API of AIDAmri. Instead of starting a new interpreter per step
+(python script.py -i file), the scripts of the stage folders are imported once and
+their functions are called directly:
+
+    import pipelineStages
+    pipelineStages.runStage('preProcessing_T2.py', inputFile)
+    applyMICO = pipelineStages.loadModule('2.1_T2PreProcessing', 'applyMICO')
+    applyMICO.run_MICO(inputFile, outputPath)
+
+The stage folders are no packages and some of them contain modules with the same
+name (applyMICO, MICO), so every module is loaded from its own folder and cached
+under a unique name.
+"""
+
+import os
+import sys
+import importlib.util
+
+# path of the AIDAmri bin folder
+binPath = os.path.dirname(os.path.abspath(__file__))
+
+# entry point of every stage script: script -> (stage folder, function)
+stageFunctions = {
+    'pv_conv2Nifti.py': ('1_PV2NIfTiConverter', 'convertStudy'),
+    'preProcessing_T2.py': ('2.1_T2PreProcessing', 'startPreprocessing'),
+    'registration_T2.py': ('2.1_T2PreProcessing', 'startRegistration'),
+    'preProcessing_DTI.py': ('2.2_DTIPreProcessing', 'startPreprocessing'),
+    'registration_DTI.py': ('2.2_DTIPreProcessing', 'startRegistration'),
+    'preProcessing_fMRI.py': ('2.3_fMRIPreProcessing', 'startPreprocessing'),
+    'registration_rsfMRI.py': ('2.3_fMRIPreProcessing', 'startRegistration'),
+    'getIncidenceSize_par.py': ('3.1_T2Processing', 'startIncidenceSize'),
+    'getIncidenceSize.py': ('3.1_T2Processing', 'startIncidenceSize'),
+    'dsi_main.py': ('3.2_DTIConnectivity', 'startConnectivity'),
+    'DTIdata_extract.py': ('3.2.1_DTIdata_extract', 'startExtraction'),
+    'process_fMRI.py': ('3.3_fMRIActivity', 'startProcessing'),
+    'regress.py': ('3.3_fMRIActivity', 'startRegression'),
+}
+
+_modules = {}
+
+def loadModule(folder, name):
+    # Imports the module name of the stage folder (e.g. '2.1_T2PreProcessing',
+    # 'applyMICO') once per process. The modules imported by it are resolved in
+    # its own folder first. A missing or broken module raises RuntimeError, like
+    # the errors of runStage.
+    key = (folder, name)
+    if key in _modules:
+        return _modules[key]
+    stageDir = os.path.join(binPath, folder)
+    path = os.path.join(stageDir, name + '.py')
+    if not os.path.isfile(path):
+        raise RuntimeError("Error: '%s' is not an existing file." % (path,))
+
+    # hide modules of other stage folders with the same name while importing
+    localNames = [os.path.splitext(f)[0] for f in os.listdir(stageDir) if f.endswith('.py')]
+    hidden = {n: sys.modules.pop(n) for n in localNames if n in sys.modules}
+    sys.path.insert(0, stageDir)
+    try:
+        spec = importlib.util.spec_from_file_location('aida_%s_%s' % (folder.replace('.', '_'), name), path)
+        module = importlib.util.module_from_spec(spec)
+        # registered under its unique name, so its functions can be pickled for worker processes
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    except (Exception, SystemExit) as e:
+        sys.modules.pop(spec.name, None)
+        raise RuntimeError("Error: '%s' could not be loaded (%s)." % (path, e))
+    finally:
+        sys.path.remove(stageDir)
+        for n in localNames:
+            sys.modules.pop(n, None)
+        sys.modules.update(hidden)
+    _modules[key] = module
+    return module
+
+def getFunction(script):
+    # Returns the entry point of a stage script, e.g. 'registration_T2.py'
+    if script not in stageFunctions:
+        raise RuntimeError("Error: '%s' is no known stage script." % (script,))
+    folder, function = stageFunctions[script]
+    return getattr(loadModule(folder, os.path.splitext(script)[0]), function)
+
+def runStage(script, *args, **kwargs):
+    # Runs the entry point of a stage script in this process with the stage
+    # folder as working directory, as if the script was started from there.
+    # Errors of the stage (sys.exit) and of loading it are raised as
+    # RuntimeError, so the caller keeps running.
+    function = getFunction(script)
+    cwd = os.getcwd()
+    os.chdir(os.path.join(binPath, stageFunctions[script][0]))
+    try:
+        return function(*args, **kwargs)
+    except SystemExit as e:
+        raise RuntimeError(str(e.code))
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,269 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Index of a ParaVision raw data tree (raw_data/days/studies/expno/pdata/procno)
+in a SQLite database. For every reconstruction it stores day, study, the study
+folder, expno, procno, the protocol name and its class as used for the proc_data subfolders
+(T2w, DTI, fMRI, T2map, Localizer, Others), the data dimensions, TR/TE, the
+modification time and size of the parameter files and 2dseq and the converted
+NIfTI file in proc_data, if it exists.
+
+The index is updated incrementally: only scans whose files changed since the
+last run are parsed again, scans that no longer exist are removed. The drivers
+query it instead of walking the file system, e.g.
+python conv2Nifti_auto.py -f /Volumes/Desktop/MRI/raw_data --index
+python batchProc.py -f /Volumes/Desktop/MRI/proc_data -g Sham -d P7 -t T2w --index
+
+Only reconstructions with a visu_pars are indexed. conv2Nifti_auto therefore
+still lists the study folders of the day folders and converts those without
+any indexed scan like before; batchProc only finds subjects with converted
+scans of indexed raw data. The ROI analysis (4.1_ROI_analysis) takes its
+studies and expnos from the tables filled in proc_tools.py, not from the index.
+
+Example:
+python rawIndex.py -f /Volumes/Desktop/MRI/raw_data -d Baseline P7 -p T2w DTI --list
+"""
+
+import os
+import sys
+import glob
+import time
+import sqlite3
+import pipelineStages
+
+indexName = 'rawIndex.sqlite'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS scans (
+    path TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    study TEXT NOT NULL,
+    expno INTEGER NOT NULL,
+    procno INTEGER NOT NULL,
+    protocolName TEXT,
+    protocol TEXT,
+    dims TEXT,
+    wordType TEXT,
+    repetitionTime REAL,
+    echoTimes TEXT,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    procPath TEXT,
+    indexed TEXT NOT NULL,
+    studyPath TEXT
+);
+CREATE INDEX IF NOT EXISTS scansStudy ON scans (day, study);
+CREATE INDEX IF NOT EXISTS scansProtocol ON scans (protocol);
+'''
+
+def defaultDatabase(rawPath):
+    # The index is stored next to the raw data folder, like proc_data
+    return os.path.join(os.path.dirname(os.path.abspath(rawPath)), indexName)
+
+def openIndex(database):
+    connection = sqlite3.connect(database)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(schema)
+    # databases of older versions have no studyPath column yet
+    columns = [row['name'] for row in connection.execute('PRAGMA table_info(scans)')]
+    if 'studyPath' not in columns:
+        connection.execute('ALTER TABLE scans ADD COLUMN studyPath TEXT')
+    return connection
+
+def loadParser():
+    # pv_parseBruker_md_np of the converter, including its parameter cache
+    return pipelineStages.loadModule('1_PV2NIfTiConverter', 'pv_parseBruker_md_np')
+
+def findScans(rawPath, days=None):
+    # All reconstructions (pdata/procno folders with visu_pars) below the
+    # day and study folders, as (day, study, expno, procno, path)
+    scans = []
+    if days is None:
+        days = sorted(f.name for f in os.scandir(rawPath) if f.is_dir())
+    for day in days:
+        dayPath = os.path.join(rawPath, day)
+        if not os.path.isdir(dayPath):
+            continue
+        for study in sorted(f.name for f in os.scandir(dayPath) if f.is_dir() and f.name.lower() != 'physio'):
+            studyPath = os.path.join(dayPath, study)
+            for expno in sorted((f.name for f in os.scandir(studyPath) if f.is_dir() and f.name.isdigit()), key=int):
+                pdataPath = os.path.join(studyPath, expno, 'pdata')
+                if not os.path.isdir(pdataPath):
+                    continue
+                for procno in sorted((f.name for f in os.scandir(pdataPath) if f.is_dir() and f.name.isdigit()), key=int):
+                    path = os.path.join(pdataPath, procno)
+                    if os.path.isfile(os.path.join(path, 'visu_pars')):
+                        scans.append((day, study, int(expno), int(procno), path))
+    return scans
+
+def fileState(path):
+    # Latest modification time and total size of the files a scan is read from
+    mtime = 0
+    size = 0
+    for name in (os.path.join(path, 'visu_pars'), os.path.join(path, '2dseq'),
+                 os.path.join(path, '..', '..', 'acqp'), os.path.join(path, '..', '..', 'method')):
+        if os.path.isfile(name):
+            stat = os.stat(name)
+            mtime = max(mtime, stat.st_mtime_ns)
+            size += stat.st_size
+    return mtime, size
+
+def dataDims(visuPars):
+    # Core dimensions followed by the frame group dimensions, e.g. '64 64 16 300'
+    dims = visuPars.get('VisuCoreSize', '').split()
+    if int(visuPars.get('VisuFGOrderDescDim', '0')) > 0:
+        frameGroups = visuPars['VisuFGOrderDesc'][1:-1].split(') (')
+        dims += [item.split(',')[0].strip() for item in frameGroups]
+    return ' '.join(dims)
+
+def readScan(path):
+    # Parameters of one reconstruction from acqp and visu_pars
+    pB = loadParser()
+    acqp = pB.parsePV(os.path.join(path, '..', '..', 'acqp'))
+    visuPars = pB.parsePV(os.path.join(path, 'visu_pars'))
+    protocolName = acqp.get('ACQ_protocol_name', '').strip('"') if acqp != [] else ''
+    repetitionTime = visuPars.get('VisuAcqRepetitionTime')
+    return {'protocolName': protocolName,
+            'protocol': pB.classifyProtocol(protocolName),
+            'dims': dataDims(visuPars),
+            'wordType': visuPars.get('VisuCoreWordType'),
+            'repetitionTime': float(repetitionTime.split()[0]) if repetitionTime else None,
+            'echoTimes': visuPars.get('VisuAcqEchoTime')}
+
+def findProcPath(procPath, day, study, protocol, expno, procno):
+    # Converted NIfTI file proc_data/day/group/study/protocol/study.expno.procno.nii.gz
+    pattern = os.path.join(glob.escape(procPath), glob.escape(day), '*', glob.escape(study), protocol,
+                           glob.escape('%s.%d.%d.nii.gz' % (study, expno, procno)))
+    matches = sorted(glob.glob(pattern))
+    return matches[0] if len(matches) > 0 else None
+
+def updateIndex(rawPath, database=None, days=None, procPath=None):
+    # Crawls the raw data tree (all days or the given ones) and brings the
+    # index up to date. Returns the number of parsed, unchanged and removed scans.
+    rawPath = os.path.abspath(rawPath)
+    if not os.path.isdir(rawPath):
+        sys.exit("Error: '%s' is not an existing directory." % (rawPath,))
+    database = database or defaultDatabase(rawPath)
+    if procPath is None:
+        procPath = os.path.join(os.path.dirname(rawPath), 'proc_data')
+    scans = findScans(rawPath, days)
+    parsed = unchanged = removed = 0
+    with openIndex(database) as connection:
+        known = dict((row['path'], row) for row in connection.execute('SELECT * FROM scans'))
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        for day, study, expno, procno, path in scans:
+            mtime, size = fileState(path)
+            studyPath = os.path.join(rawPath, day, study)
+            row = known.get(path)
+            if row is not None and row['mtime'] == mtime and row['size'] == size:
+                unchanged += 1
+                if row['studyPath'] != studyPath:
+                    connection.execute('UPDATE scans SET studyPath = ? WHERE path = ?', (studyPath, path))
+                if row['procPath'] is None or not os.path.isfile(row['procPath']):
+                    connection.execute('UPDATE scans SET procPath = ? WHERE path = ?',
+                                       (findProcPath(procPath, day, study, row['protocol'], expno, procno), path))
+                continue
+            try:
+                info = readScan(path)
+            except SystemExit as e:
+                print("Notice: '%s' could not be read (%s) - it is not indexed." % (path, e.code))
+                continue
+            connection.execute('INSERT OR REPLACE INTO scans VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (path, day, study, expno, procno, info['protocolName'], info['protocol'],
+                                info['dims'], info['wordType'], info['repetitionTime'], info['echoTimes'],
+                                mtime, size, findProcPath(procPath, day, study, info['protocol'], expno, procno), now,
+                                studyPath))
+            parsed += 1
+        # scans of the crawled days that no longer exist
+        found = set(scan[4] for scan in scans)
+        crawledDays = None if days is None else set(days)
+        for path, row in known.items():
+            if path.startswith(rawPath + os.sep) and path not in found and (crawledDays is None or row['day'] in crawledDays):
+                connection.execute('DELETE FROM scans WHERE path = ?', (path,))
+                removed += 1
+    connection.close()
+    return parsed, unchanged, removed
+
+def queryScans(database, days=None, studies=None, protocols=None):
+    # Rows of the index, optionally restricted to days, studies and protocol classes
+    conditions = []
+    values = []
+    for column, selection in (('day', days), ('study', studies), ('protocol', protocols)):
+        if selection is not None:
+            conditions.append('%s IN (%s)' % (column, ', '.join('?' * len(selection))))
+            values += list(selection)
+    query = 'SELECT * FROM scans'
+    if len(conditions) > 0:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY day, study, expno, procno'
+    connection = openIndex(database)
+    try:
+        return [dict(row) for row in connection.execute(query, values)]
+    finally:
+        connection.close()
+
+def updateProcPaths(database, procPath, days=None):
+    # Looks up the NIfTI files of scans converted since the last update of the
+    # index (or moved) in procPath, e.g. before batchProc queries the index
+    with openIndex(database) as connection:
+        for row in connection.execute('SELECT * FROM scans').fetchall():
+            if (days is None or row['day'] in days) and (row['procPath'] is None or not os.path.isfile(row['procPath'])):
+                connection.execute('UPDATE scans SET procPath = ? WHERE path = ?',
+                                   (findProcPath(procPath, row['day'], row['study'], row['protocol'], row['expno'], row['procno']),
+                                    row['path']))
+    connection.close()
+
+def subjectFolders(database, procPath, days=None, groups=None):
+    # Subject folders (procPath/day/group/study) of the converted scans, like findData of batchProc
+    procPath = os.path.abspath(procPath)
+    folders = []
+    for row in queryScans(database, days=days):
+        if row['procPath'] is None:
+            continue
+        # procPath/day/group/study/protocol/file
+        parts = os.path.relpath(row['procPath'], procPath).split(os.sep)
+        if len(parts) != 5 or parts[0] == os.pardir or (groups is not None and parts[1] not in groups):
+            continue
+        folder = os.path.join(procPath, *parts[:3])
+        if folder not in folders:
+            folders.append(folder)
+    return folders
+
+def studyFolders(database, days=None):
+    # Study folders (rawPath/day/study) of the indexed scans, like findData of conv2Nifti_auto
+    folders = []
+    for row in queryScans(database, days=days):
+        folder = row['studyPath']
+        if folder not in folders:
+            folders.append(folder)
+    return folders
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Index of a ParaVision raw data tree (raw_data/days/studies) in a SQLite database. Only new or changed scans are parsed. Example: python rawIndex.py -f /Volumes/Desktop/MRI/raw_data -d Baseline P7 -p T2w DTI --list')
+    parser.add_argument('-f', '--folder', required=True, help='Path to the raw project folder, e.g. raw_data')
+    parser.add_argument('-d', '--days', nargs='+', default=None, help='Day names to index (default: all)')
+    parser.add_argument('-p', '--protocols', nargs='+', default=None, help='Protocol classes to list: T2w, DTI, fMRI, T2map, Localizer, Others')
+    parser.add_argument('--database', default=None, help='Index database (default: %s next to the raw project folder)' % (indexName,))
+    parser.add_argument('--list', action='store_true', help='List the indexed scans')
+    args = parser.parse_args()
+
+    database = args.database or defaultDatabase(args.folder)
+    parsed, unchanged, removed = updateIndex(args.folder, database, args.days)
+    print('Index %s: %d scans parsed, %d unchanged, %d removed' % (database, parsed, unchanged, removed))
+
+    rows = queryScans(database, days=args.days, protocols=args.protocols)
+    if args.list:
+        print('%-12s %-30s %5s %6s %-10s %-24s %8s %s' % ('Day', 'Study', 'Expno', 'Procno', 'Protocol', 'Dims', 'TR [ms]', 'NIfTI'))
+        for row in rows:
+            print('%-12s %-30s %5d %6d %-10s %-24s %8s %s' % (row['day'], row['study'], row['expno'], row['procno'],
+                  row['protocol'], row['dims'], row['repetitionTime'], row['procPath'] or '-'))
+    else:
+        counts = {}
+        for row in rows:
+            counts[row['protocol']] = counts.get(row['protocol'], 0) + 1
+        for protocol, count in sorted(counts.items()):
+            print('%-10s %d scans' % (protocol, count))
@@ -0,0 +1,26 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Scratch folders of the stages. The temporary files of one step (scaled copies
+for FSL, single slices, ...) are written to a new folder of their own below
+AIDA_SCRATCH, which batchProc.py --scratch sets (e.g. a local disk or tmpfs),
+or below the system temp folder. Subjects processed at the same time therefore
+never share temporary files. The stage scripts import it from the bin folder:
+
+    from scratchSpace import makeScratchDir
+    scratch = makeScratchDir('rs-fMRI')
+"""
+
+import os
+import tempfile
+
+def scratchRoot():
+    # AIDA_SCRATCH, None for the system temp folder
+    return os.environ.get('AIDA_SCRATCH') or None
+
+def makeScratchDir(name):
+    # new folder name_xxxx below the scratch root, removed by the caller
+    return tempfile.mkdtemp(prefix=name + '_', dir=scratchRoot())
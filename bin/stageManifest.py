@@ -0,0 +1,100 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Per-subject manifest of the batch processing. For every stage it records the
+hashes of the input files, the parameters and the created output files, so a
+rerun of batchProc.py can skip all stages whose inputs and parameters did not
+change. The manifest is stored as JSON in the subject folder and all paths are
+relative to the subject folder.
+"""
+
+import os
+import glob
+import json
+import hashlib
+
+manifestName = 'processingManifest.json'
+
+def loadManifest(subjectPath):
+    # Returns the manifest of a subject or an empty one
+    path = os.path.join(subjectPath, manifestName)
+    if os.path.isfile(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            print("Notice: '%s' is no valid manifest - all stages will be processed." % (path,))
+    return {'stages': {}, 'hashes': {}}
+
+def saveManifest(subjectPath, manifest):
+    # Writes the manifest atomically, an interrupted run leaves the old one
+    path = os.path.join(subjectPath, manifestName)
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmpPath, path)
+
+def hashFile(subjectPath, path, manifest):
+    # sha1 of a file. The hash is cached in the manifest together with size
+    # and modification time, so unchanged files are not read again.
+    relPath = os.path.relpath(path, subjectPath)
+    stat = os.stat(path)
+    cached = manifest['hashes'].get(relPath)
+    if cached is not None and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+        return cached['sha1']
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    manifest['hashes'][relPath] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1.hexdigest()}
+    return sha1.hexdigest()
+
+def hashFiles(subjectPath, paths, manifest):
+    # Hashes of all files in paths, folders are only recorded by name
+    hashes = {}
+    for path in paths:
+        relPath = os.path.relpath(path, subjectPath)
+        if os.path.isdir(path):
+            hashes[relPath] = 'folder'
+        else:
+            hashes[relPath] = hashFile(subjectPath, path, manifest)
+    return hashes
+
+def findOutputFiles(subjectPath, outputs):
+    # All existing files matching the output patterns of a stage
+    files = []
+    for pattern in outputs:
+        files += [f for f in sorted(glob.glob(os.path.join(subjectPath, pattern))) if os.path.isfile(f)]
+    return files
+
+def isUpToDate(subjectPath, manifest, stageName, inputs, params, outputs):
+    # A stage is up to date if it was finished before with the same input
+    # hashes and parameters and all its recorded outputs still exist unchanged.
+    entry = manifest['stages'].get(stageName)
+    if entry is None:
+        return False
+    if entry['params'] != params:
+        return False
+    if entry['inputs'] != hashFiles(subjectPath, inputs, manifest):
+        return False
+    if len(entry['outputs']) == 0 or len(findOutputFiles(subjectPath, outputs)) == 0:
+        return False
+    for relPath, sha1 in entry['outputs'].items():
+        path = os.path.join(subjectPath, relPath)
+        if not os.path.isfile(path) or hashFile(subjectPath, path, manifest) != sha1:
+            return False
+    return True
+
+def recordStage(subjectPath, manifest, stageName, inputs, params, outputs):
+    # Stores inputs, parameters and outputs of a finished stage
+    manifest['stages'][stageName] = {
+        'inputs': hashFiles(subjectPath, inputs, manifest),
+        'params': params,
+        'outputs': hashFiles(subjectPath, findOutputFiles(subjectPath, outputs), manifest)}
+
+def invalidateStage(manifest, stageName):
+    # Removes a stage from the manifest, so it is processed again
+    manifest['stages'].pop(stageName, None)
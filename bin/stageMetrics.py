@@ -0,0 +1,157 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Resource usage of the processing stages. For every stage batchProc.py measures
+the wall time, the user/system CPU time of the worker and of all external tools
+it started (reg_aladin, reg_f3d, mcflirt, dsi_studio, ...) and the peak resident
+memory. The measurements are written to a JSON report per subject
+(processingReport.json, latest measurement of every stage) and to a report of
+the whole cohort in the project folder.
+
+Peak memory of the worker is exact on Linux (the high water mark is reset per
+stage). Peak memory of the external tools is the largest one the worker has
+waited for so far, so it is an upper bound when a worker processed several
+stages.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+
+reportName = 'processingReport.json'
+
+def rssToMB(maxrss):
+    # ru_maxrss is given in kilobytes on Linux and in bytes on macOS
+    if sys.platform == 'darwin':
+        return maxrss / 1024.0 / 1024.0
+    return maxrss / 1024.0
+
+def resetPeakRss():
+    # Resets the high water mark of this process (Linux only)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peakRss():
+    # Peak resident memory of this process in MB
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError, IndexError):
+        pass
+    return rssToMB(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def startMeasurement():
+    # Snapshot of the resource usage before a stage
+    resetPeakRss()
+    return {'start': time.time(),
+            'wall': time.perf_counter(),
+            'self': resource.getrusage(resource.RUSAGE_SELF),
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN)}
+
+def stopMeasurement(measurement):
+    # Resource usage since startMeasurement as a JSON serializable dict
+    usageSelf = resource.getrusage(resource.RUSAGE_SELF)
+    usageChildren = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(measurement['start'])),
+            'wallTime': round(time.perf_counter() - measurement['wall'], 3),
+            'userTime': round(usageSelf.ru_utime - measurement['self'].ru_utime, 3),
+            'systemTime': round(usageSelf.ru_stime - measurement['self'].ru_stime, 3),
+            'childUserTime': round(usageChildren.ru_utime - measurement['children'].ru_utime, 3),
+            'childSystemTime': round(usageChildren.ru_stime - measurement['children'].ru_stime, 3),
+            'peakRssMB': round(peakRss(), 1),
+            'childPeakRssMB': round(rssToMB(usageChildren.ru_maxrss), 1)}
+
+def cpuTime(metrics):
+    # Total CPU time of a stage including its external tools
+    return metrics['userTime'] + metrics['systemTime'] + metrics['childUserTime'] + metrics['childSystemTime']
+
+def writeJson(path, data):
+    # Writes the report atomically, an interrupted run leaves the old one
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmpPath, path)
+
+def loadReport(subjectPath):
+    # Returns the report of a subject or an empty one
+    path = os.path.join(subjectPath, reportName)
+    if os.path.isfile(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            print("Notice: '%s' is no valid report - it will be replaced." % (path,))
+    return {'stages': {}}
+
+def updateReport(subjectPath, stageName, record):
+    # Stores the latest measurement of a stage in the report of the subject
+    report = loadReport(subjectPath)
+    report['stages'][stageName] = record
+    writeJson(os.path.join(subjectPath, reportName), report)
+
+def summarizeStages(records):
+    # Totals per stage over all measured records of a run
+    summary = {}
+    for record in records:
+        if 'wallTime' not in record:
+            continue
+        entry = summary.setdefault(record['stage'], {'runs': 0, 'failed': 0, 'wallTime': 0.0, 'cpuTime': 0.0,
+                                                     'maxWallTime': 0.0, 'peakRssMB': 0.0, 'childPeakRssMB': 0.0})
+        entry['runs'] += 1
+        if record['status'] != 'done':
+            entry['failed'] += 1
+        entry['wallTime'] += record['wallTime']
+        entry['cpuTime'] += cpuTime(record)
+        entry['maxWallTime'] = max(entry['maxWallTime'], record['wallTime'])
+        entry['peakRssMB'] = max(entry['peakRssMB'], record['peakRssMB'])
+        entry['childPeakRssMB'] = max(entry['childPeakRssMB'], record['childPeakRssMB'])
+    for entry in summary.values():
+        entry['meanWallTime'] = entry['wallTime'] / entry['runs']
+    return summary
+
+def writeCohortReport(folder, records, wallTime, jobs):
+    # Writes the records of all subjects and stages of a run to
+    # folder/processingReport_<date>_<time>.json and returns the report
+    report = {'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'wallTime': round(wallTime, 3),
+              'jobs': jobs,
+              'records': records,
+              'stages': summarizeStages(records)}
+    path = os.path.join(folder, 'processingReport_%s.json' % time.strftime('%Y%m%d_%H%M%S'))
+    writeJson(path, report)
+    report['path'] = path
+    return report
+
+def printSummary(report):
+    # Table of the measured stages of a run, sorted by their total wall time
+    stages = report['stages']
+    print('')
+    print('Resource usage (%d jobs, %.1f s wall time):' % (report['jobs'], report['wallTime']))
+    if len(stages) == 0:
+        print('No stages were processed.')
+        return
+    print('%-24s %5s %7s %11s %11s %11s %10s %10s' % ('Stage', 'Runs', 'Failed', 'Wall [s]', 'Mean [s]',
+                                                     'CPU [s]', 'RSS [MB]', 'Tools [MB]'))
+    for name, entry in sorted(stages.items(), key=lambda item: -item[1]['wallTime']):
+        print('%-24s %5d %7d %11.1f %11.1f %11.1f %10.1f %10.1f' % (name, entry['runs'], entry['failed'],
+              entry['wallTime'], entry['meanWallTime'], entry['cpuTime'], entry['peakRssMB'], entry['childPeakRssMB']))
+    subjects = {}
+    for record in report['records']:
+        if 'wallTime' in record:
+            subjects[record['subject']] = subjects.get(record['subject'], 0.0) + record['wallTime']
+    if len(subjects) > 0:
+        slowest = max(subjects, key=subjects.get)
+        print('Slowest subject: %s (%.1f s)' % (slowest, subjects[slowest]))
+    if 'path' in report:
+        print('Report: ' + report['path'])
@@ -0,0 +1,65 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Thread budget of the batch processing. NiftyReg (OpenMP), ANTs/ITK, DSI Studio
+and the BLAS behind NumPy use all cores by default, so several stages processed
+at the same time would start many times more threads than there are cores.
+batchProc.py hands every stage a share of the cores and limitThreads applies it
+to the worker process and to all tools the stage starts:
+
+    with threadBudget.limitThreads(4):
+        pipelineStages.runStage('registration_T2.py', inputFile)
+
+The external tools get the budget through their environment variables, DSI
+Studio through --thread_count (see dsi_tools_20170214.threadCount). The BLAS
+of the worker itself is limited with threadpoolctl if it is installed.
+"""
+
+import os
+import contextlib
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+# variables read by OpenMP (NiftyReg), OpenBLAS, MKL, numexpr and ITK (ANTs)
+threadVariables = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS']
+
+def availableCores():
+    # Number of cores this process may run on
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def shareThreads(budget, used, slots):
+    # Threads for the next stage: the unused part of the budget divided by the
+    # number of stages that may still start, at least one
+    return max(1, (budget - used) // max(1, slots))
+
+@contextlib.contextmanager
+def noLimits():
+    # stands in for threadpoolctl (contextlib.nullcontext needs Python 3.7)
+    yield
+
+@contextlib.contextmanager
+def limitThreads(threads):
+    # Limits this process and the tools it starts to threads threads. The
+    # previous environment is restored afterwards.
+    previous = dict((name, os.environ.get(name)) for name in threadVariables)
+    for name in threadVariables:
+        os.environ[name] = str(threads)
+    limits = threadpoolctl.threadpool_limits(threads) if threadpoolctl is not None else noLimits()
+    try:
+        with limits:
+            yield threads
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
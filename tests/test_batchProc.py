@@ -0,0 +1,57 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Tests of the stage scheduler of bin/batchProc.py with a stage function that
+stands in for the stage scripts. A worker process that dies (segfault, OOM
+killer) must only fail its own stage, the other subjects are processed anyway.
+
+Run from the repository folder: python -m pytest -q tests
+"""
+
+import os
+import sys
+import signal
+import multiprocessing
+
+import pytest
+
+binPath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin')
+sys.path.insert(0, binPath)
+
+import batchProc
+import stageMetrics
+
+fakeStages = [{'name': 'T2w_preProcessing', 'dataType': 'T2w', 'script': 'preProcessing_T2.py',
+               'inputs': ['T2w/*1.nii.gz'], 'requires': [], 'outputs': ['T2w/*Bet.nii.gz']}]
+
+def fakeStage(stage, inputFile, kwargs, threads):
+    # runStage of the workers: the subjects named Crash kill their worker process
+    measurement = stageMetrics.startMeasurement()
+    if 'Crash' in inputFile:
+        os.kill(os.getpid(), signal.SIGKILL)
+    with open(inputFile.replace('1.nii.gz', 'Bet.nii.gz'), 'w') as f:
+        f.write('done')
+    return stageMetrics.stopMeasurement(measurement), None
+
+def makeSubject(path, name):
+    subjectPath = path / name
+    (subjectPath / 'T2w').mkdir(parents=True)
+    (subjectPath / 'T2w' / (name + '.1.nii.gz')).write_text('raw')
+    return str(subjectPath)
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='the workers must inherit the fake stage')
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_brokenWorker(tmp_path, monkeypatch, jobs):
+    monkeypatch.setattr(batchProc, 'STAGES', fakeStages)
+    monkeypatch.setattr(batchProc, 'runStage', fakeStage)
+    subjects = [makeSubject(tmp_path, name) for name in ('SubjectA', 'SubjectCrash', 'SubjectB', 'SubjectC')]
+
+    errorList = batchProc.executeScripts(subjects, ['T2w'], jobs=jobs, reportFolder=str(tmp_path))
+
+    assert any('SubjectCrash' in error and 'terminated' in error for error in errorList)
+    for name in ('SubjectB', 'SubjectC'):
+        assert (tmp_path / name / 'T2w' / (name + '.Bet.nii.gz')).is_file()
+    assert any(name.startswith('processingReport_') for name in os.listdir(str(tmp_path)))
@@ -0,0 +1,135 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Tests of the raw data index (bin/rawIndex.py) and of conv2Nifti_auto.py --index
+and batchProc.py --index on a small fake ParaVision tree
+raw_data/day/study/expno/pdata/1. The converter and the stages are not run,
+only the subject folders passed to them are checked.
+
+Run from the repository folder: python -m pytest -q tests
+"""
+
+import os
+import sys
+import runpy
+
+import pytest
+
+binPath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin')
+sys.path.insert(0, binPath)
+
+import pipelineStages
+import rawIndex
+
+def writeJcamp(fileName, parameters, scanPath):
+    # ParaVision parameter file with the given (name, value) pairs, arrays as (size, value).
+    # The seventh line holds the path on the scanner, e.g. .../nmr/study/expno/pdata/1/visu_pars
+    lines = ['##TITLE=Parameter List', '##JCAMPDX=4.24', '##DATATYPE=Parameter Values',
+             '##ORIGIN=Bruker BioSpin MRI GmbH', '##OWNER=nmrsu', '$$ Sun Oct 18 12:00:00 2026 CEST (UT+2h) nmrsu',
+             '$$ /opt/PV6.0.1/data/nmrsu/nmr/' + scanPath]
+    for name, value in parameters:
+        if isinstance(value, tuple):
+            lines.append('##$%s=( %s )' % (name, value[0]))
+            lines.append(value[1])
+        else:
+            lines.append('##$%s=%s' % (name, value))
+    lines.append('##END=')
+    with open(fileName, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def makeScan(rawPath, day, study, expno, protocolName):
+    expnoPath = os.path.join(rawPath, day, study, str(expno))
+    procnoPath = os.path.join(expnoPath, 'pdata', '1')
+    os.makedirs(procnoPath)
+    scanPath = '%s/%d/' % (study, expno)
+    writeJcamp(os.path.join(expnoPath, 'acqp'), [('ACQ_protocol_name', ('64', '<%s>' % protocolName))], scanPath + 'acqp')
+    writeJcamp(os.path.join(expnoPath, 'method'), [('PVM_DwAoImages', '1')], scanPath + 'method')
+    writeJcamp(os.path.join(procnoPath, 'visu_pars'),
+               [('VisuCoreDim', '2'), ('VisuCoreSize', ('2', '8 8')), ('VisuCoreWordType', '_16BIT_SGN_INT'),
+                ('VisuAcqRepetitionTime', ('1', '2500')), ('VisuFGOrderDescDim', '1'),
+                ('VisuFGOrderDesc', ('1', '(4, <FG_SLICE>, <>, 0, 2)'))], scanPath + 'pdata/1/visu_pars')
+    with open(os.path.join(procnoPath, '2dseq'), 'wb') as f:
+        f.write(bytes(8 * 8 * 4 * 2))
+
+@pytest.fixture
+def rawTree(tmp_path, monkeypatch):
+    # raw_data with two days, three studies (one of them in Physio, which is skipped)
+    monkeypatch.setenv('AIDA_PARAM_CACHE', str(tmp_path / 'cache'))
+    rawPath = tmp_path / 'raw_data'
+    makeScan(str(rawPath), 'Baseline', 'Study1', 3, 'T2_TurboRARE')
+    makeScan(str(rawPath), 'Baseline', 'Study1', 4, 'DTI_EPI_30dir')
+    makeScan(str(rawPath), 'Baseline', 'Study2', 3, 'T2_TurboRARE')
+    makeScan(str(rawPath), 'P7', 'Study1', 5, '1_Localizer')
+    makeScan(str(rawPath), 'P7', 'Physio', 1, 'T2_TurboRARE')
+    # a study without any reconstruction, which is not indexed
+    os.makedirs(str(rawPath / 'P7' / 'Study3' / '1'))
+    return rawPath
+
+def makeNifti(procPath, day, group, study, protocol, expno):
+    # converted scan as pv_conv2Nifti writes it
+    folder = procPath / day / group / study / protocol
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / ('%s.%d.1.nii.gz' % (study, expno))).write_text('nifti')
+
+def test_studyFolders(rawTree, tmp_path):
+    database = str(tmp_path / 'index.sqlite')
+    assert rawIndex.updateIndex(str(rawTree), database) == (4, 0, 0)
+    assert rawIndex.studyFolders(database) == [str(rawTree / 'Baseline' / 'Study1'), str(rawTree / 'Baseline' / 'Study2'),
+                                               str(rawTree / 'P7' / 'Study1')]
+    assert rawIndex.studyFolders(database, ['P7']) == [str(rawTree / 'P7' / 'Study1')]
+    assert rawIndex.updateIndex(str(rawTree), database) == (0, 4, 0)
+
+def test_convertIndex(rawTree, tmp_path, monkeypatch):
+    # groupMapping.csv is read from the working folder
+    monkeypatch.chdir(tmp_path)
+    with open('groupMapping.csv', 'w') as f:
+        f.write('Subject;Group\nStudy1;Sham\nStudy2;Stroke\nStudy3;Stroke\n')
+    converted = []
+
+    def runStage(script, subjectFolder, **kwargs):
+        # the converter writes its results to subjectFolder/study
+        converted.append(subjectFolder)
+        os.makedirs(os.path.join(subjectFolder, os.path.basename(subjectFolder)))
+
+    monkeypatch.setattr(pipelineStages, 'runStage', runStage)
+    monkeypatch.setattr(sys, 'argv', ['conv2Nifti_auto.py', '-f', str(rawTree), '--index'])
+    runpy.run_path(os.path.join(binPath, 'conv2Nifti_auto.py'), run_name='__main__')
+
+    assert sorted(converted) == sorted([str(rawTree / 'Baseline' / 'Study1'), str(rawTree / 'Baseline' / 'Study2'),
+                                        str(rawTree / 'P7' / 'Study1'), str(rawTree / 'P7' / 'Study3')])
+    procPath = tmp_path / 'proc_data'
+    assert (procPath / 'Baseline' / 'Sham' / 'Study1').is_dir()
+    assert (procPath / 'Baseline' / 'Stroke' / 'Study2').is_dir()
+    assert (procPath / 'P7' / 'Sham' / 'Study1').is_dir()
+    assert (procPath / 'P7' / 'Stroke' / 'Study3').is_dir()
+    assert os.path.isfile(rawIndex.defaultDatabase(str(rawTree)))
+
+def test_batchIndex(rawTree, tmp_path, monkeypatch, capsys):
+    # the index is written before the conversion, the NIfTI files are found afterwards
+    database = rawIndex.defaultDatabase(str(rawTree))
+    rawIndex.updateIndex(str(rawTree), database)
+    procPath = tmp_path / 'proc_data'
+    makeNifti(procPath, 'Baseline', 'Sham', 'Study1', 'T2w', 3)
+    makeNifti(procPath, 'Baseline', 'Stroke', 'Study2', 'T2w', 3)
+    makeNifti(procPath, 'P7', 'Sham', 'Study1', 'Localizer', 5)
+    # a subject folder of proc_data that does not come from the indexed raw data
+    (procPath / 'Baseline' / 'Sham' / 'Other' / 'T2w').mkdir(parents=True)
+
+    rawIndex.updateProcPaths(database, str(procPath))
+    assert rawIndex.subjectFolders(database, str(procPath), ['Baseline'], ['Sham']) == [str(procPath / 'Baseline' / 'Sham' / 'Study1')]
+    assert rawIndex.subjectFolders(database, str(procPath)) == [str(procPath / 'Baseline' / 'Sham' / 'Study1'),
+                                                                str(procPath / 'Baseline' / 'Stroke' / 'Study2'),
+                                                                str(procPath / 'P7' / 'Sham' / 'Study1')]
+
+    monkeypatch.setattr(sys, 'argv', ['batchProc.py', '-f', str(procPath), '-g', 'Sham', 'Stroke', '-d', 'Baseline',
+                                      '-t', 'T2w', '--index', '--plan'])
+    with pytest.raises(SystemExit) as exit:
+        runpy.run_path(os.path.join(binPath, 'batchProc.py'), run_name='__main__')
+    assert exit.value.code == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert str(procPath / 'Baseline' / 'Sham' / 'Study1') in lines
+    assert str(procPath / 'Baseline' / 'Stroke' / 'Study2') in lines
+    assert str(procPath / 'Baseline' / 'Sham' / 'Other') not in lines
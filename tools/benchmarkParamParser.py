@@ -0,0 +1,317 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Benchmark of the ParaVision parameter parsers. Writes acqp, method and
+visu_pars files of the size of a long rsfMRI scan (one orientation, position,
+slope and offset per frame) and parses them with the single-pass parsers of
+pv_parser and pv_parseBruker_md_np (parsePVFile, without the parameter cache)
+and with the previous implementations, which are kept below as reference. Both
+must return the same parameters. The cached reading parsePV is timed
+separately: cold (empty cache, the file is parsed and stored), from the cache
+folder (a new process) and from the in-process cache.
+
+    python benchmarkParamParser.py -f 6000 -r 5
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import collections
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', '1_PV2NIfTiConverter'))
+import pv_parser
+import pv_parseBruker_md_np
+
+
+def legacyParsePV(filename):
+    # pv_parseBruker_md_np.parsePV before the single-pass tokenizer
+    f = open(filename, 'r')
+    lines = f.readlines()
+    f.close()
+    params = {}
+    if 'visu_pars' in filename:
+        tmp = lines[6].split('/')
+        params['studyname'] = [[], tmp[-5]]
+        params['expno'] = [[], tmp[-4]]
+        params['procno'] = [[], tmp[-2]]
+    remove = []
+    for index, line in enumerate(lines):
+        if line[0:2] == '$$':
+            remove.append(index)
+    for offset, index in enumerate(remove):
+        del lines[index-offset]
+    lines = ''.join(lines).split('\n##')
+    lines[0] = lines[0].lstrip('##')
+    for index, line in enumerate(lines):
+        lines[index] = ''.join(line.split('\n'))
+    if 'subject' in filename:
+        tmp = lines[32].split('#$Name,')
+        params['coilname'] = tmp[1].split('#$Id')[0]
+        return params
+    for line in lines:
+        line = line.split('=', 1)
+        if line[0][0] == '$':
+            key = line[0].lstrip('$')
+            dataset = line[1]
+            params[key] = []
+            pos = 0
+            if (len(dataset) > 4) and (dataset[0:2] == '( '):
+                pos = dataset.find(' )', 2)
+                if pos > 2:
+                    pardim = [int(dim) for dim in dataset[2:pos].split(',')]
+                    params[key].append(pardim)
+                    params[key].append(dataset[pos+2:])
+            if pos <= 2:
+                params[key].append([])
+                params[key].append(dataset)
+    for key in params.keys():
+        pardim = params[key][0]
+        parval = params[key][1]
+        if (len(pardim) > 0) and (len(parval) > 0) and (parval[0] == '<'):
+            params[key][1] = parval.replace('<', '"').replace('>', '"')
+        elif (len(parval) > 0) and (parval[0] == '('):
+            params[key][1] = parval.replace('<', '"').replace('>', '"')
+        params[key] = params[key][1]
+    return params
+
+def legacyCheckArrayList(values):
+    # pv_parser.check_array_list 1.0.2
+    flagInt = True
+    flagFloat = True
+    for value in values:
+        if flagInt:
+            try:
+                value = int(value)
+            except ValueError:
+                flagInt = False
+            else:
+                continue
+        try:
+            value = float(value)
+        except ValueError:
+            flagFloat = False
+            break
+    if flagInt:
+        return np.array(values, dtype=np.int32)
+    if flagFloat:
+        return np.array(values, dtype=np.float64)
+    return np.array(values, dtype=object)
+
+def legacyGetArrayValues(label, sizes, data):
+    # pv_parser.get_array_values 1.0.2
+    if data.startswith('<'):
+        values = re.findall(r'<.*?>', data)
+        if len(sizes) > 1:
+            values = np.array(values, dtype=object)
+            if np.prod(sizes[:-1]) == values.size:
+                values = values.reshape(sizes[:-1])
+        elif len(values) == 1:
+            values = values[0]
+    elif data.startswith('('):
+        data, strList = pv_parser.replace_jcamp_strings(data)
+        values, restored = pv_parser.parse_struct(data, strList)
+    else:
+        values = re.findall(r'[^\s]+', data)
+        values = np.reshape(legacyCheckArrayList(values), sizes)
+    return values
+
+def legacyReadParamFile(filename):
+    # pv_parser.read_param_file 1.0.2 (regex per LDR, header and parameters in two loops)
+    fid = open(filename, 'r')
+    header = collections.OrderedDict()
+    line = ''
+    for index, line in enumerate(fid):
+        line = line.lstrip(' \t').rstrip('\r\n')
+        if line.startswith('##$'):
+            break
+        if line.startswith('##') or line.startswith('$$'):
+            pv_parser.read_header_line(header, index, line)
+    params = collections.OrderedDict()
+    label = None
+    while line.lstrip(' \t').startswith('##'):
+        result = re.search(r'##(.*)=(.*)', line)
+        result = [] if result is None else list(result.groups())
+        label = result[0] if len(result) > 0 else None
+        if (label is not None) and label.startswith('$'):
+            label = label[1:]
+        value = result[1] if len(result) > 1 else ''
+        line = ''
+        data = []
+        for line in fid:
+            if line.lstrip(' \t').startswith('##'):
+                break
+            if not line.lstrip(' \t').startswith('$$'):
+                data.append(line.rstrip('\r\n'))
+        data = ''.join(data)
+        if (label is None) or (label == 'END'):
+            break
+        if value.startswith('( <'):
+            pass
+        elif value.startswith('( '):
+            sizes = [int(x) for x in value.strip('( )').split(',')]
+            params[label] = legacyGetArrayValues(label, sizes, data)
+        elif value.startswith('('):
+            data = ''.join([value, data])
+            params[label] = legacyGetArrayValues(label, [1], data)[0]
+        else:
+            try:
+                params[label] = int(value)
+            except ValueError:
+                try:
+                    params[label] = float(value)
+                except ValueError:
+                    params[label] = value
+    fid.close()
+    return (header, params)
+
+
+def wrapValues(values, width=72):
+    # JCAMP data lines of at most width characters, the separating blank stays at the line end
+    lines = []
+    line = ''
+    for value in values:
+        if len(line) + len(value) > width:
+            lines.append(line)
+            line = ''
+        line += value + ' '
+    lines.append(line)
+    return '\n'.join(lines)
+
+def writeParamFile(path, name, ldrs):
+    # JCAMP-DX parameter file as written by ParaVision 6
+    lines = ['##TITLE=Parameter List', '##JCAMPDX=4.24', '##DATATYPE=Parameter Values',
+             '##ORIGIN=Bruker BioSpin MRI GmbH', '##OWNER=nmrsu',
+             '$$ Mon Oct 18 12:00:00 2026 CEST (UT+2h)  nmrsu',
+             '$$ /opt/PV6.0.1/data/nmrsu/nmr/Bench.Study/5/pdata/1/%s' % (name,)]
+    for label, sizes, data in ldrs:
+        if sizes is None:
+            lines.append('##$%s=%s' % (label, data))
+        else:
+            lines.append('##$%s=( %s )' % (label, ', '.join(str(x) for x in sizes)))
+            lines.append(data)
+    lines.append('##END=')
+    with open(os.path.join(path, name), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def writeScan(path, frames, slices=16):
+    # acqp, method and visu_pars of an EPI time series with frames frames
+    rng = np.random.default_rng(0)
+    reps = max(1, frames // slices)
+    frames = reps * slices
+    number = lambda x: ['%.6g' % v for v in x]
+    visu = [('VisuVersion', None, '3'),
+            ('VisuCoreFrameCount', None, str(frames)),
+            ('VisuCoreDim', None, '2'),
+            ('VisuCoreSize', [2], '64 64'),
+            ('VisuCoreDimDesc', [2], 'spatial spatial'),
+            ('VisuCoreExtent', [2], '19.2 19.2'),
+            ('VisuCoreFrameThickness', [1], '0.5'),
+            ('VisuCoreUnits', [2, 65], '<mm> <mm>'),
+            ('VisuCoreFrameType', [frames], wrapValues(['MAGNITUDE_IMAGE'] * frames)),
+            ('VisuCoreWordType', None, '_16BIT_SGN_INT'),
+            ('VisuCoreByteOrder', None, 'littleEndian'),
+            ('VisuCoreDataMin', [frames], wrapValues(number(rng.uniform(-10, 0, frames)))),
+            ('VisuCoreDataMax', [frames], wrapValues(number(rng.uniform(1e3, 1e4, frames)))),
+            ('VisuCoreDataOffs', [frames], wrapValues(['0'] * frames)),
+            ('VisuCoreDataSlope', [frames], wrapValues(number(rng.uniform(0.1, 1, frames)))),
+            ('VisuCoreOrientation', [frames, 9], wrapValues(['1', '0', '0', '0', '1', '0', '0', '0', '1'] * frames)),
+            ('VisuCorePosition', [frames, 3], wrapValues(number(np.tile([-9.6, -9.6, 0.0], frames) +
+                                                                 np.repeat(np.arange(frames) % slices * 0.5, 3) * np.tile([0, 0, 1], frames)))),
+            ('VisuFGOrderDescDim', None, '2'),
+            ('VisuFGOrderDesc', [2], '(%d, <FG_SLICE>, <>, 0, 2) (%d, <FG_CYCLE>, <>, 2, 1)' % (slices, reps)),
+            ('VisuGroupDepVals', [2], '(<VisuCoreOrientation>, 0) (<VisuCorePosition>, 0)'),
+            ('VisuAcqEchoTime', [1], '16'),
+            ('VisuAcqRepetitionTime', [1], '2000'),
+            ('VisuCoreSlicePacksSliceDist', [1], '0.5'),
+            ('VisuAcqSequenceName', [64], '<Bruker:EPI>')]
+    writeParamFile(path, 'visu_pars', visu)
+    acqp = [('ACQ_protocol_name', [64], '<06_T2star_EPI_fMRI>'),
+            ('ACQ_slice_sepn', [1], '0.5'),
+            ('ACQ_obj_order', [slices], wrapValues(str(x) for x in range(slices))),
+            ('ACQ_slice_offset', [slices], wrapValues(number(np.arange(slices) * 0.5))),
+            ('NR', None, str(reps)),
+            ('ACQ_time_points', [reps], wrapValues(number(np.arange(reps) * 2000.0)))]
+    writeParamFile(path, 'acqp', acqp)
+    method = [('Method', None, '<Bruker:EPI>'),
+              ('PVM_SPackArrSliceDistance', [1], '0.5'),
+              ('PVM_EncSteps1', [64], wrapValues(str(x) for x in range(-32, 32))),
+              ('PVM_NRepetitions', None, str(reps))]
+    writeParamFile(path, 'method', method)
+    return frames
+
+def sameValue(a, b):
+    # Equal parameters including the NumPy data type
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.dtype == b.dtype and np.array_equal(a, b)
+    return type(a) == type(b) and a == b
+
+def timeIt(function, filename, repeats, prepare=None):
+    # Best time of repeats calls, prepare is called before each of them
+    best = float('inf')
+    for _ in range(repeats):
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        result = function(filename)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the ParaVision parameter parsers')
+    parser.add_argument('-f', '--frames', help='number of frames of the scan (slices x repetitions) - default: 6000',
+                        type=int, default=6000)
+    parser.add_argument('-r', '--repeats', help='number of runs per parser, the fastest counts - default: 5',
+                        type=int, default=5)
+    parser.add_argument('-o', '--output', help='folder for the parameter files (default: temporary folder)', default=None)
+    args = parser.parse_args()
+
+    folder = args.output or tempfile.mkdtemp(prefix='paramBench_')
+    os.makedirs(folder, exist_ok=True)
+    # a cache folder of its own, the cache of the user is not touched
+    cacheFolder = os.path.join(folder, 'cache')
+    os.environ['AIDA_PARAM_CACHE'] = cacheFolder
+    clearMemory = lambda: pv_parser.cache_entries.clear()
+    clearAll = lambda: (clearMemory(), shutil.rmtree(cacheFolder, ignore_errors=True))
+    try:
+        frames = writeScan(folder, args.frames)
+        print('Scan with %d frames' % (frames,))
+        print('%-10s %9s %14s %14s %8s %14s %14s %8s' % ('File', 'Size [kB]', 'parsePVFile [ms]', 'legacy [ms]', 'Same',
+                                                        'pv_parser [ms]', 'legacy [ms]', 'Same'))
+        allSame = True
+        cacheTimes = []
+        for name in ('acqp', 'method', 'visu_pars'):
+            path = os.path.join(folder, name)
+            newTime, newParams = timeIt(pv_parseBruker_md_np.parsePVFile, path, args.repeats)
+            oldTime, oldParams = timeIt(legacyParsePV, path, args.repeats)
+            sameLegacy = newParams == oldParams and list(newParams) == list(oldParams)
+            newTypedTime, (newHeader, newTyped) = timeIt(pv_parser.read_param_file, path, args.repeats)
+            oldTypedTime, (oldHeader, oldTyped) = timeIt(legacyReadParamFile, path, args.repeats)
+            sameTyped = (list(newHeader.items()) == list(oldHeader.items()) and list(newTyped) == list(oldTyped) and
+                         all(sameValue(newTyped[key], oldTyped[key]) for key in newTyped))
+            allSame = allSame and sameLegacy and sameTyped
+            coldTime, cachedParams = timeIt(pv_parseBruker_md_np.parsePV, path, args.repeats, clearAll)
+            diskTime, cachedParams = timeIt(pv_parseBruker_md_np.parsePV, path, args.repeats, clearMemory)
+            memoryTime, cachedParams = timeIt(pv_parseBruker_md_np.parsePV, path, args.repeats)
+            allSame = allSame and cachedParams == newParams
+            cacheTimes.append((name, coldTime, diskTime, memoryTime))
+            print('%-10s %9.1f %14.2f %14.2f %8s %14.2f %14.2f %8s' % (name, os.path.getsize(path) / 1024.0,
+                  1000 * newTime, 1000 * oldTime, sameLegacy, 1000 * newTypedTime, 1000 * oldTypedTime, sameTyped))
+        print('')
+        print('%-10s %14s %14s %14s' % ('parsePV', 'cold [ms]', 'folder [ms]', 'memory [ms]'))
+        for name, coldTime, diskTime, memoryTime in cacheTimes:
+            print('%-10s %14.2f %14.2f %14.2f' % (name, 1000 * coldTime, 1000 * diskTime, 1000 * memoryTime))
+        if not allSame:
+            sys.exit("Error: The parsers return different parameters.")
+    finally:
+        if args.output is None:
+            shutil.rmtree(folder, ignore_errors=True)
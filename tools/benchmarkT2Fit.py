@@ -0,0 +1,93 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Benchmark of the T2 fits of P2_IDLt2_mapping. Simulates multi echo decay
+curves with known T2 and S0 plus noise and fits them with the batched solver
+mpfitbatch (all voxels at once, as t2_fitmonoexp1/2 do per slice) and with
+the per voxel lmfit fit mpfitfun, which is the reference. Reports the fitted
+voxels per second of both and how far the batched results are from lmfit.
+The closed form estimate t2_loglinear, which also gives the start values of
+the batched fit, and the dictionary matching t2_dictmatch are listed as well.
+
+    python benchmarkT2Fit.py -n 65536 -l 500
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', '1_PV2NIfTiConverter'))
+import P2_IDLt2_mapping
+
+
+def simulate(voxels, echoTimes, model, snr, seed=0):
+    # decay curves with T2 between 20 and 90 ms (the T2_3p fit is bounded at 70 ms),
+    # magnitude data with Gaussian noise of S0 / snr on both channels
+    rng = np.random.default_rng(seed)
+    T2 = rng.uniform(20, 90, voxels)
+    S0 = rng.uniform(500, 3000, voxels)
+    signal = S0[:, None] * np.exp(-echoTimes / T2[:, None])
+    if 'T2_3p' in model:
+        signal += 0.05 * S0[:, None]
+    sigma = (S0 / snr)[:, None]
+    real = signal + rng.normal(0, 1, signal.shape) * sigma
+    imag = rng.normal(0, 1, signal.shape) * sigma
+    return np.sqrt(real ** 2 + imag ** 2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the batched T2 fit against the lmfit fit of P2_IDLt2_mapping')
+    parser.add_argument('-n', '--voxels', help='number of fitted voxels (a 256x256 slice) - default: 65536',
+                        type=int, default=65536)
+    parser.add_argument('-l', '--lmfitVoxels', help='number of voxels also fitted with lmfit - default: 500',
+                        type=int, default=500)
+    parser.add_argument('-e', '--echoes', help='number of echoes - default: 16', type=int, default=16)
+    parser.add_argument('-t', '--echoSpacing', help='echo spacing in ms - default: 10', type=float, default=10.0)
+    parser.add_argument('-s', '--snr', help='SNR of the first echo - default: 50', type=float, default=50.0)
+    parser.add_argument('-d', '--dictStep', help='T2 step of the dictionary in ms - default: 0.5', type=float, default=0.5)
+    parser.add_argument('-u', '--upLim', help='upper limit of T2 of the T2_2p fit - default: 100', type=int, default=100)
+    args = parser.parse_args()
+
+    echoTimes = np.arange(1, args.echoes + 1) * args.echoSpacing
+    lmfitVoxels = min(args.lmfitVoxels, args.voxels)
+    print('%d voxels, %d echoes (TE %s - %s ms), SNR %.0f' % (args.voxels, args.echoes, echoTimes[0], echoTimes[-1], args.snr))
+    print('%-6s %14s %14s %8s %14s %14s %10s' % ('Model', 'batch [vox/s]', 'lmfit [vox/s]', 'Speedup',
+                                                 'median dT2', 'max dT2', 'Converged'))
+    for model in ('T2_2p', 'T2_3p'):
+        data = simulate(args.voxels, echoTimes, model, args.snr)
+
+        start = time.perf_counter()
+        offset = data[:, -1:] if 'T2_3p' in model else 0
+        logLinear = P2_IDLt2_mapping.t2_loglinear(data - offset, echoTimes, args.upLim if 'T2_2p' in model else 70)
+        batch = P2_IDLt2_mapping.mpfitbatch(data, echoTimes, model, args.upLim, start=logLinear)
+        batchRate = args.voxels / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        reference = np.array([P2_IDLt2_mapping.mpfitfun(y, echoTimes, model, args.upLim)['T2'].value
+                              for y in data[:lmfitVoxels]])
+        lmfitRate = lmfitVoxels / (time.perf_counter() - start)
+
+        # absolute T2 difference to lmfit in ms
+        difference = np.abs(batch['T2'][:lmfitVoxels] - reference)
+        print('%-6s %14.0f %14.0f %8.1f %14.2e %14.2e %9.1f%%' % (model, batchRate, lmfitRate, batchRate / lmfitRate,
+              np.median(difference), np.max(difference), 100.0 * np.mean(batch['converged'])))
+
+    # the estimates without fit are compared on T2_2p data
+    data = simulate(args.voxels, echoTimes, 'T2_2p', args.snr)
+    reference = np.array([P2_IDLt2_mapping.mpfitfun(y, echoTimes, 'T2_2p', args.upLim)['T2'].value
+                          for y in data[:lmfitVoxels]])
+    # the dictionary is calculated before the timing, as it is once per echo times
+    P2_IDLt2_mapping.t2_dictionary(echoTimes, args.upLim, args.dictStep, False)
+    for name, estimate in (('loglin', lambda: P2_IDLt2_mapping.t2_loglinear(data, echoTimes, args.upLim)),
+                           ('dict', lambda: P2_IDLt2_mapping.t2_dictmatch(data, echoTimes, args.upLim, args.dictStep, False))):
+        start = time.perf_counter()
+        result = estimate()
+        rate = args.voxels / (time.perf_counter() - start)
+        difference = np.abs(result['T2'][:lmfitVoxels] - reference)
+        print('%-6s %14.0f %14s %8s %14.2e %14.2e' % (name, rate, '-', '-', np.median(difference), np.max(difference)))
@@ -0,0 +1,106 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Benchmark of getT2mapping of P2_IDLt2_mapping on a synthetic MSME scan
+(msmePhantom.py) with known T2 values and Rician noise. The scan is converted
+once with pv_conv2Nifti, then mapped with every T2 estimator and SNR method.
+Reports the time and the voxels per second of each mapping, the share of
+phantom and air voxels that got a T2 and the bias of the T2 values, overall
+and relative for each T2 value of the phantom.
+
+The SNR maps of calcSNR (ReferenceMethods) divide the noise estimate by 10, so
+the Rician noise of the air gets an SNR of about 12. With the snrLim of the
+converter (1.5) the air is fitted as well; the benchmark therefore uses
+snrLim 18, which rejects the air, and at a low SNR (e.g. -s 8) the SNR methods
+keep different parts of the phantom.
+
+    python benchmarkT2Mapping.py -s 50 -w 4
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', '1_PV2NIfTiConverter'))
+import pv_conv2Nifti
+import P2_IDLt2_mapping
+import msmePhantom
+
+estimators = ('fit', 'loglinear', 'dictionary')
+snrMethods = ('Brummer', 'Chang', 'Sijbers')
+
+def convertPhantom(truth):
+    # NIfTI file of the phantom scan, as convertScan writes it
+    studyPath = truth['path']
+    study = os.path.basename(studyPath)
+    img = pv_conv2Nifti.Bruker2Nifti(study, truth['expno'], '1', os.path.dirname(studyPath), studyPath)
+    img.read_2dseq()
+    return img.save_nifti()
+
+def compare(mapPath, scan, truth):
+    # T2 map against the true T2 of the phantom, which is oriented like the map
+    T2 = nib.load(mapPath).dataobj[..., 0]
+    trueT2 = np.asarray(nib.as_closest_canonical(nib.Nifti1Image(truth['T2'], scan.affine)).dataobj)
+    phantom = trueT2 > 0
+    fitted = phantom & (T2 > 0)
+    difference = T2[fitted] - trueT2[fitted]
+    relative = [100.0 * np.mean(T2[fitted & (trueT2 == t2)] / t2 - 1) if np.any(fitted & (trueT2 == t2)) else np.nan
+                for t2 in np.unique(trueT2[phantom])]
+    return {'phantom': 100.0 * np.mean(T2[phantom] > 0), 'air': 100.0 * np.mean(T2[~phantom] > 0),
+            'bias': np.mean(difference) if difference.size > 0 else np.nan,
+            'mae': np.median(np.abs(difference)) if difference.size > 0 else np.nan, 'relative': relative}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the T2 estimators and SNR methods of getT2mapping on a synthetic MSME scan')
+    parser.add_argument('-o', '--output', help='folder of the phantom, which is kept (default: a temporary folder)', default=None)
+    parser.add_argument('-n', '--size', help='matrix size of a slice - default: 64', type=int, default=64)
+    parser.add_argument('-z', '--slices', help='number of slices - default: 3', type=int, default=3)
+    parser.add_argument('-e', '--echoes', help='number of echoes - default: 16', type=int, default=16)
+    parser.add_argument('-d', '--echoSpacing', help='echo spacing in ms - default: 10', type=float, default=10.0)
+    parser.add_argument('-t', '--t2Values', help='T2 values of the phantom in ms - default: 25 35 45 60 80',
+                        nargs='+', type=float, default=[25, 35, 45, 60, 80])
+    parser.add_argument('-s', '--snr', help='S0 divided by the noise standard deviation - default: 50', type=float, default=50.0)
+    parser.add_argument('-f', '--model', help='T2_2p (default) or T2_3p', type=str, default='T2_2p', choices=['T2_2p', 'T2_3p'])
+    parser.add_argument('-u', '--upLim', help='upper limit of T2 - default: 100', type=int, default=100)
+    parser.add_argument('-l', '--snrLim', help='SNR limit of the fitted voxels (calcSNR scale, noise about 12) - default: 18', type=float, default=18.0)
+    parser.add_argument('-w', '--workers', help='number of processes fitting the slices - default: 1', type=int, default=1)
+    args = parser.parse_args()
+
+    tempFolder = tempfile.TemporaryDirectory(prefix='benchmarkT2Mapping') if args.output is None else None
+    folder = args.output if args.output is not None else tempFolder.name
+    truth = msmePhantom.writePhantom(folder, size=args.size, slices=args.slices, echoes=args.echoes,
+                                     echoSpacing=args.echoSpacing, t2Values=args.t2Values, snr=args.snr)
+    scanPath = convertPhantom(truth)
+    scan = nib.load(scanPath)
+    mapPath = os.path.join(os.path.dirname(scanPath), os.path.basename(scanPath).split('.')[0] + 'T2Map' + args.model + '.nii.gz')
+
+    rows = []
+    for estimator in estimators:
+        for snrMethod in snrMethods:
+            start = time.perf_counter()
+            P2_IDLt2_mapping.getT2mapping(scanPath, args.model, args.upLim, args.snrLim, snrMethod, truth['echoTime'],
+                                          estimator, workers=args.workers)
+            seconds = time.perf_counter() - start
+            rows.append((estimator, snrMethod, seconds, compare(mapPath, scan, truth)))
+
+    print('')
+    print('%dx%dx%d voxels, %d echoes (TE %g - %g ms), SNR %g, snrLim %g, %s, %d worker(s)' % (args.size, args.size, args.slices,
+          args.echoes, truth['echoTime'][0], truth['echoTime'][-1], args.snr, args.snrLim, args.model, args.workers))
+    print('%-10s %-8s %8s %11s %11s %8s %10s %10s  %s' % ('Estimator', 'SNR', 'Time [s]', 'Voxels/s', 'Phantom [%]',
+          'Air [%]', 'Bias [ms]', 'MAE [ms]', 'Bias at T2 ' + ' '.join('%g' % (t2,) for t2 in sorted(set(args.t2Values))) + ' [%]'))
+    voxels = args.size * args.size * args.slices
+    for estimator, snrMethod, seconds, result in rows:
+        print('%-10s %-8s %8.2f %11.0f %11.1f %8.1f %10.2f %10.2f  %s' % (estimator, snrMethod, seconds, voxels / seconds,
+              result['phantom'], result['air'], result['bias'], result['mae'],
+              ' '.join('%+.1f' % (value,) for value in result['relative'])))
+    if tempFolder is not None:
+        tempFolder.cleanup()
@@ -0,0 +1,146 @@
+"""
+Created on 18/10/2026
+
+AG Neuroimaging and Neuroengineering of Experimental Stroke
+Department of Neurology, University Hospital Cologne
+
+Synthetic multi slice multi echo (MSME) scan in the ParaVision raw data
+layout (study/subject, study/expno/acqp, method, pdata/1/2dseq, visu_pars) as
+read by pv_conv2Nifti.py. Each slice holds a disk of sectors with known T2
+values in air; the magnitude signal S0 * exp(-TE / T2) gets Rician noise of
+standard deviation S0 / snr. The ground truth is returned by writePhantom and
+is stored in truth.npz next to the study folder.
+
+    python msmePhantom.py -o /tmp -s 50 -t 25 40 60 80
+"""
+
+import os
+import sys
+import tempfile
+import argparse
+
+import numpy as np
+
+# the parameters of a subject file, pv_parseBruker_md_np reads the coil from
+# the record after them
+subjectParams = ['SUBJECT_version_nr', 'SUBJECT_name_string', 'SUBJECT_id', 'SUBJECT_instance_uid',
+                 'SUBJECT_dbase_type', 'SUBJECT_type', 'SUBJECT_sex', 'SUBJECT_birth_date', 'SUBJECT_weight',
+                 'SUBJECT_height', 'SUBJECT_remarks', 'SUBJECT_entry', 'SUBJECT_position', 'SUBJECT_date',
+                 'SUBJECT_abs_date', 'SUBJECT_study_name', 'SUBJECT_study_nr', 'SUBJECT_study_instance_uid',
+                 'SUBJECT_study_date', 'SUBJECT_study_abs_date', 'SUBJECT_purpose', 'SUBJECT_referral',
+                 'SUBJECT_study_comment', 'SUBJECT_weight_unit', 'SUBJECT_height_unit', 'SUBJECT_institution',
+                 'SUBJECT_station']
+
+def writeJcamp(path, records, pathComment):
+    # JCAMP-DX parameter file, records are (name, value) or (name, (dims, value))
+    lines = ['##TITLE=Parameter List', '##JCAMPDX=4.24', '##DATATYPE=Parameter Values',
+             '##ORIGIN=Bruker BioSpin MRI GmbH', '##OWNER=nmrsu',
+             '$$ Sun Oct 18 12:00:00 2026 CEST (UT+2h) nmrsu', '$$ ' + pathComment]
+    for name, value in records:
+        if isinstance(value, tuple):
+            lines.append('##$%s=( %s )' % (name, ', '.join(str(dim) for dim in value[0])))
+            lines.append(value[1])
+        else:
+            lines.append('##$%s=%s' % (name, value))
+    lines.append('##END=')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def phantomMaps(size, slices, t2Values, s0):
+    # T2 and S0 maps (size x size x slices): a disk of equal sectors, one per T2
+    # value, turned by one sector from slice to slice
+    y, x = np.mgrid[0:size, 0:size] - (size - 1) / 2.0
+    disk = np.hypot(x, y) < 0.4 * size
+    sector = (np.floor((np.arctan2(y, x) + np.pi) / (2 * np.pi) * len(t2Values)).astype(int)) % len(t2Values)
+    T2 = np.zeros((size, size, slices))
+    for slc in range(slices):
+        T2[:, :, slc] = np.where(disk, np.asarray(t2Values, dtype=float)[(sector + slc) % len(t2Values)], 0)
+    S0 = np.where(T2 > 0, float(s0), 0)
+    return T2, S0
+
+def writePhantom(folder=None, study='Phantom', expno=1, size=64, slices=3, echoes=16, echoSpacing=10.0,
+                 t2Values=(25, 35, 45, 60, 80), s0=2000.0, snr=50.0, seed=0):
+    """
+    Writes the MSME scan expno of study into folder (a new temporary folder if
+    None) and returns the ground truth: the study folder 'path', 'expno', the
+    echo times 'echoTime' in ms, and the maps 'T2', 'S0' and 'mask' of the
+    phantom (size x size x slices).
+    """
+    if folder is None:
+        folder = tempfile.mkdtemp(prefix='msmePhantom')
+    if snr <= 0 or echoes < 4:
+        sys.exit("Error: The phantom needs a positive SNR and at least 4 echoes.")
+    studyPath = os.path.join(folder, study)
+    scanPath = os.path.join(studyPath, str(expno))
+    procPath = os.path.join(scanPath, 'pdata', '1')
+    os.makedirs(procPath, exist_ok=True)
+    rawComment = '/opt/PV6.0.1/data/nmrsu/nmr/%s/%d' % (study, expno)
+
+    echoTime = echoSpacing * np.arange(1, echoes + 1)
+    T2, S0 = phantomMaps(size, slices, t2Values, s0)
+
+    # magnitude of the signal with complex Gaussian noise (Rician noise), in the
+    # frame order of the visu_pars below: echoes first, then slices
+    rng = np.random.default_rng(seed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        signal = S0[:, :, None, :] * np.exp(-echoTime[None, None, :, None] / T2[:, :, None, :])
+    signal = np.nan_to_num(signal)
+    sigma = s0 / snr
+    real = signal + rng.normal(0, sigma, signal.shape)
+    imag = rng.normal(0, sigma, signal.shape)
+    data = np.clip(np.round(np.sqrt(real ** 2 + imag ** 2)), 0, np.iinfo(np.int16).max).astype('<i2')
+    data.reshape(-1, order='F').tofile(os.path.join(procPath, '2dseq'))
+
+    frames = echoes * slices
+    extent = 0.1 * size
+    positions = ' '.join('%g %g %g' % (-extent / 2, -extent / 2, 0.7 * slc) for slc in range(slices) for echo in range(echoes))
+    teList = ' '.join('%g' % (te,) for te in echoTime)
+    writeJcamp(os.path.join(studyPath, 'subject'),
+               [(name, '<>') for name in subjectParams] + [('SUBJECT_coil', '<#$Name,1H_Phantom#$Id,1>')],
+               '/opt/PV6.0.1/data/nmrsu/nmr/%s/subject' % (study,))
+    writeJcamp(os.path.join(scanPath, 'acqp'),
+               [('ACQ_protocol_name', ((64,), '<T2_MSME_Phantom>')), ('ACQ_slice_sepn', ((1,), '0.7')),
+                ('NECHOES', str(echoes))],
+               rawComment + '/acqp')
+    writeJcamp(os.path.join(scanPath, 'method'),
+               [('Method', '<Bruker:MSME>'), ('PVM_EchoTime', '%g' % (echoSpacing,)),
+                ('PVM_NEchoImages', str(echoes)), ('EffectiveTE', ((echoes,), teList)),
+                ('PVM_SPackArrSliceDistance', ((1,), '0.7'))],
+               rawComment + '/method')
+    writeJcamp(os.path.join(procPath, 'visu_pars'),
+               [('VisuCoreDim', '2'), ('VisuCoreSize', ((2,), '%d %d' % (size, size))),
+                ('VisuCoreDimDesc', ((2,), 'spatial spatial')), ('VisuCoreExtent', ((2,), '%g %g' % (extent, extent))),
+                ('VisuCoreFrameThickness', ((1,), '0.5')), ('VisuCoreUnits', ((2, 65), '<mm> <mm>')),
+                ('VisuCoreWordType', '_16BIT_SGN_INT'), ('VisuCoreByteOrder', 'littleEndian'),
+                ('VisuCoreDataSlope', ((frames,), ' '.join(['1'] * frames))),
+                ('VisuCoreDataOffs', ((frames,), ' '.join(['0'] * frames))),
+                ('VisuCoreOrientation', ((frames, 9), ' '.join(['1 0 0 0 1 0 0 0 1'] * frames))),
+                ('VisuCorePosition', ((frames, 3), positions)),
+                ('VisuAcqRepetitionTime', ((1,), '2500')), ('VisuAcqEchoTime', ((echoes,), teList)),
+                ('VisuCoreSlicePacksSliceDist', ((1,), '0.7')), ('VisuFGOrderDescDim', '2'),
+                ('VisuFGOrderDesc', ((2,), '(%d, <FG_ECHO>, <>, 0, 1) (%d, <FG_SLICE>, <>, 1, 2)' % (echoes, slices)))],
+               rawComment + '/pdata/1/visu_pars')
+
+    truth = {'path': studyPath, 'expno': str(expno), 'echoTime': echoTime, 'T2': T2, 'S0': S0, 'mask': T2 > 0}
+    np.savez(os.path.join(folder, 'truth.npz'), echoTime=echoTime, T2=T2, S0=S0)
+    return truth
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Synthetic MSME scan with known T2 values in the ParaVision raw data layout')
+    parser.add_argument('-o', '--output', help='folder of the study (default: a new temporary folder)', default=None)
+    parser.add_argument('-n', '--size', help='matrix size of a slice - default: 64', type=int, default=64)
+    parser.add_argument('-z', '--slices', help='number of slices - default: 3', type=int, default=3)
+    parser.add_argument('-e', '--echoes', help='number of echoes - default: 16', type=int, default=16)
+    parser.add_argument('-d', '--echoSpacing', help='echo spacing in ms - default: 10', type=float, default=10.0)
+    parser.add_argument('-t', '--t2Values', help='T2 values of the sectors in ms - default: 25 35 45 60 80',
+                        nargs='+', type=float, default=[25, 35, 45, 60, 80])
+    parser.add_argument('-a', '--s0', help='signal at TE = 0 - default: 2000', type=float, default=2000.0)
+    parser.add_argument('-s', '--snr', help='S0 divided by the noise standard deviation - default: 50', type=float, default=50.0)
+    parser.add_argument('-r', '--seed', help='seed of the noise - default: 0', type=int, default=0)
+    args = parser.parse_args()
+
+    truth = writePhantom(args.output, size=args.size, slices=args.slices, echoes=args.echoes, echoSpacing=args.echoSpacing,
+                         t2Values=args.t2Values, s0=args.s0, snr=args.snr, seed=args.seed)
+    print('Phantom scan %s/%s (T2 %s ms, SNR %g)' % (truth['path'], truth['expno'],
+          ' '.join('%g' % (t2,) for t2 in args.t2Values), args.snr))